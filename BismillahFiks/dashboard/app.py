@@ -11,10 +11,15 @@ import os
 from dotenv import load_dotenv
 import queue 
 import threading 
+import logging
+import bmkg_codec
+from bmkg_eventqueue import CoalescingEventQueue
+from bmkg_hub import SubscriptionHub
+from bmkg_logging import setup_logging
 
 load_dotenv()
-
-mqtt_log_queue = queue.Queue()
+setup_logging()  # Idempoten: rerun Streamlit tidak memasang handler ganda
+log = logging.getLogger("bmkg.dashboard")
 
 APP_TITLE = os.getenv("APP_TITLE", "Live Prakiraan Cuaca BMKG via MQTT")
 AVAILABLE_ADM4_CODES_STR = os.getenv("AVAILABLE_ADM4_CODES_LIST", "")
@@ -35,18 +40,37 @@ STREAMLIT_USER = os.getenv("STREAMLIT_APP_USER", "admin")
 STREAMLIT_PASSWORD = os.getenv("STREAMLIT_APP_PASSWORD", "streamlit")
 REQUEST_TOPIC_TO_PUBLISHER = os.getenv("REQUEST_TOPIC_TO_PUBLISHER", "bmkg/control/request")
 _response_base_prefix_from_env = os.getenv("RESPONSE_TOPIC_APP_BASE_PREFIX", "streamlit_app/response")
-RESPONSE_TOPIC_APP_BASE = f"{_response_base_prefix_from_env}/{uuid.uuid4()}"
+# Publisher dengan DELTA_PUBLISHING=true mengirim periode yang berubah ke <topik>/delta
+DELTA_TOPIC_SUFFIX = os.getenv("DELTA_TOPIC_SUFFIX", "/delta")
+# Batas kerja process_mqtt_queue per rerun; sisa antrian diproses di rerun berikutnya
+DASHBOARD_DRAIN_BUDGET = int(os.getenv("DASHBOARD_DRAIN_BUDGET", 200))
+DASHBOARD_DRAIN_BUDGET_MS = float(os.getenv("DASHBOARD_DRAIN_BUDGET_MS", 100))
+# Panel cuaca dan pompa event di-refresh sebagai fragment, paling sering DASHBOARD_MAX_FPS kali per detik
+DASHBOARD_MAX_FPS = float(os.getenv("DASHBOARD_MAX_FPS", 2))
+DASHBOARD_REFRESH_SECONDS = 1 / max(DASHBOARD_MAX_FPS, 0.1)
+# Jumlah tabel prakiraan siap-tampil yang disimpan (per topik x versi payload)
+DASHBOARD_FRAME_CACHE_SIZE = int(os.getenv("DASHBOARD_FRAME_CACHE_SIZE", 500))
+FORECAST_SOURCE_COLUMNS = ["local_datetime", "weather_desc", "weather_desc_en", "t", "hu", "ws", "wd"]
+# Ringkasan wilayah dipaginasi; tabel prakiraan lengkap hanya dimuat untuk wilayah yang dibuka
+DASHBOARD_REGIONS_PER_PAGE = int(os.getenv("DASHBOARD_REGIONS_PER_PAGE", 25))
 
 def init_session_state():
     defaults = {
-        'mqtt_client': None, 'connected': False, 'subscribed_topics': set(), # Ini adalah set topik yang *ingin* disubscribe oleh UI
-        'weather_data': {}, 'pending_requests': {}, 'request_responses': {},
+        'hub_session_id': str(uuid.uuid4()), 'hub_attached': False, 'connected': False,
+        'subscribed_topics': set(), # Ini adalah set topik yang *ingin* disubscribe oleh UI
+        # Data prakiraan ada di latest-value store hub; sesi hanya menyimpan cursor (versi terakhir yang dilihat)
+        'hub_cursor': 0, 'weather_cleared': {},
+        'pending_requests': {}, 'request_responses': {},
+        'history_chunks': {}, 'history_series': {}, # Respons 'history' datang dalam beberapa chunk
         'app_log': [], 'authenticated': False, 'attempted_connect': False,
-        'login_error': None 
+        'login_error': None, 'drain_backlog': False
     }
     for key, value in defaults.items():
         if key not in st.session_state:
             st.session_state[key] = value
+    # Antrian event sesi (respons, status koneksi) dari hub; disimpan di session state karena script dieksekusi ulang setiap rerun
+    if 'mqtt_events' not in st.session_state:
+        st.session_state.mqtt_events = CoalescingEventQueue()
 
 init_session_state()
 
@@ -56,17 +80,11 @@ def log_to_streamlit_ui(message_text):
     st.session_state.app_log.insert(0, message_text)
     st.session_state.app_log = st.session_state.app_log[:50]
 
-def log_message_from_mqtt_thread(message):
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    full_log_message = f"[{timestamp}] (MQTT) {message}"
-    mqtt_log_queue.put(full_log_message)
-    print(f"Q_LOG: {full_log_message}")
-
 def log_message_from_main_thread(message):
     timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     full_log_message = f"[{timestamp}] (Main) {message}"
     log_to_streamlit_ui(full_log_message)
-    print(f"MAIN_LOG: {full_log_message}")
+    log.info("(Main) %s", message)
 
 def display_login_form():
     st.sidebar.subheader("Login Aplikasi")
@@ -83,46 +101,35 @@ def display_login_form():
                 st.session_state.login_error = "Username atau password salah."
     return False 
 
-# --- Fungsi Callback MQTT ---
-def on_connect_subscriber(client, userdata, flags, rc, properties=None):
-    if rc == 0:
-        log_message_from_mqtt_thread(f"Connected to MQTT Broker ({MQTT_BROKER_HOST}:{MQTT_PORT}, rc: {rc})!")
-        # Kirim status koneksi dan sinyal untuk resubscribe
-        mqtt_log_queue.put({'type': 'connection_status', 'status': True, 'rc': rc})
-        mqtt_log_queue.put({'type': 'resubscribe_topics_signal'}) # Sinyal untuk main thread
-        
-        # Subscribe ke topik response aplikasi tetap di sini karena ini adalah bagian dari setup koneksi client
-        app_specific_response_topic_filter = f"{RESPONSE_TOPIC_APP_BASE}/#"
-        client.subscribe(app_specific_response_topic_filter, qos=1)
-        log_message_from_mqtt_thread(f"Subscribed (by client) to app response topic: {app_specific_response_topic_filter}")
-    else:
-        log_message_from_mqtt_thread(f"Failed to connect, return code {rc}")
-        mqtt_log_queue.put({'type': 'connection_status', 'status': False, 'rc': rc})
-
-def on_message_subscriber(client, userdata, msg): # Tetap sama
-    topic = msg.topic
-    payload_bytes = msg.payload
-    log_message_from_mqtt_thread(f"Raw message received on {topic} (len: {len(payload_bytes)} B)")
-    message_data_for_queue = {
-        'type': 'mqtt_message', 'topic': topic, 'payload_bytes': payload_bytes,
-        'properties': {'CorrelationData': msg.properties.CorrelationData if msg.properties and hasattr(msg.properties, 'CorrelationData') else None}
-    }
-    mqtt_log_queue.put(message_data_for_queue)
-
-def on_disconnect_subscriber(client, userdata, rc, properties=None): # Tetap sama
-    log_message_from_mqtt_thread(f"Disconnected from MQTT Broker (rc: {rc}).")
-    mqtt_log_queue.put({'type': 'connection_status', 'status': False, 'rc': rc, 'event': 'disconnect'})
+# --- Koneksi MQTT bersama ---
+@st.cache_resource
+def get_hub():
+    # Satu koneksi broker per proses server, dipakai semua sesi browser (bukan satu client per sesi)
+    if USE_TLS and (not CA_CERT_PATH or not os.path.exists(CA_CERT_PATH)):
+        raise ValueError(f"CA_CERT_PATH '{CA_CERT_PATH}' is not valid")
+    return SubscriptionHub(
+        MQTT_BROKER_HOST, MQTT_PORT, f"{_response_base_prefix_from_env}/{uuid.uuid4()}",
+        tls_ca_certs=CA_CERT_PATH if USE_TLS else None,
+        delta_suffix=DELTA_TOPIC_SUFFIX, resync_topic=REQUEST_TOPIC_TO_PUBLISHER,
+    ).start()
 
 # --- Fungsi Proses Queue di Main Thread ---
 def process_mqtt_queue():
+    events = st.session_state.mqtt_events
+    for line in events.drain_logs():
+        log_to_streamlit_ui(line)
     rerun_needed_from_queue = False
-    while not mqtt_log_queue.empty():
+    st.session_state.drain_backlog = False
+    deadline = time.monotonic() + DASHBOARD_DRAIN_BUDGET_MS / 1000
+    for drained in range(DASHBOARD_DRAIN_BUDGET + 1):
+        if drained == DASHBOARD_DRAIN_BUDGET or time.monotonic() > deadline:
+            # Budget habis: sisa event menunggu rerun berikutnya supaya UI tidak tertahan drain
+            st.session_state.drain_backlog = len(events) > 0
+            break
         try:
-            item = mqtt_log_queue.get_nowait()
+            item = events.get_nowait()
             rerun_needed_from_queue = True 
-            if isinstance(item, str):
-                log_to_streamlit_ui(item)
-            elif isinstance(item, dict) and 'type' in item:
+            if isinstance(item, dict) and 'type' in item:
                 event_type = item['type']
 
                 if event_type == 'connection_status':
@@ -130,98 +137,95 @@ def process_mqtt_queue():
                     log_msg = f"(Main) Event: {'Connected' if item['status'] else 'Disconnected/Failed'} to MQTT (rc: {item.get('rc')})"
                     log_to_streamlit_ui(log_msg)
                 
-                elif event_type == 'resubscribe_topics_signal':
-                    if st.session_state.connected and st.session_state.mqtt_client:
-                        log_to_streamlit_ui("(Main) Received resubscribe signal. Resubscribing to topics...")
-                        # Akses st.session_state.subscribed_topics di sini (main thread)
-                        # Ini adalah daftar topik yang *diinginkan* oleh UI
-                        for topic_to_sub in list(st.session_state.subscribed_topics): 
-                            st.session_state.mqtt_client.subscribe(topic_to_sub, qos=2)
-                            log_to_streamlit_ui(f"(Main) Resubscribed (by main thread) to {topic_to_sub}")
-                    else:
-                        log_to_streamlit_ui("(Main) Received resubscribe signal, but not connected or client missing.")
-
                 elif event_type == 'mqtt_message':
                     topic, payload_bytes, properties = item['topic'], item['payload_bytes'], item['properties']
-                    try: payload_str = payload_bytes.decode()
-                    except UnicodeDecodeError:
-                        log_to_streamlit_ui(f"(Main) Error: Cannot decode payload from {topic} as UTF-8.")
-                        continue
-                    log_to_streamlit_ui(f"(Main) Processing message from {topic}")
+                    # Codec payload (JSON/MessagePack/zstd) mengikuti properti ContentType; tanpa ContentType = JSON
+                    payload_obj, decode_error = None, None
+                    try: payload_obj = bmkg_codec.decode(payload_bytes, properties.get('ContentType'))
+                    except ValueError as e: decode_error = str(e)
+                    log_to_streamlit_ui(f"(Main) Processing message from {topic} ({properties.get('ContentType') or 'application/json'})")
                     if topic.startswith(_response_base_prefix_from_env):
                         correlation_data_bytes = properties.get('CorrelationData')
                         correlation_data = None
                         if correlation_data_bytes:
                             try: correlation_data = correlation_data_bytes.decode()
                             except: correlation_data = str(correlation_data_bytes)
-                        if correlation_data and correlation_data in st.session_state.pending_requests:
+                        if correlation_data and correlation_data in st.session_state.pending_requests and isinstance(payload_obj, dict) and payload_obj.get('command') == 'history':
+                            # Kumpulkan chunk (CorrelationData sama) sampai lengkap, baru tampilkan deret waktunya
+                            parts = st.session_state.history_chunks.setdefault(correlation_data, {})
+                            parts[payload_obj.get('chunk', 0)] = payload_obj
+                            log_to_streamlit_ui(f"(Main) History chunk {len(parts)}/{payload_obj.get('chunks', 1)} for Correlation ID: {correlation_data}")
+                            if len(parts) < payload_obj.get('chunks', 1): continue
+                            del st.session_state.history_chunks[correlation_data]
+                            points = [point for index in sorted(parts) for point in parts[index].get('points', [])]
+                            if not payload_obj.get('error'): st.session_state.history_series[payload_obj.get('adm4')] = points
+                            st.session_state.request_responses[correlation_data] = dict(
+                                {key: value for key, value in payload_obj.items() if key not in ('points', 'chunk')}, points_received=len(points))
+                            del st.session_state.pending_requests[correlation_data]
+                        elif correlation_data and correlation_data in st.session_state.pending_requests:
                             log_to_streamlit_ui(f"(Main) Response for Correlation ID: {correlation_data}")
-                            try: st.session_state.request_responses[correlation_data] = json.loads(payload_str)
-                            except json.JSONDecodeError: st.session_state.request_responses[correlation_data] = {"error": "Failed to parse JSON response", "raw_payload": payload_str}
+                            if decode_error: st.session_state.request_responses[correlation_data] = {"error": "Failed to decode response", "detail": decode_error}
+                            else: st.session_state.request_responses[correlation_data] = payload_obj
                             if correlation_data in st.session_state.pending_requests: del st.session_state.pending_requests[correlation_data]
                         else: log_to_streamlit_ui(f"(Main) Unmatched response on {topic} (CorrID: {correlation_data})")
-                    elif topic.startswith("bmkg/prakiraan/"):
-                        try:
-                            data = json.loads(payload_str)
-                            if isinstance(data, list):
-                                st.session_state.weather_data[topic] = data
-                                log_to_streamlit_ui(f"(Main) Weather data for {topic} updated ({len(data)} forecasts).")
-                            else: log_to_streamlit_ui(f"(Main) Non-list data on weather topic {topic}: {type(data)}")
-                        except json.JSONDecodeError: log_to_streamlit_ui(f"(Main) Error decoding JSON from weather topic {topic}")
-                        except Exception as e: log_to_streamlit_ui(f"(Main) Error processing weather topic {topic}: {e}")
                     else: log_to_streamlit_ui(f"(Main) Message on unhandled topic: {topic}")
         except queue.Empty: break
         except Exception as e: log_to_streamlit_ui(f"(Main) Error processing queue item: {e}")
+    if st.session_state.hub_attached:
+        # Prakiraan sudah di-decode dan digabung hub; sesi cukup memajukan cursor-nya.
+        # Perubahan prakiraan tidak memicu rerun penuh: panel cuaca me-refresh dirinya sendiri (weather_panel)
+        hub = get_hub()
+        # attach idempoten: memperbarui last_seen, dan mendaftarkan ulang sesi yang sudah di-reap karena idle
+        st.session_state.mqtt_events = hub.attach(st.session_state.hub_session_id)
+        st.session_state.hub_cursor, changed = hub.changed_since(st.session_state.hub_cursor, st.session_state.subscribed_topics)
+        if len(changed) > 5: # Ratusan wilayah: satu baris log, bukan satu per topik
+            log_to_streamlit_ui(f"(Main) Weather data for {len(changed)} regions updated.")
+        else:
+            for topic, version in changed.items():
+                log_to_streamlit_ui(f"(Main) Weather data for {topic} updated (v{version}).")
     return rerun_needed_from_queue
 
-# --- Fungsi Koneksi MQTT (Tetap sama) ---
+@st.fragment(run_every=DASHBOARD_REFRESH_SECONDS)
+def mqtt_event_pump():
+    # Menguras antrian sesi tanpa menunggu interaksi user. Hanya event yang mengubah bagian lain
+    # halaman (status koneksi, respons perintah) yang memicu rerun penuh.
+    if process_mqtt_queue():
+        st.rerun()
+
+# --- Fungsi Koneksi MQTT ---
 def connect_mqtt():
-    if st.session_state.connected and st.session_state.mqtt_client:
+    if st.session_state.hub_attached:
         log_message_from_main_thread("Already connected.")
         return
+    st.session_state.attempted_connect = True
     try:
-        st.session_state.attempted_connect = True
-        client_id = f"streamlit-subscriber-{uuid.uuid4()}"
-        if st.session_state.mqtt_client:
-            try: st.session_state.mqtt_client.loop_stop(force=True)
-            except: pass
-            st.session_state.mqtt_client = None
-        st.session_state.mqtt_client = mqtt.Client(client_id=client_id, protocol=mqtt.MQTTv5)
-        st.session_state.mqtt_client.on_connect = on_connect_subscriber
-        st.session_state.mqtt_client.on_message = on_message_subscriber
-        st.session_state.mqtt_client.on_disconnect = on_disconnect_subscriber
-        if USE_TLS:
-            if not CA_CERT_PATH or not os.path.exists(CA_CERT_PATH):
-                log_message_from_main_thread(f"MQTTS error: CA_CERT_PATH '{CA_CERT_PATH}' is not valid.")
-                st.sidebar.error(f"MQTTS error: CA Cert Path '{CA_CERT_PATH}' tidak valid.")
-                st.session_state.attempted_connect = False
-                return
-            st.session_state.mqtt_client.tls_set(ca_certs=CA_CERT_PATH)
-        log_message_from_main_thread(f"Attempting to connect to {MQTT_BROKER_HOST}:{MQTT_PORT} {'with TLS' if USE_TLS else ''}...")
-        st.session_state.mqtt_client.connect_async(MQTT_BROKER_HOST, MQTT_PORT, 60)
-        st.session_state.mqtt_client.loop_start()
+        hub = get_hub()
     except Exception as e:
         log_message_from_main_thread(f"Error during MQTT connection setup: {e}")
-        if st.session_state.mqtt_client:
-             try: st.session_state.mqtt_client.loop_stop(force=True)
-             except: pass
-        st.session_state.mqtt_client = None
-        st.session_state.connected = False
+        st.sidebar.error(f"MQTT error: {e}")
         st.session_state.attempted_connect = False
-        st.rerun() 
+        return
+    st.session_state.mqtt_events = hub.attach(st.session_state.hub_session_id)
+    st.session_state.hub_attached = True
+    log_message_from_main_thread(f"Attached to shared MQTT connection {MQTT_BROKER_HOST}:{MQTT_PORT} {'with TLS' if USE_TLS else ''}")
 
 def disconnect_mqtt():
-    if st.session_state.mqtt_client:
-        log_message_from_main_thread("Requesting disconnect from MQTT Broker...")
-        st.session_state.mqtt_client.disconnect()
-        st.session_state.mqtt_client.loop_stop(force=True)
+    # Hanya sesi ini yang dilepas; koneksi bersama tetap dipakai sesi lain
+    if st.session_state.hub_attached:
+        log_message_from_main_thread("Detaching from shared MQTT connection...")
+        get_hub().detach(st.session_state.hub_session_id)
+    st.session_state.hub_attached = False
     st.session_state.connected = False
+    st.session_state.mqtt_events = CoalescingEventQueue()
     # st.session_state.subscribed_topics.clear() # Jangan clear di sini, biarkan UI yang manage
     # Biarkan UI yang mengelola apa yang ingin disubscribe saat konek lagi
     # Tapi data yang ditampilkan bisa di-clear
-    st.session_state.weather_data.clear()
+    st.session_state.hub_cursor = 0
+    st.session_state.weather_cleared.clear()
     st.session_state.pending_requests.clear()
     st.session_state.request_responses.clear()
+    st.session_state.history_chunks.clear()
+    st.session_state.history_series.clear()
     st.session_state.attempted_connect = False
     log_message_from_main_thread("MQTT client disconnected and resources cleaned up.")
     st.rerun() 
@@ -241,9 +245,9 @@ if not st.session_state.authenticated:
     st.info("Silakan login melalui sidebar untuk mengakses dashboard.")
     st.stop()
 
-if st.session_state.authenticated and not st.session_state.connected and not st.session_state.attempted_connect:
-    if not st.session_state.mqtt_client: 
-        connect_mqtt()
+if st.session_state.authenticated and not st.session_state.hub_attached and not st.session_state.attempted_connect:
+    connect_mqtt()
+mqtt_event_pump()
 
 st.sidebar.header("🔌 Koneksi MQTT")
 connection_status_text = "🟢 Terhubung" if st.session_state.connected else "🔴 Terputus"
@@ -251,9 +255,10 @@ broker_info_text = f"{MQTT_BROKER_HOST}:{MQTT_PORT} ({'MQTTS' if USE_TLS else 'M
 st.sidebar.markdown(f"**Status:** {connection_status_text}", unsafe_allow_html=True)
 st.sidebar.caption(f"Broker: {broker_info_text}")
 
-if not st.session_state.connected:
+if not st.session_state.hub_attached:
     if st.sidebar.button("Hubungkan ke MQTT Broker", key="connect_btn_main_key"):
         connect_mqtt()
+        st.rerun()
 else:
     if st.sidebar.button("Putuskan Koneksi MQTT", key="disconnect_btn_main_key"):
         disconnect_mqtt()
@@ -271,27 +276,16 @@ if st.session_state.connected:
     # Ini adalah set topik yang *diinginkan* oleh UI saat ini
     desired_topics_from_ui = {f"bmkg/prakiraan/{adm4}" for adm4 in selected_adm4s_ui}
     
-    # Topik yang perlu ditambahkan (subscribe)
-    topics_to_add_subscription = desired_topics_from_ui - st.session_state.subscribed_topics
+    # Hub hanya subscribe/unsubscribe ke broker saat sesi pertama/terakhir memegang topik;
+    # idempoten, jadi aman dipanggil setiap rerun (juga memulihkan topik setelah sesi di-reap)
+    topics_to_add_subscription, topics_to_remove_subscription = get_hub().set_subscriptions(
+        st.session_state.hub_session_id, desired_topics_from_ui)
     for topic_to_sub in topics_to_add_subscription:
-        if st.session_state.mqtt_client and st.session_state.connected:
-            st.session_state.mqtt_client.subscribe(topic_to_sub, qos=2)
-            log_message_from_main_thread(f"Subscribing to {topic_to_sub}") 
-            if topic_to_sub not in st.session_state.weather_data:
-                 st.session_state.weather_data[topic_to_sub] = []
-    
-    # Topik yang perlu dihilangkan (unsubscribe)
-    topics_to_remove_subscription = st.session_state.subscribed_topics - desired_topics_from_ui
-    # Filter hanya topik data cuaca
-    topics_to_remove_subscription = {t for t in topics_to_remove_subscription if t.startswith("bmkg/prakiraan/")}
-
+        log_message_from_main_thread(f"Subscribing to {topic_to_sub}")
     for topic_to_unsub in topics_to_remove_subscription:
-        if st.session_state.mqtt_client and st.session_state.connected:
-            st.session_state.mqtt_client.unsubscribe(topic_to_unsub)
-        if topic_to_unsub in st.session_state.weather_data: # Hapus data dari UI juga
-            del st.session_state.weather_data[topic_to_unsub]
+        st.session_state.weather_cleared.pop(topic_to_unsub, None)
         log_message_from_main_thread(f"Unsubscribing from {topic_to_unsub}")
-    
+
     # Update st.session_state.subscribed_topics agar sesuai dengan UI
     st.session_state.subscribed_topics = desired_topics_from_ui
 
@@ -300,11 +294,80 @@ if st.session_state.connected:
             st.rerun()
 
     if st.sidebar.button("Clear Displayed Weather Data", key="clear_weather_data_btn"):
-        for topic_key in list(st.session_state.weather_data.keys()):
-            if topic_key.startswith("bmkg/prakiraan/"): 
-                 st.session_state.weather_data[topic_key] = []
+        # Store hub dipakai bersama sesi lain: cukup sembunyikan versi yang sekarang untuk sesi ini
+        for topic_key in st.session_state.subscribed_topics:
+            st.session_state.weather_cleared[topic_key] = get_hub().latest(topic_key)[0]
         st.rerun() 
 
+def format_numeric_column(column):
+    # Kolom int dengan nilai kosong menjadi float di pandas ("30.0"); tampilkan lagi sebagai int lewat dtype Int64
+    values = pd.to_numeric(column, errors="coerce")
+    present = values.dropna()
+    if len(present) and (present % 1 == 0).all():
+        values = values.astype("Int64")
+    return values.astype(object).where(values.notna(), column.where(column.notna(), "N/A"))
+
+@st.cache_data(max_entries=DASHBOARD_FRAME_CACHE_SIZE, show_spinner=False)
+def build_forecast_frame(topic, payload_digest, _forecast_list):
+    # Di-cache per (topik, sidik payload) untuk semua sesi: rerun tanpa data baru tidak parsing apa pun.
+    # _forecast_list tidak ikut di-hash Streamlit; isinya sudah terwakili oleh payload_digest.
+    raw = pd.DataFrame.from_records([item for item in _forecast_list if isinstance(item, dict)], columns=FORECAST_SOURCE_COLUMNS)
+    local_dt = pd.to_datetime(raw["local_datetime"], format="%Y-%m-%d %H:%M:%S", errors="coerce")
+    tanggal, jam = local_dt.dt.strftime("%d %b %Y"), local_dt.dt.strftime("%H:%M")
+    unparsed = local_dt.isna()
+    if unparsed.any():
+        # Format tak dikenal: tampilkan potongan teks aslinya seperti sebelumnya
+        local_text = raw.loc[unparsed, "local_datetime"].fillna("N/A").astype(str).str.split(" ")
+        tanggal[unparsed], jam[unparsed] = local_text.str[0], local_text.str[-1].str[:5]
+    return pd.DataFrame({
+        "Tanggal": tanggal, "Jam": jam,
+        "Cuaca": raw["weather_desc"].fillna(raw["weather_desc_en"]).fillna("N/A"),
+        "Suhu (°C)": format_numeric_column(raw["t"]), "Kelembaban (%)": format_numeric_column(raw["hu"]),
+        "Angin (km/j)": format_numeric_column(raw["ws"]), "Arah Angin": raw["wd"].fillna("N/A"),
+    })
+
+@st.cache_data(max_entries=DASHBOARD_FRAME_CACHE_SIZE, show_spinner=False)
+def forecast_period_starts(topic, payload_digest, _forecast_list):
+    # Awal periode (UTC) per baris build_forecast_frame, untuk memilih periode yang sedang berlaku
+    utc_text = [item.get('datetime') or item.get('utc_datetime') for item in _forecast_list if isinstance(item, dict)]
+    return pd.to_datetime(pd.Series(utc_text, dtype=object), utc=True, errors="coerce").dt.tz_localize(None).to_numpy()
+
+def current_forecast_row(topic, version, forecast_list, digest):
+    """Baris periode yang sedang berlaku (periode terakhir yang sudah dimulai), atau None."""
+    if version <= st.session_state.weather_cleared.get(topic, 0) or not isinstance(forecast_list, list) or not forecast_list:
+        return None
+    frame = build_forecast_frame(topic, digest, forecast_list)
+    starts = forecast_period_starts(topic, digest, forecast_list)
+    started = (starts <= pd.Timestamp.now(tz="UTC").tz_localize(None).to_datetime64()).nonzero()[0]  # NaT tidak pernah <= now
+    return frame.iloc[started[-1] if len(started) else 0]
+
+@st.fragment(run_every=DASHBOARD_REFRESH_SECONDS)
+def weather_summary(topics):
+    # Satu baris per wilayah di halaman ini; hanya cache lookup, tidak ada parsing tanpa data baru
+    hub = get_hub()
+    rows = []
+    for topic in topics:
+        row = {"Wilayah": topic.split("/")[-1]}
+        current = current_forecast_row(topic, *hub.latest(topic))
+        if current is None:
+            row["Cuaca"] = "Menunggu data..."
+        else:
+            row.update(current.to_dict())
+        rows.append(row)
+    summary_df = pd.DataFrame(rows, columns=["Wilayah", "Tanggal", "Jam", "Cuaca", "Suhu (°C)", "Kelembaban (%)", "Angin (km/j)", "Arah Angin"])
+    st.dataframe(summary_df.fillna(""), use_container_width=True, hide_index=True, height=min(35 * DASHBOARD_REGIONS_PER_PAGE + 38, len(summary_df) * 35 + 38))
+
+@st.fragment(run_every=DASHBOARD_REFRESH_SECONDS)
+def weather_panel(topic):
+    # Fragment per wilayah: data baru dari hub tampil tanpa rerun penuh halaman
+    adm4_code_display = topic.split("/")[-1]
+    version, forecast_list, digest = get_hub().latest(topic)
+    if version > st.session_state.weather_cleared.get(topic, 0) and isinstance(forecast_list, list) and forecast_list:
+        df = build_forecast_frame(topic, digest, forecast_list)
+        st.dataframe(df, use_container_width=True, height=min(300, len(df) * 35 + 38))
+    else:
+        st.write(f"Menunggu data untuk {adm4_code_display}...")
+
 # Tampilan Data Cuaca (Sama)
 st.header("📊 Prakiraan Cuaca Terkini")
 if not st.session_state.connected:
@@ -316,33 +379,42 @@ else:
     sorted_weather_topics = sorted([t for t in st.session_state.subscribed_topics if t.startswith("bmkg/prakiraan/")])
     if not sorted_weather_topics:
          st.info("Tidak ada wilayah cuaca yang dipilih atau data belum diterima.")
-    for topic_idx, topic in enumerate(sorted_weather_topics):
-        adm4_code_display = topic.split("/")[-1]
-        expander_expanded = topic_idx == 0 
-        with st.expander(f"📍 Wilayah: {adm4_code_display}", expanded=expander_expanded):
-            if topic in st.session_state.weather_data and st.session_state.weather_data[topic]:
-                forecast_list = st.session_state.weather_data[topic]
-                display_data = []
-                for item in forecast_list:
-                    try:
-                        local_dt = datetime.strptime(item.get('local_datetime', ''), "%Y-%m-%d %H:%M:%S")
-                        time_str = local_dt.strftime("%H:%M")
-                        date_str = local_dt.strftime("%d %b %Y")
-                    except ValueError:
-                        time_str = item.get('local_datetime', 'N/A').split(" ")[-1][:5]
-                        date_str = item.get('local_datetime', 'N/A').split(" ")[0]
-                    display_data.append({
-                        "Tanggal": date_str, "Jam": time_str,
-                        "Cuaca": item.get('weather_desc', item.get('weather_desc_en', 'N/A')),
-                        "Suhu (°C)": item.get('t', 'N/A'), "Kelembaban (%)": item.get('hu', 'N/A'),
-                        "Angin (km/j)": item.get('ws', 'N/A'), "Arah Angin": item.get('wd', 'N/A')
-                    })
-                df = pd.DataFrame(display_data)
-                st.dataframe(df, use_container_width=True, height=min(300, len(df) * 35 + 38))
-            elif topic in st.session_state.weather_data: # Key ada, data kosong
-                st.write(f"Menunggu data untuk {adm4_code_display}...")
-            else: # Key topik belum ada di weather_data (seharusnya tidak terjadi jika subscribed_topics dikelola dgn benar)
-                 st.write(f"Data untuk {adm4_code_display} belum tersedia (belum ada key di data store).")
+    else:
+        # Ringkasan: satu baris per wilayah, per halaman. Render dan payload websocket tidak lagi
+        # tumbuh dengan jumlah wilayah yang dipilih.
+        page_count = (len(sorted_weather_topics) - 1) // DASHBOARD_REGIONS_PER_PAGE + 1
+        page = 1
+        if page_count > 1:
+            # Halaman disimpan di state terpisah dari widget: jumlah wilayah bisa berkurang sejak halaman
+            # dipilih dan number_input menolak nilai di atas max_value, jadi nilainya dipotong sebelum dipakai
+            page = st.number_input(f"Halaman (dari {page_count}, {len(sorted_weather_topics)} wilayah):",
+                                   min_value=1, max_value=page_count, step=1,
+                                   value=min(st.session_state.get("weather_summary_page", 1), page_count))
+            st.session_state.weather_summary_page = page
+        page_topics = sorted_weather_topics[(page - 1) * DASHBOARD_REGIONS_PER_PAGE:page * DASHBOARD_REGIONS_PER_PAGE]
+        weather_summary(page_topics)
+
+        # Tabel prakiraan lengkap hanya untuk wilayah yang dibuka
+        opened_adm4 = st.selectbox("📍 Buka detail wilayah:", options=[topic.split("/")[-1] for topic in page_topics], key="weather_detail_adm4_key")
+        if opened_adm4:
+            weather_panel(f"bmkg/prakiraan/{opened_adm4}")
+
+# Riwayat prakiraan dari command 'history' (store publisher), sudah di-downsample
+if st.session_state.connected and st.session_state.history_series:
+    st.header("📈 Riwayat Prakiraan")
+    for adm4_code_history, points in sorted(st.session_state.history_series.items()):
+        with st.expander(f"📍 Riwayat Wilayah: {adm4_code_history} ({len(points)} titik)", expanded=True):
+            if not points:
+                st.write("Tidak ada riwayat untuk rentang waktu ini.")
+                continue
+            history_df = pd.DataFrame(points)
+            history_df["Waktu"] = pd.to_datetime(history_df["local_datetime"].fillna(history_df["datetime"]))
+            history_df = history_df.set_index("Waktu").rename(columns={"t": "Suhu (°C)", "hu": "Kelembaban (%)", "ws": "Angin (km/j)"})
+            st.line_chart(history_df[["Suhu (°C)", "Kelembaban (%)"]])
+            st.line_chart(history_df[["Angin (km/j)"]])
+    if st.button("Clear Riwayat", key="clear_history_btn_key"):
+        st.session_state.history_series.clear()
+        st.rerun()
 
 # Fitur MQTT 5.0 Request/Response (Sama)
 if st.session_state.connected:
@@ -351,30 +423,40 @@ if st.session_state.connected:
     with col_req:
         st.subheader("Kirim Perintah")
         with st.form("request_form_main"):
-            command_type = st.selectbox("Pilih Perintah:", ["status", "force_refresh"], key="cmd_type_sel_main")
+            command_type = st.selectbox("Pilih Perintah:", ["status", "force_refresh", "history"], key="cmd_type_sel_main")
             adm4_for_refresh_cmd = ""
-            if command_type == "force_refresh":
+            if command_type in ("force_refresh", "history"):
                 adm4_for_refresh_cmd = st.selectbox(
-                    "ADM4 untuk di-refresh:", options=AVAILABLE_ADM4_CODES, key="cmd_adm4_sel_main"
+                    "ADM4 untuk di-refresh:" if command_type == "force_refresh" else "ADM4 untuk riwayat:",
+                    options=AVAILABLE_ADM4_CODES, key="cmd_adm4_sel_main"
                 )
+            if command_type == "history":
+                history_days = st.number_input("Rentang (hari terakhir):", min_value=1, max_value=90, value=7, key="cmd_history_days")
+                history_max_points = st.number_input("Titik maksimum:", min_value=10, max_value=2000, value=200, step=10, key="cmd_history_points")
             submit_request_btn = st.form_submit_button("Kirim Perintah ke Publisher")
             if submit_request_btn:
-                if st.session_state.mqtt_client and st.session_state.connected:
+                if st.session_state.hub_attached and st.session_state.connected:
+                    hub = get_hub()
                     correlation_id = str(uuid.uuid4())
-                    response_topic_for_publisher_to_use = RESPONSE_TOPIC_APP_BASE 
+                    # Respons dikirim ke topik milik sesi ini; hub meneruskannya ke antrian sesi
+                    response_topic_for_publisher_to_use = hub.response_topic(st.session_state.hub_session_id)
                     req_properties = props.Properties(PacketTypes.PUBLISH)
                     req_properties.ResponseTopic = response_topic_for_publisher_to_use
                     req_properties.CorrelationData = correlation_id.encode('utf-8')
                     payload_dict = {"command": command_type}
-                    if command_type == "force_refresh" and adm4_for_refresh_cmd:
+                    if command_type in ("force_refresh", "history") and adm4_for_refresh_cmd:
                         payload_dict["adm4"] = adm4_for_refresh_cmd
+                    if command_type == "history":
+                        # Rentang dalam UTC, sama dengan field "datetime" BMKG
+                        payload_dict["since"] = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(time.time() - history_days * 86400))
+                        payload_dict["max_points"] = int(history_max_points)
                     payload_json = json.dumps(payload_dict)
-                    result = st.session_state.mqtt_client.publish(
+                    result = hub.publish(
                         REQUEST_TOPIC_TO_PUBLISHER, payload_json, qos=1, properties=req_properties
                     )
                     if result.rc == mqtt.MQTT_ERR_SUCCESS:
                         st.session_state.pending_requests[correlation_id] = f"Perintah: {command_type}" + \
-                            (f" untuk {adm4_for_refresh_cmd}" if command_type == "force_refresh" and adm4_for_refresh_cmd else "")
+                            (f" untuk {adm4_for_refresh_cmd}" if command_type in ("force_refresh", "history") and adm4_for_refresh_cmd else "")
                         log_message_from_main_thread(f"Perintah '{command_type}' dikirim (CorrID: {correlation_id[:8]})")
                     else:
                         log_message_from_main_thread(f"Gagal mengirim perintah '{command_type}', rc: {result.rc}")
@@ -412,6 +494,19 @@ with log_container:
         st.caption("Log kosong.")
     for entry in st.session_state.get('app_log', []):
         st.caption(entry)
+queue_stats = st.session_state.mqtt_events.stats()
+st.sidebar.caption(
+    f"Antrian MQTT: {queue_stats['depth']}/{queue_stats['maxsize']} (puncak {queue_stats['high_water']}), "
+    f"dibuang {queue_stats['dropped']}, digabung {queue_stats['coalesced']}, log dibuang {queue_stats['logs_dropped']}"
+)
+if st.session_state.hub_attached:
+    hub_stats = get_hub().stats()
+    st.sidebar.caption(
+        f"Koneksi bersama: {hub_stats['sessions']} sesi, {hub_stats['topics']} topik, "
+        f"inbox {hub_stats['inbox']['depth']} (digabung {hub_stats['inbox']['coalesced']}, dibuang {hub_stats['inbox']['dropped']})"
+    )
 
 # Tidak perlu rerun eksplisit di akhir jika modifikasi state sudah terjadi
-# dan rerun_triggered_by_queue sudah ditangani.
\ No newline at end of file
+# dan rerun_triggered_by_queue sudah ditangani; kecuali budget drain habis sebelum antrian kosong.
+if st.session_state.drain_backlog:
+    st.rerun()
\ No newline at end of file
@@ -0,0 +1,94 @@
+# bmkg_eventqueue.py
+# Antrian event terbatas antara thread network paho dan main thread Streamlit.
+# Ring buffer: saat penuh, event tertua dibuang (dan dihitung) alih-alih memori tumbuh
+# tanpa batas selama burst. Pesan snapshot per topik di-coalesce: jika topik yang sama
+# masih antre, payload lama diganti yang terbaru, jadi main thread hanya men-decode
+# payload terakhir per topik. Baris log untuk UI punya ring sendiri yang lebih kecil.
+import itertools
+import logging
+import os
+import queue
+import threading
+from collections import OrderedDict, deque
+
+from bmkg_logging import SAMPLED
+
+log = logging.getLogger(__name__)
+
+DASHBOARD_EVENT_QUEUE_SIZE = int(os.getenv("DASHBOARD_EVENT_QUEUE_SIZE", 1000))
+DASHBOARD_LOG_QUEUE_SIZE = int(os.getenv("DASHBOARD_LOG_QUEUE_SIZE", 50))  # Sama dengan jumlah log yang ditampilkan UI
+
+
+class CoalescingEventQueue:
+    """Ring buffer thread-safe dengan coalescing per key.
+
+    put(item, coalesce_key=...) mengganti event ber-key sama yang belum diambil dan
+    memindahkannya ke ekor (urutan relatif terhadap delta/respons tetap benar).
+    Event tanpa key selalu ditambahkan. get()/get_nowait() melempar queue.Empty seperti queue.Queue.
+    """
+
+    def __init__(self, maxsize=DASHBOARD_EVENT_QUEUE_SIZE, log_maxsize=DASHBOARD_LOG_QUEUE_SIZE):
+        self.maxsize = max(1, maxsize)
+        self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        self._events = OrderedDict()  # key -> event; event tanpa coalesce_key memakai key unik
+        self._logs = deque(maxlen=max(1, log_maxsize))
+        self._unique_keys = itertools.count()
+        self.dropped = 0
+        self.coalesced = 0
+        self.logs_dropped = 0
+        self.high_water = 0
+
+    def put(self, item, coalesce_key=None):
+        with self._lock:
+            if coalesce_key is not None and coalesce_key in self._events:
+                self._events[coalesce_key] = item
+                self._events.move_to_end(coalesce_key)
+                self.coalesced += 1
+                return
+            dropped = len(self._events) >= self.maxsize
+            if dropped:
+                self._events.popitem(last=False)
+                self.dropped += 1
+            key = coalesce_key if coalesce_key is not None else ("event", next(self._unique_keys))
+            self._events[key] = item
+            self.high_water = max(self.high_water, len(self._events))
+            self._not_empty.notify()
+        if dropped:
+            log.warning("Antrian event dashboard penuh (%s), event tertua dibuang (total %s)", self.maxsize, self.dropped, extra=SAMPLED)
+
+    def put_log(self, text):
+        with self._lock:
+            if len(self._logs) == self._logs.maxlen:
+                self.logs_dropped += 1
+            self._logs.append(text)
+
+    def get(self, timeout=None):
+        with self._not_empty:
+            if not self._not_empty.wait_for(lambda: self._events, timeout):
+                raise queue.Empty
+            return self._events.popitem(last=False)[1]
+
+    def get_nowait(self):
+        with self._lock:
+            if not self._events:
+                raise queue.Empty
+            return self._events.popitem(last=False)[1]
+
+    def drain_logs(self):
+        """Semua baris log yang antre, tertua lebih dulu."""
+        with self._lock:
+            lines = list(self._logs)
+            self._logs.clear()
+        return lines
+
+    def __len__(self):
+        with self._lock:
+            return len(self._events)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "depth": len(self._events), "maxsize": self.maxsize, "high_water": self.high_water,
+                "dropped": self.dropped, "coalesced": self.coalesced, "logs_dropped": self.logs_dropped,
+            }
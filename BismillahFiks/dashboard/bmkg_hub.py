@@ -0,0 +1,356 @@
+# bmkg_hub.py
+# Satu koneksi broker per proses server Streamlit, dipakai bersama oleh semua sesi browser.
+# Hub menyimpan registry topik ber-refcount (topik/filter baru di-subscribe ke broker saat sesi
+# pertama memintanya, di-unsubscribe saat sesi terakhir melepasnya) dan latest-value store:
+# nilai terakhir per topik, sudah di-decode dan (untuk publisher mode delta) sudah digabung,
+# masing-masing dengan nomor versi yang naik monoton. Sesi cukup menyimpan cursor (versi
+# terakhir yang sudah dilihat) untuk tahu topik mana yang berubah.
+# Respons request/response (ResponseTopic <base>/<session_id>) dan event koneksi dikirim ke
+# antrian event milik masing-masing sesi.
+import hashlib
+import json
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+
+import paho.mqtt.client as mqtt
+import paho.mqtt.properties as props
+from paho.mqtt.packettypes import PacketTypes
+
+import bmkg_codec
+from bmkg_eventqueue import CoalescingEventQueue
+
+log = logging.getLogger(__name__)
+
+# Sesi browser yang tidak rerun selama ini dianggap ditutup; topiknya dilepas
+HUB_SESSION_IDLE_SECONDS = float(os.getenv("HUB_SESSION_IDLE_SECONDS", 3600))
+HUB_INBOX_SIZE = int(os.getenv("HUB_INBOX_SIZE", 5000))
+
+
+def forecast_key(item):
+    return item.get('datetime') or item.get('local_datetime')
+
+
+def merge_forecast_delta(forecast_list, delta):
+    # Periode di 'changed' menggantikan periode dengan datetime yang sama, 'removed' dihapus
+    merged = {forecast_key(item): item for item in forecast_list or [] if isinstance(item, dict)}
+    for key in delta.get('removed', []):
+        merged.pop(key, None)
+    for item in delta.get('changed', []):
+        merged[forecast_key(item)] = item
+    return [merged[key] for key in sorted(merged)]
+
+
+def payload_digest(payload_bytes, previous=None):
+    # Sidik isi: sama berarti tidak ada yang berubah; delta dirantai ke sidik nilai sebelumnya
+    hasher = hashlib.blake2b(digest_size=16)
+    if previous:
+        hasher.update(previous.encode())
+    hasher.update(payload_bytes)
+    return hasher.hexdigest()
+
+
+def message_seq(properties):
+    try: return int(properties.get('UserProperty', {}).get('seq'))
+    except (TypeError, ValueError): return None
+
+
+def message_event(msg):
+    """Bentuk event antrian yang sama untuk semua konsumen (properti MQTT 5 sebagai dict biasa)."""
+    properties = msg.properties
+    return {
+        'type': 'mqtt_message', 'topic': msg.topic, 'payload_bytes': msg.payload,
+        'properties': {'CorrelationData': properties.CorrelationData if properties and hasattr(properties, 'CorrelationData') else None,
+                       'UserProperty': dict(properties.UserProperty) if properties and hasattr(properties, 'UserProperty') else {},
+                       'ContentType': properties.ContentType if properties and hasattr(properties, 'ContentType') else None},
+    }
+
+
+class _TopicEntry:
+    __slots__ = ("version", "value", "seq", "digest")
+
+    def __init__(self, version, value, seq=None, digest=None):
+        self.version = version
+        self.value = value
+        self.seq = seq
+        self.digest = digest
+
+
+class _Session:
+    __slots__ = ("events", "topics", "last_seen")
+
+    def __init__(self):
+        self.events = CoalescingEventQueue()
+        self.topics = set()
+        self.last_seen = time.monotonic()
+
+
+class SubscriptionHub:
+    """Koneksi MQTT bersama dengan registry topik ber-refcount dan latest-value store.
+
+    Thread network paho hanya memasukkan pesan ke inbox (snapshot di-coalesce per topik);
+    decode dan penggabungan delta dilakukan sekali oleh thread worker hub untuk semua sesi.
+    Jika delta_suffix diisi, <topik><delta_suffix> ikut di-subscribe dan digabung ke <topik>;
+    delta yang bolong memicu force_refresh ke resync_topic (sekali per topik sampai snapshot datang).
+    """
+
+    def __init__(self, host, port, response_base, tls_ca_certs=None, username=None, password=None,
+                 delta_suffix=None, resync_topic=None, qos=2, keepalive=60):
+        self.host = host
+        self.port = port
+        self.response_base = response_base
+        self.delta_suffix = delta_suffix
+        self.resync_topic = resync_topic
+        self.qos = qos
+        self.keepalive = keepalive
+        self.connected = False
+        self._lock = threading.RLock()
+        self._sessions = {}  # session_id -> _Session
+        self._refs = {}  # topik -> set(session_id)
+        self._latest = {}  # topik -> _TopicEntry
+        self._version = 0
+        self._resync_requested = set()
+        self._inbox = CoalescingEventQueue(maxsize=HUB_INBOX_SIZE, log_maxsize=1)
+        client_id = f"streamlit-hub-{uuid.uuid4()}"
+        # Callback di sini memakai signature paho 1.x; paho 2.x perlu diminta eksplisit
+        if hasattr(mqtt, "CallbackAPIVersion"):
+            self.client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION1, client_id=client_id, protocol=mqtt.MQTTv5)
+        else:
+            self.client = mqtt.Client(client_id=client_id, protocol=mqtt.MQTTv5)
+        if username and password:
+            self.client.username_pw_set(username, password)
+        if tls_ca_certs:
+            self.client.tls_set(ca_certs=tls_ca_certs)
+        self.client.on_connect = self._on_connect
+        self.client.on_disconnect = self._on_disconnect
+        self.client.on_message = self._on_message
+        self._worker = threading.Thread(target=self._run, name="bmkg-hub", daemon=True)
+
+    def start(self):
+        log.info("Hub connecting to %s:%s", self.host, self.port)
+        self.client.connect_async(self.host, self.port, self.keepalive)
+        self.client.loop_start()
+        self._worker.start()
+        return self
+
+    # --- Sesi ---
+    def response_topic(self, session_id):
+        return f"{self.response_base}/{session_id}"
+
+    def attach(self, session_id):
+        """Daftarkan sesi (idempoten) dan kembalikan antrian event miliknya."""
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                session = self._sessions[session_id] = _Session()
+                log.info("Session %s attached (%s sessions)", session_id[:8], len(self._sessions))
+                if self.connected:
+                    session.events.put({'type': 'connection_status', 'status': True, 'rc': 0})
+            session.last_seen = time.monotonic()
+            return session.events
+
+    def detach(self, session_id):
+        with self._lock:
+            if session_id not in self._sessions:
+                return
+            self.set_subscriptions(session_id, ())
+            del self._sessions[session_id]
+            log.info("Session %s detached (%s sessions)", session_id[:8], len(self._sessions))
+
+    def set_subscriptions(self, session_id, topics):
+        """Samakan topik sesi dengan `topics`; broker hanya disentuh saat refcount 0 <-> 1."""
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                return set(), set()
+            topics = set(topics)
+            added, removed = topics - session.topics, session.topics - topics
+            for topic in added:
+                holders = self._refs.setdefault(topic, set())
+                if not holders and self.connected:
+                    self.client.subscribe([(filter_, self.qos) for filter_ in self._broker_filters(topic)])
+                holders.add(session_id)
+            for topic in removed:
+                holders = self._refs.get(topic, set())
+                holders.discard(session_id)
+                if not holders:
+                    self._refs.pop(topic, None)
+                    if self.connected:
+                        self.client.unsubscribe(self._broker_filters(topic))
+                    for stale in [cached for cached in self._latest if self._matches(topic, cached) and not self._is_wanted(cached)]:
+                        del self._latest[stale]
+                        self._resync_requested.discard(stale)
+            session.topics = topics
+            return added, removed
+
+    @staticmethod
+    def _matches(topic_filter, topic):
+        return topic_filter == topic or (("+" in topic_filter or "#" in topic_filter) and mqtt.topic_matches_sub(topic_filter, topic))
+
+    def _is_wanted(self, topic):
+        return topic in self._refs or any(self._matches(topic_filter, topic) for topic_filter in self._refs)
+
+    def _broker_filters(self, topic):
+        return [topic, f"{topic}{self.delta_suffix}"] if self.delta_suffix else [topic]
+
+    def _reap_idle_sessions(self):
+        cutoff = time.monotonic() - HUB_SESSION_IDLE_SECONDS
+        with self._lock:
+            idle = [session_id for session_id, session in self._sessions.items() if session.last_seen < cutoff]
+        for session_id in idle:
+            log.info("Session %s idle for %ss, releasing its topics", session_id[:8], HUB_SESSION_IDLE_SECONDS)
+            self.detach(session_id)
+
+    # --- Latest-value store ---
+    def latest(self, topic):
+        """(versi, nilai, sidik payload) terakhir untuk topik; (0, None, None) jika belum ada data."""
+        with self._lock:
+            entry = self._latest.get(topic)
+            return (entry.version, entry.value, entry.digest) if entry is not None else (0, None, None)
+
+    def changed_since(self, cursor, topics):
+        """(cursor baru, {topik: versi}) untuk topik yang cocok dengan `topics` dan berubah setelah `cursor`."""
+        with self._lock:
+            if cursor >= self._version:
+                return self._version, {}
+            exact = {topic for topic in topics if "+" not in topic and "#" not in topic}
+            wildcards = [topic for topic in topics if topic not in exact]
+            changed = {}
+            for topic in exact:
+                entry = self._latest.get(topic)
+                if entry is not None and entry.version > cursor:
+                    changed[topic] = entry.version
+            if wildcards:
+                for topic, entry in self._latest.items():
+                    if entry.version > cursor and any(mqtt.topic_matches_sub(wildcard, topic) for wildcard in wildcards):
+                        changed[topic] = entry.version
+            return self._version, changed
+
+    def _store(self, topic, value, seq=None, digest=None):
+        with self._lock:
+            entry = self._latest.get(topic)
+            if entry is not None and digest is not None and entry.digest == digest:
+                # Publisher periodik mengirim ulang isi yang sama: versi tidak naik, sesi tidak re-render
+                entry.seq = seq
+                return
+            self._version += 1
+            self._latest[topic] = _TopicEntry(self._version, value, seq, digest)
+
+    # --- Callback paho (thread network) ---
+    def _broadcast(self, event, log_line):
+        with self._lock:
+            sessions = list(self._sessions.values())
+        for session in sessions:
+            session.events.put(event)
+            session.events.put_log(log_line)
+
+    def _on_connect(self, client, userdata, flags, rc, properties=None):
+        timestamp = time.strftime("%Y-%m-%d %H:%M:%S")
+        if rc != 0:
+            log.error("Hub failed to connect, return code %s", rc)
+            self._broadcast({'type': 'connection_status', 'status': False, 'rc': rc}, f"[{timestamp}] (MQTT) Failed to connect, return code {rc}")
+            return
+        with self._lock:
+            self.connected = True
+            filters = [(filter_, self.qos) for topic in self._refs for filter_ in self._broker_filters(topic)]
+        client.subscribe(f"{self.response_base}/#", qos=1)
+        if filters:
+            client.subscribe(filters)  # Resubscribe semua topik yang masih dipegang sesi
+        log.info("Hub connected to %s:%s, %s topics resubscribed", self.host, self.port, len(filters))
+        self._broadcast({'type': 'connection_status', 'status': True, 'rc': rc},
+                        f"[{timestamp}] (MQTT) Connected to MQTT Broker ({self.host}:{self.port}, rc: {rc})!")
+
+    def _on_disconnect(self, client, userdata, rc, properties=None):
+        with self._lock:
+            self.connected = False
+        log.log(logging.WARNING if rc else logging.INFO, "Hub disconnected from MQTT Broker (rc: %s)", rc)
+        self._broadcast({'type': 'connection_status', 'status': False, 'rc': rc, 'event': 'disconnect'},
+                        f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] (MQTT) Disconnected from MQTT Broker (rc: {rc}).")
+
+    def _on_message(self, client, userdata, msg):
+        log.debug("Hub received %s (len: %s B)", msg.topic, len(msg.payload))
+        if msg.topic.startswith(f"{self.response_base}/"):
+            session_id = msg.topic[len(self.response_base) + 1:].split("/", 1)[0]
+            with self._lock:
+                session = self._sessions.get(session_id)
+            if session is not None:
+                session.events.put(message_event(msg))
+            return
+        is_delta = bool(self.delta_suffix) and msg.topic.endswith(self.delta_suffix)
+        self._inbox.put(message_event(msg), coalesce_key=None if is_delta else msg.topic)
+
+    # --- Worker: decode + gabung delta, sekali untuk semua sesi ---
+    def _run(self):
+        next_reap = time.monotonic() + 60
+        while True:
+            try:
+                self._apply(self._inbox.get(timeout=5))
+            except queue.Empty:
+                pass
+            except Exception as e:
+                log.exception("Hub failed to apply message: %s", e)
+            if time.monotonic() >= next_reap:
+                next_reap = time.monotonic() + 60
+                self._reap_idle_sessions()
+
+    def _apply(self, event):
+        topic, properties = event['topic'], event['properties']
+        try:
+            value = bmkg_codec.decode(event['payload_bytes'], properties.get('ContentType'))
+        except ValueError as e:
+            log.warning("Hub could not decode %s: %s", topic, e)
+            return
+        if self.delta_suffix and topic.endswith(self.delta_suffix):
+            self._apply_delta(topic[:-len(self.delta_suffix)], value, properties, event['payload_bytes'])
+            return
+        with self._lock:
+            if not self._is_wanted(topic):
+                return  # Sudah di-unsubscribe selagi pesan antre
+            self._resync_requested.discard(topic)
+        # Snapshot dari publisher mode delta membawa seq; tanpa seq, delta berikutnya memicu resync
+        self._store(topic, value, message_seq(properties), payload_digest(event['payload_bytes']))
+
+    def _apply_delta(self, topic, delta, properties, payload_bytes):
+        if not isinstance(delta, dict):
+            log.warning("Hub got non-dict delta on %s: %s", topic, type(delta))
+            return
+        with self._lock:
+            if not self._is_wanted(topic):
+                return
+            entry = self._latest.get(topic)
+            seq = message_seq(properties) or delta.get('seq')
+            last_seq = entry.seq if entry is not None else None
+            if last_seq is not None and seq is not None and seq <= last_seq:
+                return  # Duplikat (QoS 1)
+            if last_seq is None or seq != last_seq + 1:
+                log.info("Delta gap on %s (last seq %s, got %s), waiting for snapshot", topic, last_seq, seq)
+                if entry is not None:
+                    entry.seq = None
+                self._request_resync(topic)
+                return
+            self._store(topic, merge_forecast_delta(entry.value, delta), seq, payload_digest(payload_bytes, entry.digest))
+
+    def _request_resync(self, topic):
+        if not self.resync_topic or topic in self._resync_requested or not self.connected:
+            return
+        req_properties = props.Properties(PacketTypes.PUBLISH)
+        req_properties.ResponseTopic = self.response_topic("hub")
+        req_properties.CorrelationData = str(uuid.uuid4()).encode('utf-8')
+        result = self.client.publish(self.resync_topic, json.dumps({"command": "force_refresh", "adm4": topic.split("/")[-1]}),
+                                     qos=1, properties=req_properties)
+        if result.rc == mqtt.MQTT_ERR_SUCCESS:
+            self._resync_requested.add(topic)
+            log.info("Requested snapshot resync for %s", topic)
+
+    def publish(self, topic, payload, qos=1, properties=None):
+        return self.client.publish(topic, payload, qos=qos, properties=properties)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "connected": self.connected, "sessions": len(self._sessions), "topics": len(self._refs),
+                "cached_topics": len(self._latest), "version": self._version, "inbox": self._inbox.stats(),
+            }
@@ -0,0 +1,146 @@
+# GENERATED COPY dari ../../bmkg_codec.py oleh sync_bmkg_modules.py -- JANGAN DIEDIT DI SINI.
+# Ubah file di root repo lalu jalankan: python sync_bmkg_modules.py
+# bmkg_codec.py
+# Codec payload MQTT yang bisa dipilih: JSON ringkas (default), MessagePack, atau
+# JSON terkompresi zstd. Codec yang dipakai ditandai lewat properti MQTT 5
+# ContentType dan PayloadFormatIndicator, jadi subscriber bisa decode tanpa menebak.
+# Pesan tanpa ContentType (publisher lama) selalu dianggap JSON.
+#
+# Dependensi opsional: msgpack (codec "msgpack"), zstandard (codec "json+zstd")
+import json
+import logging
+import os
+import threading
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+log = logging.getLogger(__name__)
+
+CODEC_JSON = "json"
+CODEC_MSGPACK = "msgpack"
+CODEC_JSON_ZSTD = "json+zstd"
+
+CONTENT_TYPES = {
+    CODEC_JSON: "application/json",
+    CODEC_MSGPACK: "application/msgpack",
+    CODEC_JSON_ZSTD: "application/json+zstd",
+}
+CODECS_BY_CONTENT_TYPE = {content_type: codec for codec, content_type in CONTENT_TYPES.items()}
+
+ZSTD_LEVEL = int(os.getenv("PAYLOAD_ZSTD_LEVEL", 10))
+
+# Objek zstd tidak aman dipakai bersamaan dari beberapa thread, jadi satu per thread
+_zstd_local = threading.local()
+
+
+def available_codecs():
+    codecs = [CODEC_JSON]
+    if msgpack is not None:
+        codecs.append(CODEC_MSGPACK)
+    if zstandard is not None:
+        codecs.append(CODEC_JSON_ZSTD)
+    return codecs
+
+
+def resolve_codec(name):
+    """Nama codec yang valid dan terpasang; jatuh ke JSON jika tidak."""
+    name = CODECS_BY_CONTENT_TYPE.get(name, name)
+    if name in available_codecs():
+        return name
+    log.warning("Codec '%s' tidak dikenal atau library-nya tidak terpasang, memakai JSON.", name)
+    return CODEC_JSON
+
+
+# Codec untuk publikasi periodik; respons request/response memakai hasil negotiate()
+PAYLOAD_CODEC = resolve_codec(os.getenv("PAYLOAD_CODEC", CODEC_JSON).lower())
+
+
+def _zstd_compressor():
+    if not hasattr(_zstd_local, "compressor"):
+        _zstd_local.compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL)
+    return _zstd_local.compressor
+
+
+def _zstd_decompressor():
+    if not hasattr(_zstd_local, "decompressor"):
+        _zstd_local.decompressor = zstandard.ZstdDecompressor()
+    return _zstd_local.decompressor
+
+
+def _json_bytes(obj):
+    return json.dumps(obj, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+
+def encode(obj, codec=PAYLOAD_CODEC):
+    """Serialisasi obj menjadi bytes payload dengan codec yang diminta."""
+    if codec == CODEC_MSGPACK:
+        return msgpack.packb(obj, use_bin_type=True)
+    if codec == CODEC_JSON_ZSTD:
+        return _zstd_compressor().compress(_json_bytes(obj))
+    return _json_bytes(obj)
+
+
+def decode(payload, content_type=None):
+    """Kebalikan encode(); codec dipilih dari ContentType pesan (None = JSON).
+
+    Melempar ValueError jika payload tidak bisa di-decode.
+    """
+    codec = CODECS_BY_CONTENT_TYPE.get(content_type, CODEC_JSON) if content_type else CODEC_JSON
+    try:
+        if codec == CODEC_MSGPACK:
+            if msgpack is None:
+                raise ValueError("payload MessagePack diterima tetapi msgpack tidak terpasang")
+            return msgpack.unpackb(payload, raw=False)
+        if codec == CODEC_JSON_ZSTD:
+            if zstandard is None:
+                raise ValueError("payload zstd diterima tetapi zstandard tidak terpasang")
+            payload = _zstd_decompressor().decompress(payload)
+        if isinstance(payload, (bytes, bytearray)):
+            payload = payload.decode("utf-8")
+        return json.loads(payload)
+    except ValueError:
+        raise
+    except Exception as e:  # msgpack/zstd punya tipe exception sendiri
+        raise ValueError(f"gagal decode payload {codec}: {e}") from e
+
+
+def set_properties(publish_properties, codec=PAYLOAD_CODEC):
+    """Isi ContentType dan PayloadFormatIndicator (1 = UTF-8, 0 = biner) pada properti PUBLISH."""
+    publish_properties.ContentType = CONTENT_TYPES[codec]
+    publish_properties.PayloadFormatIndicator = 1 if codec == CODEC_JSON else 0
+    return publish_properties
+
+
+def negotiate(accept, default=CODEC_JSON):
+    """Pilih codec respons dari preferensi klien.
+
+    `accept` berupa string (dipisah koma) atau list nama codec/ContentType,
+    urut dari yang paling disukai. Tanpa preferensi, respons tetap JSON
+    supaya klien lama tidak rusak.
+    """
+    if not accept:
+        return default
+    if isinstance(accept, str):
+        accept = accept.split(",")
+    for candidate in accept:
+        candidate = str(candidate).strip().lower()
+        codec = CODECS_BY_CONTENT_TYPE.get(candidate, candidate)
+        if codec in available_codecs():
+            return codec
+    return default
+
+
+def requested_codec(properties, request_data=None):
+    """Codec respons untuk sebuah request: field "accept" di payload JSON, atau User Property "accept"."""
+    accept = request_data.get("accept") if isinstance(request_data, dict) else None
+    if not accept and properties is not None:
+        accept = dict(getattr(properties, "UserProperty", None) or []).get("accept")
+    return negotiate(accept)
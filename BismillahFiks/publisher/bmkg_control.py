@@ -0,0 +1,143 @@
+# bmkg_control.py
+# Antrian command kontrol (bmkg/control/request) di luar thread network paho.
+# Command murah (status, history) selalu didahulukan dari force_refresh yang antre,
+# force_refresh ganda untuk ADM4 yang sama digabung menjadi satu fetch, dan request
+# yang MessageExpiryInterval-nya sudah lewat dibuang alih-alih dijalankan terlambat.
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+
+log = logging.getLogger(__name__)
+
+CONTROL_WORKERS = max(2, int(os.getenv("CONTROL_WORKERS", 2)))
+CONTROL_QUEUE_SIZE = int(os.getenv("CONTROL_QUEUE_SIZE", 100))
+
+
+def request_deadline(properties):
+    """Deadline (time.monotonic) dari MessageExpiryInterval pesan MQTT 5, atau None jika tidak diset.
+
+    Broker sudah mengurangi interval dengan lama pesan menunggu di broker,
+    jadi nilai yang diterima adalah sisa umur pesan.
+    """
+    expiry = getattr(properties, "MessageExpiryInterval", None) if properties else None
+    return time.monotonic() + expiry if expiry else None
+
+
+class _ControlJob:
+    __slots__ = ("name", "handler", "key", "waiters")
+
+    def __init__(self, name, handler, key):
+        self.name = name
+        self.handler = handler
+        self.key = key
+        self.waiters = []  # (reply, deadline) per request yang digabung ke job ini
+
+
+class ControlQueue:
+    """Dua prioritas: command cepat (FIFO) dan command lambat (satu per key, FIFO).
+
+    Command lambat hanya boleh memakai `workers - 1` thread, jadi selalu ada
+    worker yang bebas untuk status meskipun beberapa refresh sedang berjalan.
+    `handler()` mengembalikan payload respons yang diteruskan ke `reply(payload)`
+    untuk setiap request yang masih berlaku (payload {"error": ...} jika handler gagal).
+    """
+
+    def __init__(self, workers=CONTROL_WORKERS, max_queue=CONTROL_QUEUE_SIZE):
+        self.max_queue = max_queue
+        self.max_slow_running = workers - 1
+        self._cond = threading.Condition()
+        self._fast = deque()
+        self._slow = OrderedDict()  # key -> _ControlJob yang menunggu
+        self._running_slow = {}  # key -> _ControlJob yang sedang berjalan
+        self.collapsed = 0
+        self.expired = 0
+        self.rejected = 0
+        for index in range(workers):
+            threading.Thread(target=self._worker, name=f"bmkg-control-{index}", daemon=True).start()
+
+    def submit(self, name, handler, reply=None, deadline=None, key=None, slow=False):
+        """Antrekan command; False jika antrian penuh (pemanggil sebaiknya menjawab 'sibuk')."""
+        with self._cond:
+            if slow:
+                # Refresh yang sama sedang antre atau berjalan: cukup tunggu hasil job itu
+                job = self._slow.get(key) or self._running_slow.get(key)
+                if job is not None:
+                    job.waiters.append((reply, deadline))
+                    self.collapsed += 1
+                    return True
+            if len(self._fast) + len(self._slow) >= self.max_queue:
+                self.rejected += 1
+                return False
+            job = _ControlJob(name, handler, key)
+            job.waiters.append((reply, deadline))
+            if slow:
+                self._slow[key] = job
+            else:
+                self._fast.append(job)
+            self._cond.notify()
+        return True
+
+    def _next_job_locked(self):
+        if self._fast:
+            return self._fast.popleft(), False
+        if self._slow and len(self._running_slow) < self.max_slow_running:
+            key, job = self._slow.popitem(last=False)
+            self._running_slow[key] = job
+            return job, True
+        return None, False
+
+    def _live_waiters_locked(self, job):
+        now = time.monotonic()
+        live = [(reply, deadline) for reply, deadline in job.waiters if deadline is None or deadline > now]
+        self.expired += len(job.waiters) - len(live)
+        job.waiters = live
+        return live
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                job, is_slow = self._next_job_locked()
+                while job is None:
+                    self._cond.wait()
+                    job, is_slow = self._next_job_locked()
+                expired_while_queued = not self._live_waiters_locked(job)
+
+            result = None
+            if not expired_while_queued:
+                try:
+                    result = job.handler()
+                except Exception as e:
+                    log.exception("Error while running '%s': %s", job.name, e)
+                    result = {"error": f"Command '{job.name}' failed: {e}"}
+            with self._cond:
+                if is_slow:
+                    self._running_slow.pop(job.key, None)
+                    self._cond.notify_all()
+                # Request yang digabung saat job berjalan ikut menerima hasilnya
+                waiters = [] if expired_while_queued else self._live_waiters_locked(job)
+            if expired_while_queued:
+                log.warning("'%s' dropped: MessageExpiryInterval passed while queued", job.name)
+            for reply, _ in waiters:
+                if reply:
+                    try:
+                        reply(result)
+                    except Exception as e:
+                        log.exception("Error while replying to '%s': %s", job.name, e)
+
+    def queue_depth(self):
+        """Jumlah command yang menunggu worker (tidak termasuk yang sedang berjalan)."""
+        with self._cond:
+            return len(self._fast) + len(self._slow)
+
+    def stats(self):
+        with self._cond:
+            return {
+                "queued_fast": len(self._fast),
+                "queued_slow": len(self._slow),
+                "running_slow": len(self._running_slow),
+                "collapsed": self.collapsed,
+                "expired": self.expired,
+                "rejected": self.rejected,
+            }
@@ -0,0 +1,59 @@
+# GENERATED COPY dari ../../bmkg_dedup.py oleh sync_bmkg_modules.py -- JANGAN DIEDIT DI SINI.
+# Ubah file di root repo lalu jalankan: python sync_bmkg_modules.py
+# bmkg_dedup.py
+# Deteksi perubahan per topik: payload yang isinya sama dengan publikasi terakhir
+# tidak dipublish ulang, kecuali sudah lewat batas keep-alive.
+import hashlib
+import os
+import threading
+import time
+
+# Payload yang tidak berubah tetap dipublish ulang paling lambat setiap interval ini
+PUBLISH_KEEPALIVE_SECONDS = int(os.getenv("PUBLISH_KEEPALIVE_SECONDS", 6 * 3600))
+
+
+class PayloadHashStore:
+    def __init__(self, keepalive_seconds=PUBLISH_KEEPALIVE_SECONDS):
+        self.keepalive_seconds = keepalive_seconds
+        self._entries = {}  # topic -> (digest, waktu publish terakhir)
+        self._lock = threading.Lock()
+        self.published = 0
+        self.skipped = 0
+
+    @staticmethod
+    def digest(payload):
+        if isinstance(payload, str):
+            payload = payload.encode()
+        return hashlib.blake2b(payload, digest_size=16).digest()
+
+    def check(self, topic, payload):
+        """Kembalikan (perlu_publish, digest) untuk payload yang akan dikirim ke `topic`."""
+        payload_digest = self.digest(payload)
+        with self._lock:
+            previous = self._entries.get(topic)
+            if (previous and previous[0] == payload_digest
+                    and time.monotonic() - previous[1] < self.keepalive_seconds):
+                self.skipped += 1
+                return False, payload_digest
+        return True, payload_digest
+
+    def record(self, topic, payload_digest):
+        """Catat publikasi yang berhasil (dipanggil setelah publish sukses)."""
+        with self._lock:
+            self._entries[topic] = (payload_digest, time.monotonic())
+            self.published += 1
+
+    def forget(self, topics):
+        """Lupakan hash topik tertentu, mis. wilayah yang pindah ke node lain."""
+        with self._lock:
+            for topic in topics:
+                self._entries.pop(topic, None)
+
+    def clear(self):
+        """Lupakan semua hash, mis. setelah reconnect ke broker yang mungkin kehilangan retained message."""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {"topics": len(self._entries), "published": self.published, "skipped_unchanged": self.skipped}
@@ -0,0 +1,94 @@
+# GENERATED COPY dari ../../bmkg_forecast.py oleh sync_bmkg_modules.py -- JANGAN DIEDIT DI SINI.
+# Ubah file di root repo lalu jalankan: python sync_bmkg_modules.py
+# bmkg_forecast.py
+# Normalisasi respons BMKG: dokumen mentah (lokasi + data[0].cuaca bertingkat per hari)
+# diubah sekali per fetch menjadi record prakiraan ringkas yang hanya berisi field
+# yang dipakai dashboard. Semua publisher mengirim bentuk ini, bukan JSON mentah BMKG.
+import os
+
+FORECAST_FIELDS = ("datetime", "local_datetime", "t", "hu", "ws", "wd", "weather_desc")
+LOCATION_FIELDS = ("adm4", "desa", "kecamatan", "kotkab", "provinsi")
+# Field BMKG tambahan yang ikut dikirim; default-nya field yang dibaca WeatherCard.vue (dashboard Vue).
+# Isi kosong untuk hanya mengirim field inti.
+FORECAST_EXTRA_FIELDS = tuple(
+    field.strip() for field in os.getenv("FORECAST_EXTRA_FIELDS", "image,tcc,wd_card,vs_text").split(",") if field.strip()
+)
+
+
+def _number(value):
+    """Angka dari BMKG (kadang string); int jika bulat, None jika tidak valid."""
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return None
+    return int(number) if number.is_integer() else number
+
+
+class Forecast:
+    """Satu periode prakiraan (biasanya 3 jam). `datetime` (UTC) menjadi kunci periode."""
+
+    __slots__ = FORECAST_FIELDS + ("extra",)
+
+    def __init__(self, datetime, local_datetime, t=None, hu=None, ws=None, wd=None, weather_desc=None, extra=None):
+        self.datetime = datetime
+        self.local_datetime = local_datetime
+        self.t = t
+        self.hu = hu
+        self.ws = ws
+        self.wd = wd
+        self.weather_desc = weather_desc
+        self.extra = extra
+
+    @classmethod
+    def from_bmkg(cls, item):
+        return cls(
+            datetime=item.get("datetime") or item.get("utc_datetime"),
+            local_datetime=item.get("local_datetime"),
+            t=_number(item.get("t")),
+            hu=_number(item.get("hu")),
+            ws=_number(item.get("ws")),
+            wd=item.get("wd"),
+            weather_desc=item.get("weather_desc") or item.get("weather_desc_en"),
+            extra={field: item[field] for field in FORECAST_EXTRA_FIELDS if field in item} or None,
+        )
+
+    def to_dict(self):
+        record = {field: getattr(self, field) for field in FORECAST_FIELDS}
+        if self.extra:
+            record.update(self.extra)
+        return record
+
+
+def normalize_location(lokasi):
+    if not isinstance(lokasi, dict):
+        return {}
+    return {field: lokasi[field] for field in LOCATION_FIELDS if field in lokasi}
+
+
+def parse_bmkg_response(weather_data):
+    """(lokasi ringkas, list Forecast terurut waktu) dari respons BMKG.
+
+    Menerima dokumen resmi {"lokasi": ..., "data": [{"cuaca": [[...], ...]}]}
+    maupun list periode yang sudah datar.
+    """
+    if isinstance(weather_data, list):
+        location, raw_items = {}, weather_data
+    elif isinstance(weather_data, dict):
+        location = normalize_location(weather_data.get("lokasi"))
+        raw_items = []
+        data_list = weather_data.get("data") or []
+        if data_list and isinstance(data_list[0], dict):
+            location = location or normalize_location(data_list[0].get("lokasi"))
+            for daily_forecast_array in data_list[0].get("cuaca") or []:
+                raw_items.extend(daily_forecast_array if isinstance(daily_forecast_array, list) else [daily_forecast_array])
+    else:
+        return {}, []
+    forecasts = [Forecast.from_bmkg(item) for item in raw_items if isinstance(item, dict)]
+    forecasts.sort(key=lambda forecast: forecast.datetime or forecast.local_datetime or "")
+    return location, forecasts
+
+
+def normalize_bmkg_response(weather_data):
+    """Bentuk siap kirim dan siap cache: {"location": {...}, "forecasts": [dict, ...]}."""
+    location, forecasts = parse_bmkg_response(weather_data)
+    return {"location": location, "forecasts": [forecast.to_dict() for forecast in forecasts]}
@@ -0,0 +1,356 @@
+# GENERATED COPY dari ../../bmkg_metrics.py oleh sync_bmkg_modules.py -- JANGAN DIEDIT DI SINI.
+# Ubah file di root repo lalu jalankan: python sync_bmkg_modules.py
+# bmkg_metrics.py
+# Metrik ala Prometheus (counter, gauge, histogram) tanpa dependensi tambahan.
+# Semua metrik terdaftar di registry modul ini dan diekspor dalam text exposition
+# format Prometheus lewat endpoint HTTP lokal: http://METRICS_ADDR:METRICS_PORT/metrics
+# Nama metrik sama di semua publisher/responder supaya satu dashboard bisa dipakai untuk semuanya.
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+log = logging.getLogger(__name__)
+
+# 0 / kosong: endpoint tidak dijalankan (metrik tetap dihitung di memori)
+METRICS_PORT = int(os.getenv("METRICS_PORT") or 0)
+METRICS_ADDR = os.getenv("METRICS_ADDR", "127.0.0.1")
+# Detik; cukup rapat di bawah 1 s untuk cache/broker lokal, dan sampai timeout BMKG di atasnya
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60)
+# Request yang tidak pernah dijawab dilupakan setelah ini (dan jumlahnya dibatasi)
+REQUEST_TIMER_TTL_SECONDS = 300
+REQUEST_TIMER_MAX_PENDING = 10000
+
+_registry = OrderedDict()  # nama -> metrik, urutan sesuai pendaftaran
+_registry_lock = threading.Lock()
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs += [f'{name}="{_escape(value)}"' for name, value in extra]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}  # tuple nilai label -> nilai
+        with _registry_lock:
+            if name in _registry:
+                raise ValueError(f"Metric {name} is already registered")
+            _registry[name] = self
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _samples(self):
+        with self._lock:
+            return [(self.name, key, (), value) for key, value in self._values.items()]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for sample_name, key, extra, value in self._samples():
+            lines.append(f"{sample_name}{_format_labels(self.labelnames, key, extra)} {_format_value(value)}")
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        if not self.labelnames:
+            self._values[()] = 0  # Counter tanpa label langsung terlihat di scrape, mulai dari 0
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """Gauge yang di-set langsung, atau dibaca dari fungsi saat scrape lewat `set_function`."""
+
+    kind = "gauge"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._functions = {}
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set_function(self, function, **labels):
+        """Nilai gauge = function() saat scrape, mis. panjang antrian yang sudah dihitung di tempat lain."""
+        key = self._key(labels)
+        with self._lock:
+            self._functions[key] = function
+
+    def _samples(self):
+        with self._lock:
+            functions = list(self._functions.items())
+            samples = [(self.name, key, (), value) for key, value in self._values.items() if key not in self._functions]
+        for key, function in functions:
+            try:
+                samples.append((self.name, key, (), function()))
+            except Exception as e:
+                log.warning("Cannot read %s%s: %s", self.name, dict(zip(self.labelnames, key)), e)
+        return samples
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]  # [count per bucket, sum, count]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][index] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    def time(self, **labels):
+        """Context manager: catat durasi blok `with` dalam detik."""
+        return _Timer(self, labels)
+
+    def _samples(self):
+        samples = []
+        with self._lock:
+            states = [(key, list(state[0]), state[1], state[2]) for key, state in self._values.items()]
+        for key, bucket_counts, total, count in states:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, bucket_counts):
+                cumulative += bucket_count
+                samples.append((f"{self.name}_bucket", key, (("le", _format_value(bound)),), cumulative))
+            samples.append((f"{self.name}_sum", key, (), total))
+            samples.append((f"{self.name}_count", key, (), count))
+        return samples
+
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.monotonic()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.monotonic() - self.started, **self.labels)
+        return False
+
+
+class RequestTimer:
+    """Latensi request -> respons dengan kunci CorrelationData MQTT 5.
+
+    `start()` dipanggil saat request diterima (thread network paho), `finish()`
+    saat respons dengan CorrelationData yang sama dipublish (bisa di thread lain).
+    """
+
+    def __init__(self, histogram, ttl_seconds=REQUEST_TIMER_TTL_SECONDS, max_pending=REQUEST_TIMER_MAX_PENDING):
+        self.histogram = histogram
+        self.ttl_seconds = ttl_seconds
+        self.max_pending = max_pending
+        self._lock = threading.Lock()
+        self._pending = OrderedDict()  # (kind, correlation_data) -> waktu request diterima
+
+    def start(self, correlation_data, kind):
+        if not correlation_data:
+            return
+        now = time.monotonic()
+        with self._lock:
+            self._pending[(kind, correlation_data)] = now
+            self._pending.move_to_end((kind, correlation_data))
+            while self._pending:
+                oldest_key, started = next(iter(self._pending.items()))
+                if len(self._pending) <= self.max_pending and now - started < self.ttl_seconds:
+                    break
+                del self._pending[oldest_key]
+
+    def finish(self, correlation_data, kind, outcome="success"):
+        if not correlation_data:
+            return None
+        with self._lock:
+            started = self._pending.pop((kind, correlation_data), None)
+        if started is None:
+            return None
+        elapsed = time.monotonic() - started
+        self.histogram.observe(elapsed, kind=kind, outcome=outcome)
+        return elapsed
+
+    def pending(self):
+        with self._lock:
+            return len(self._pending)
+
+
+class InflightTracker:
+    """Jumlah publish QoS > 0 yang sudah dikirim tapi belum di-ACK broker.
+
+    Panggil `sent(result, qos)` setelah client.publish dan pasang `on_publish`
+    sebagai callback paho (atau panggil dari callback yang sudah ada).
+    """
+
+    def __init__(self, max_early_acks=1000):
+        self.max_early_acks = max_early_acks
+        self._lock = threading.Lock()
+        self._pending = set()
+        self._early_acks = set()  # PUBACK bisa datang sebelum sent() sempat mencatat mid
+
+    def sent(self, result, qos):
+        if qos == 0 or result.rc != 0:
+            return
+        with self._lock:
+            if result.mid in self._early_acks:
+                self._early_acks.discard(result.mid)
+            else:
+                self._pending.add(result.mid)
+
+    def on_publish(self, client, userdata, mid, *args):
+        with self._lock:
+            if mid in self._pending:
+                self._pending.discard(mid)
+                return
+            if len(self._early_acks) >= self.max_early_acks:
+                self._early_acks.clear()
+            self._early_acks.add(mid)
+
+    def reset(self):
+        """Koneksi putus: PUBACK untuk pesan lama tidak akan datang lagi."""
+        with self._lock:
+            self._pending.clear()
+            self._early_acks.clear()
+
+    def count(self):
+        with self._lock:
+            return len(self._pending)
+
+
+# --- Metrik bersama ---
+# Hanya berlabel status: label per ADM4 membuat satu deret histogram per wilayah (ribuan deret)
+BMKG_FETCH_DURATION = Histogram(
+    "bmkg_fetch_duration_seconds", "Latency of BMKG API calls (including retries) by final HTTP status.", ["status"])
+BMKG_FETCHES = Counter("bmkg_fetches_total", "BMKG API calls by final HTTP status ('error' for connection failures).", ["status"])
+CACHE_LOOKUPS = Counter(
+    "bmkg_cache_lookups_total", "Responder cache lookups (hit, stale, miss) and 304 revalidations; hit ratio = hit / (hit + stale + miss).",
+    ["result"])
+MQTT_PUBLISHED = Counter("mqtt_published_messages_total", "Messages handed to the MQTT client, by kind.", ["kind"])
+MQTT_INFLIGHT = Gauge("mqtt_inflight_messages", "QoS > 0 publishes still waiting for PUBACK/PUBCOMP.")
+MQTT_RECONNECTS = Counter("mqtt_reconnects_total", "Successful MQTT connections after the first one.")
+MQTT_DISCONNECTS = Counter("mqtt_disconnects_total", "MQTT connection losses.")
+QUEUE_DEPTH = Gauge("bmkg_queue_depth", "Work waiting for a worker thread, per queue.", ["queue"])
+REQUEST_DURATION = Histogram(
+    "bmkg_request_duration_seconds", "Time from receiving a request to publishing its response, keyed by CorrelationData.",
+    ["kind", "outcome"])
+
+request_timer = RequestTimer(REQUEST_DURATION)
+inflight_tracker = InflightTracker()
+MQTT_INFLIGHT.set_function(inflight_tracker.count)
+
+_connected_once = False
+
+
+def record_fetch(status, seconds):
+    """Satu pemanggilan BMKG selesai (status HTTP akhir, atau 'error' jika koneksi gagal)."""
+    BMKG_FETCHES.inc(status=status)
+    BMKG_FETCH_DURATION.observe(seconds, status=status)
+
+
+def record_connect():
+    """Panggil dari on_connect (rc == 0); koneksi kedua dan seterusnya dihitung sebagai reconnect."""
+    global _connected_once
+    if _connected_once:
+        MQTT_RECONNECTS.inc()
+    _connected_once = True
+
+
+def record_disconnect():
+    """Panggil dari on_disconnect."""
+    MQTT_DISCONNECTS.inc()
+    inflight_tracker.reset()
+
+
+def track_publish(result, qos, kind):
+    """Catat hasil client.publish: rate publish per jenis dan pesan in-flight."""
+    if result.rc == 0:
+        MQTT_PUBLISHED.inc(kind=kind)
+    inflight_tracker.sent(result, qos)
+    return result
+
+
+def render():
+    with _registry_lock:
+        metrics = list(_registry.values())
+    lines = []
+    for metric in metrics:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/metrics", "/"):
+            self.send_error(404)
+            return
+        body = render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # Scrape setiap beberapa detik tidak perlu dicetak
+
+
+def start_http_server(port=METRICS_PORT, addr=METRICS_ADDR):
+    """Jalankan endpoint /metrics di thread daemon; None jika dinonaktifkan atau port tidak bisa dipakai."""
+    if not port:
+        return None
+    try:
+        server = ThreadingHTTPServer((addr, port), _MetricsHandler)
+    except OSError as e:
+        log.warning("Cannot listen on %s:%s: %s. Metrics endpoint disabled.", addr, port, e)
+        return None
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="bmkg-metrics", daemon=True).start()
+    log.info("Serving Prometheus metrics on http://%s:%s/metrics", addr, port)
+    return server
@@ -0,0 +1,232 @@
+# GENERATED COPY dari ../../bmkg_store.py oleh sync_bmkg_modules.py -- JANGAN DIEDIT DI SINI.
+# Ubah file di root repo lalu jalankan: python sync_bmkg_modules.py
+# bmkg_store.py
+# Penyimpanan prakiraan di disk dengan kunci (ADM4, waktu prakiraan): SQLite mode WAL
+# (penulis tidak memblokir pembaca) dengan mmap untuk pembacaan. Dipakai untuk warm
+# start setelah restart, menjawab request dari data terakhir saat BMKG lambat/gagal,
+# dan menyimpan riwayat prakiraan untuk dashboard.
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import Counter, namedtuple
+from datetime import datetime
+
+log = logging.getLogger(__name__)
+
+# Kosongkan untuk menonaktifkan store (publisher kembali murni in-memory)
+FORECAST_STORE_PATH = os.getenv("FORECAST_STORE_PATH", "bmkg_forecasts.sqlite3")
+FORECAST_STORE_MMAP_BYTES = int(os.getenv("FORECAST_STORE_MMAP_BYTES", 256 * 1024 * 1024))
+# Periode prakiraan yang lebih tua dari ini dihapus dari riwayat
+FORECAST_STORE_RETENTION_DAYS = int(os.getenv("FORECAST_STORE_RETENTION_DAYS", 30))
+PRUNE_INTERVAL_SECONDS = 3600
+# Resolusi asli prakiraan BMKG; bucket downsampling tidak pernah lebih kecil dari ini
+NATIVE_RESOLUTION_SECONDS = 3 * 3600
+SERIES_NUMERIC_FIELDS = ("t", "hu", "ws")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS locations (
+    adm4 TEXT PRIMARY KEY,
+    location TEXT NOT NULL,
+    fetched_at REAL NOT NULL,
+    first_datetime TEXT,
+    last_datetime TEXT,
+    etag TEXT,
+    last_modified TEXT
+);
+CREATE TABLE IF NOT EXISTS forecasts (
+    adm4 TEXT NOT NULL,
+    datetime TEXT NOT NULL,
+    fetched_at REAL NOT NULL,
+    record TEXT NOT NULL,
+    PRIMARY KEY (adm4, datetime)
+) WITHOUT ROWID;
+"""
+
+# data: {"location": {...}, "forecasts": [...]} (bentuk bmkg_forecast.normalize_bmkg_response)
+StoredForecast = namedtuple("StoredForecast", ["data", "fetched_at", "etag", "last_modified"])
+
+
+def _json(obj):
+    return json.dumps(obj, separators=(",", ":"), ensure_ascii=False)
+
+
+class ForecastStore:
+    """Prakiraan terakhir dan riwayat per ADM4 di satu file SQLite.
+
+    Setiap thread memakai koneksinya sendiri; mode WAL membuat pembacaan
+    (request, status) tidak menunggu penulisan hasil fetch.
+    """
+
+    def __init__(self, path=FORECAST_STORE_PATH, retention_days=FORECAST_STORE_RETENTION_DAYS):
+        self.path = path
+        self.retention_days = retention_days
+        self._local = threading.local()
+        self._prune_lock = threading.Lock()
+        self._last_prune = 0.0
+        connection = self._connection()
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.executescript(SCHEMA)
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=10)
+            connection.execute("PRAGMA synchronous=NORMAL")  # Aman untuk WAL; commit tidak fsync setiap kali
+            connection.execute(f"PRAGMA mmap_size={FORECAST_STORE_MMAP_BYTES}")
+            self._local.connection = connection
+        return connection
+
+    def save(self, adm4, data, response_headers=None, fetched_at=None):
+        """Simpan hasil fetch yang sudah dinormalisasi; periode yang sama ditimpa versi terbaru."""
+        forecasts = [forecast for forecast in data.get("forecasts") or [] if forecast.get("datetime")]
+        if not forecasts:
+            return
+        headers = response_headers or {}
+        fetched_at = fetched_at or time.time()
+        connection = self._connection()
+        with connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO locations VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (adm4, _json(data.get("location") or {}), fetched_at, forecasts[0]["datetime"],
+                 forecasts[-1]["datetime"], headers.get("ETag"), headers.get("Last-Modified")),
+            )
+            connection.executemany(
+                "INSERT OR REPLACE INTO forecasts VALUES (?, ?, ?, ?)",
+                [(adm4, forecast["datetime"], fetched_at, _json(forecast)) for forecast in forecasts],
+            )
+        self._maybe_prune()
+
+    def touch(self, adm4, response_headers=None):
+        """BMKG menjawab 304: data tersimpan masih berlaku, hanya waktu fetch yang diperbarui."""
+        headers = response_headers or {}
+        connection = self._connection()
+        with connection:
+            connection.execute(
+                "UPDATE locations SET fetched_at = ?, etag = COALESCE(?, etag), last_modified = COALESCE(?, last_modified) WHERE adm4 = ?",
+                (time.time(), headers.get("ETag"), headers.get("Last-Modified"), adm4),
+            )
+
+    def latest(self, adm4):
+        """Prakiraan dari fetch terakhir untuk `adm4` sebagai StoredForecast, atau None."""
+        connection = self._connection()
+        row = connection.execute(
+            "SELECT location, fetched_at, first_datetime, last_datetime, etag, last_modified FROM locations WHERE adm4 = ?",
+            (adm4,),
+        ).fetchone()
+        if row is None:
+            return None
+        location, fetched_at, first_datetime, last_datetime, etag, last_modified = row
+        records = connection.execute(
+            "SELECT record FROM forecasts WHERE adm4 = ? AND datetime BETWEEN ? AND ? ORDER BY datetime",
+            (adm4, first_datetime, last_datetime),
+        ).fetchall()
+        data = {"location": json.loads(location), "forecasts": [json.loads(record) for (record,) in records]}
+        return StoredForecast(data, fetched_at, etag, last_modified)
+
+    def history(self, adm4, since=None, until=None):
+        """Iterator record prakiraan `adm4` (termasuk periode yang sudah lewat), urut waktu.
+
+        `since`/`until` berformat sama dengan field "datetime" BMKG (UTC, "YYYY-MM-DD HH:MM:SS").
+        """
+        cursor = self._connection().execute(
+            "SELECT record FROM forecasts WHERE adm4 = ? AND datetime >= ? AND datetime <= ? ORDER BY datetime",
+            (adm4, since or "", until or "9999"),
+        )
+        for (record,) in cursor:
+            yield json.loads(record)
+
+    def adm4_codes(self):
+        """{adm4: fetched_at} untuk semua wilayah yang pernah disimpan."""
+        return dict(self._connection().execute("SELECT adm4, fetched_at FROM locations"))
+
+    def _maybe_prune(self):
+        if time.monotonic() - self._last_prune < PRUNE_INTERVAL_SECONDS or not self._prune_lock.acquire(blocking=False):
+            return
+        try:
+            self._last_prune = time.monotonic()
+            cutoff = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(time.time() - self.retention_days * 86400))
+            connection = self._connection()
+            with connection:
+                deleted = connection.execute("DELETE FROM forecasts WHERE datetime < ?", (cutoff,)).rowcount
+            if deleted:
+                log.info("Pruned %s forecast periods older than %s days", deleted, self.retention_days)
+        finally:
+            self._prune_lock.release()
+
+    def stats(self):
+        connection = self._connection()
+        regions, = connection.execute("SELECT COUNT(*) FROM locations").fetchone()
+        periods, = connection.execute("SELECT COUNT(*) FROM forecasts").fetchone()
+        return {"path": self.path, "regions": regions, "forecast_periods": periods,
+                "size_bytes": os.path.getsize(self.path) if os.path.exists(self.path) else 0}
+
+
+def _timestamp(value):
+    try:
+        return datetime.strptime(value, "%Y-%m-%d %H:%M:%S").timestamp()
+    except (TypeError, ValueError):
+        return None
+
+
+def downsample(records, max_points):
+    """Ringkas record prakiraan menjadi paling banyak `max_points` titik dengan bucket waktu sama lebar.
+
+    Field numerik dirata-rata, weather_desc diambil yang paling sering muncul.
+    Mengembalikan (titik, lebar bucket dalam detik).
+    """
+    timed = [(_timestamp(record.get("datetime")), record) for record in records]
+    timed = [(timestamp, record) for timestamp, record in timed if timestamp is not None]
+    if not timed:
+        return [], NATIVE_RESOLUTION_SECONDS
+    # Lebar bucket = kelipatan resolusi asli, supaya setiap bucket berisi jumlah periode yang sama
+    periods = int((timed[-1][0] - timed[0][0]) // NATIVE_RESOLUTION_SECONDS) + 1
+    bucket_seconds = NATIVE_RESOLUTION_SECONDS * (max(1, -(-periods // max_points)) if max_points > 0 else 1)
+
+    buckets = {}
+    for timestamp, record in timed:
+        buckets.setdefault(int((timestamp - timed[0][0]) // bucket_seconds), []).append(record)
+    points = []
+    for bucket in buckets.values():
+        point = {"datetime": bucket[0]["datetime"], "local_datetime": bucket[0].get("local_datetime"), "n": len(bucket)}
+        for field in SERIES_NUMERIC_FIELDS:
+            values = [record[field] for record in bucket if isinstance(record.get(field), (int, float))]
+            point[field] = round(sum(values) / len(values), 1) if values else None
+        descriptions = Counter(record.get("weather_desc") for record in bucket if record.get("weather_desc"))
+        point["weather_desc"] = descriptions.most_common(1)[0][0] if descriptions else None
+        points.append(point)
+    return points, bucket_seconds
+
+
+def chunk_points(header, points, encoder, max_bytes, header_reserve=512):
+    """Pecah `points` menjadi beberapa payload dict(header, points=[...]) yang masing-masing
+    (setelah di-encode dengan `encoder`) kira-kira tidak lebih dari `max_bytes`.
+
+    `header_reserve` byte disisakan untuk header dan field chunk/chunks. Titik yang
+    sendirian sudah melebihi batas tetap dikirim sebagai satu chunk. Selalu ada
+    minimal satu chunk (bisa kosong) supaya peminta tetap menerima header.
+    """
+    chunks = []
+    current, current_size = [], 0
+    for point in points:
+        point_size = len(encoder(point)) + 1  # +1 untuk pemisah list
+        if current and current_size + point_size > max_bytes - header_reserve:
+            chunks.append(dict(header, points=current))
+            current, current_size = [], 0
+        current.append(point)
+        current_size += point_size
+    chunks.append(dict(header, points=current))
+    return chunks
+
+
+def open_store(path=FORECAST_STORE_PATH):
+    """ForecastStore di `path`, atau None jika dinonaktifkan atau file tidak bisa dibuka."""
+    if not path:
+        return None
+    try:
+        return ForecastStore(path)
+    except sqlite3.Error as e:
+        log.warning("Cannot open forecast store %s: %s. Continuing without it.", path, e)
+        return None
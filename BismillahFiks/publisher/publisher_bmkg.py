@@ -8,10 +8,26 @@ import time
 import schedule
 from datetime import datetime
 import uuid
+import threading
+import signal
+import logging
 from dotenv import load_dotenv
-
 # Load environment variables from .env file in the current directory
+# (sebelum modul bmkg_* di bawah membaca konfigurasinya saat di-import)
 load_dotenv()
+from bmkg_logging import setup_logging
+from bmkg_ratelimit import run_fetch_cycle
+import bmkg_http
+from bmkg_dedup import PayloadHashStore
+import bmkg_delta
+import bmkg_codec
+import bmkg_metrics
+from bmkg_forecast import parse_bmkg_response
+from bmkg_sharding import ShardMembership
+from bmkg_store import open_store, downsample, chunk_points
+from bmkg_control import ControlQueue, request_deadline
+
+log = logging.getLogger("bmkg.publisher")
 
 # --- Konfigurasi (diambil dari .env) ---
 # MQTT Broker Settings
@@ -30,12 +46,56 @@ ADM4_CODES = [code.strip() for code in ADM4_CODES_STR.split(',') if code.strip()
 ADM4_CODES_FOR_API = [code.replace(".", "") for code in ADM4_CODES]
 
 FETCH_INTERVAL_SECONDS = int(os.getenv("FETCH_INTERVAL_SECONDS", 3600))
+# Saat start, prakiraan tersimpan yang lebih muda dari ini langsung dipublish sebelum siklus fetch pertama
+WARM_START_MAX_AGE_SECONDS = int(os.getenv("WARM_START_MAX_AGE_SECONDS", 6 * 3600))
+
+# Command 'history': jumlah titik maksimum setelah downsampling, rentang default,
+# dan ukuran payload maksimum per pesan respons (di bawah max packet size broker)
+HISTORY_MAX_POINTS = int(os.getenv("HISTORY_MAX_POINTS", 500))
+HISTORY_DEFAULT_DAYS = int(os.getenv("HISTORY_DEFAULT_DAYS", 7))
+HISTORY_CHUNK_MAX_BYTES = int(os.getenv("HISTORY_CHUNK_MAX_BYTES", 64 * 1024))
 
 # Publisher Settings
 DATA_QOS_LEVEL = int(os.getenv("DATA_QOS_LEVEL", 1))
 REQUEST_TOPIC_CONTROL = os.getenv("REQUEST_TOPIC_CONTROL", "bmkg/control/request")
 
-API_BASE_URL = "https://api.bmkg.go.id/publik/prakiraan-cuaca"
+API_BASE_URL = os.getenv("BMKG_API_URL", "https://api.bmkg.go.id/publik/prakiraan-cuaca")
+
+# Diisi supervisor_bmkg.py saat publisher berjalan sebagai worker (kosong jika berdiri sendiri)
+PUBLISHER_WORKER_NAME = os.getenv("PUBLISHER_WORKER_NAME", "")
+# Saat SIGTERM, siklus fetch yang sedang berjalan ditunggu paling lama selama ini
+SHUTDOWN_DRAIN_TIMEOUT_SECONDS = float(os.getenv("SHUTDOWN_DRAIN_TIMEOUT_SECONDS", 30))
+
+# Ringkasan siklus fetch penuh terakhir (dilaporkan lewat command 'status')
+last_fetch_cycle = None
+fetch_cycle_lock = threading.Lock()
+# Satu fetch/publish per wilayah pada satu waktu (siklus vs force_refresh), supaya delta/dedup tidak saling timpa
+region_locks = {}
+region_locks_guard = threading.Lock()
+# Di-set oleh SIGTERM: tidak ada siklus baru, kode yang belum dimulai dilewati
+shutdown_requested = threading.Event()
+# Hash payload terakhir per topik; prakiraan yang sama tidak dipublish ulang sampai PUBLISH_KEEPALIVE_SECONDS
+published_payloads = PayloadHashStore()
+# Snapshot/delta terakhir per topik (hanya dipakai jika DELTA_PUBLISHING=true)
+delta_tracker = bmkg_delta.DeltaTracker(encoder=bmkg_codec.encode)
+# Command kontrol: status didahulukan, force_refresh ganda digabung, request kedaluwarsa dibuang
+control_queue = ControlQueue()
+bmkg_metrics.QUEUE_DEPTH.set_function(control_queue.queue_depth, queue="control")
+# Prakiraan terakhir dan riwayat per ADM4 di disk (FORECAST_STORE_PATH), untuk warm start setelah restart
+forecast_store = open_store()
+
+def on_shard_rebalance(gained, lost):
+    # Wilayah yang pindah ke node lain dilupakan; wilayah yang diambil alih langsung di-fetch
+    published_payloads.forget([f"bmkg/prakiraan/{adm4_code}" for adm4_code in lost])
+    for adm4_code in lost:
+        delta_tracker.invalidate(f"bmkg/prakiraan/{adm4_code}")
+    if gained:
+        log.info("Shard rebalance: taking over %s regions %s", len(gained), gained)
+        threading.Thread(target=run_fetch_cycle, name="bmkg-rebalance", daemon=True,
+                         args=(gained, lambda adm4_code: fetch_and_publish_region(adm4_code, force=True))).start()
+
+# SHARD_GROUP diset: ADM4_CODES dibagi ke semua publisher yang hidup lewat consistent hashing
+shard_membership = ShardMembership(ADM4_CODES, on_change=on_shard_rebalance)
 
 # --- Klien MQTT ---
 publisher_id = f"bmkg-publisher-{uuid.uuid4()}"
@@ -43,14 +103,33 @@ client = mqtt.Client(client_id=publisher_id, protocol=mqtt.MQTTv5)
 
 def on_connect(client, userdata, flags, rc, properties=None):
     if rc == 0:
-        print(f"Publisher Connected to MQTT Broker (rc: {rc})!")
+        log.info("Publisher Connected to MQTT Broker (rc: %s)!", rc)
+        bmkg_metrics.record_connect()
+        published_payloads.clear() # Setelah reconnect, publikasi berikutnya selalu dikirim
+        delta_tracker.invalidate() # ... dan berupa snapshot penuh
+        shard_membership.announce(client)
         client.subscribe(REQUEST_TOPIC_CONTROL, qos=1)
-        print(f"Subscribed to control topic: {REQUEST_TOPIC_CONTROL}")
+        log.info("Subscribed to control topic: %s", REQUEST_TOPIC_CONTROL)
     else:
-        print(f"Publisher Failed to connect, return code {rc}")
+        log.error("Publisher Failed to connect, return code %s", rc)
+
+def on_disconnect(client, userdata, rc, properties=None):
+    log.warning("Publisher disconnected from MQTT Broker (rc: %s), reconnecting...", rc)
+    bmkg_metrics.record_disconnect()
+
+def region_lock(adm4_code):
+    with region_locks_guard:
+        return region_locks.setdefault(adm4_code, threading.Lock())
+
+def answers_for(adm4_code=None):
+    # SHARD_GROUP: hanya satu node yang menjawab, yaitu pemilik wilayah atau (untuk status dan
+    # kode yang tidak dipantau) node koordinator; tanpa SHARD_GROUP node ini selalu menjawab
+    if adm4_code in ADM4_CODES:
+        return shard_membership.owns(adm4_code)
+    return shard_membership.is_coordinator()
 
 def on_message_control(client, userdata, msg):
-    print(f"Control message received on topic {msg.topic}")
+    log.debug("Control message received on topic %s", msg.topic)
     try:
         payload_str = msg.payload.decode()
         request_data = json.loads(payload_str)
@@ -62,136 +141,334 @@ def on_message_control(client, userdata, msg):
         if msg.properties:
             if msg.properties.ResponseTopic:
                 response_topic = msg.properties.ResponseTopic
-                print(f"  Response Topic: {response_topic}")
+                log.debug("Response Topic: %s", response_topic)
             if msg.properties.CorrelationData:
                 correlation_data = msg.properties.CorrelationData
-                print(f"  Correlation Data: {correlation_data.decode() if isinstance(correlation_data, bytes) else correlation_data}")
+                log.debug("Correlation Data: %r", correlation_data)
 
         if not response_topic:
-            print("  No Response Topic in request, cannot reply.")
+            log.warning("No Response Topic in request, cannot reply.")
             return
 
-        response_payload = {}
+        response_codec = bmkg_codec.requested_codec(msg.properties, request_data)
+        deadline = request_deadline(msg.properties)
+
+        def reply(response_payload):
+            publish_control_response(response_topic, correlation_data, response_payload, response_codec)
+
+        adm4_requested = request_data.get("adm4") if command in ("force_refresh", "history") else None
+        if not answers_for(adm4_requested):
+            # Node lain di SHARD_GROUP yang menjawab; diam agar peminta tidak menerima dua respons
+            log.debug("%s %s is handled by another shard node, ignoring", command, adm4_requested or "")
+            return
+        # Timer dimulai setelah cek kepemilikan: node yang diam tidak pernah menyelesaikannya
+        bmkg_metrics.request_timer.start(correlation_data, "control")
+
+        # Semua command dikerjakan di antrian kontrol, thread network paho tidak pernah menunggu fetch
         if command == "status":
-            response_payload = {"status": "Publisher is running", "timestamp": datetime.now().isoformat(), "monitoring_adm4": ADM4_CODES}
-            print("  Responding to 'status' command")
+            queued = control_queue.submit("status", build_status, reply, deadline)
         elif command == "force_refresh":
-            adm4_to_refresh_with_dots = request_data.get("adm4") # Ini adalah kode dengan titik dari Streamlit
-            adm4_to_refresh_api = adm4_to_refresh_with_dots.replace(".", "") if adm4_to_refresh_with_dots else None
-            
-            if adm4_to_refresh_with_dots and adm4_to_refresh_with_dots in ADM4_CODES:
-                print(f"  Force refreshing data for {adm4_to_refresh_with_dots}")
-                fetch_and_publish_weather_data(specific_adm4_original_format=adm4_to_refresh_with_dots)
-                response_payload = {"status": f"Data refresh triggered for {adm4_to_refresh_with_dots}"}
-            else:
-                response_payload = {"error": f"Invalid or not monitored adm4 code for refresh: {adm4_to_refresh_with_dots}"}
+            adm4_to_refresh_with_dots = adm4_requested # Ini adalah kode dengan titik dari Streamlit
+            if not adm4_to_refresh_with_dots or adm4_to_refresh_with_dots not in ADM4_CODES:
+                reply({"error": f"Invalid or not monitored adm4 code for refresh: {adm4_to_refresh_with_dots}"})
+                return
+            # Refresh ganda untuk ADM4 yang sama (antre atau sedang berjalan) digabung menjadi satu fetch
+            queued = control_queue.submit("force_refresh", lambda: refresh_region(adm4_to_refresh_with_dots), reply, deadline,
+                                          key=adm4_to_refresh_with_dots, slow=True)
+        elif command == "history":
+            queued = control_queue.submit(
+                "history", lambda: publish_history_response(response_topic, correlation_data, request_data, response_codec), None, deadline)
         else:
-            response_payload = {"error": "Unknown command"}
+            reply({"error": "Unknown command"})
+            return
+
+        if not queued:
+            reply({"error": "Publisher is busy, control queue is full. Try again later."})
+
+    except json.JSONDecodeError:
+        log.warning("Error decoding JSON payload from control message.")
+    except Exception as e:
+        log.exception("Error processing control message: %s", e)
 
-        response_properties = props.Properties(PacketTypes.PUBLISH)
+def publish_control_response(response_topic, correlation_data, response_payload, response_codec):
+    response_properties = bmkg_codec.set_properties(props.Properties(PacketTypes.PUBLISH), response_codec)
+    if correlation_data:
+        response_properties.CorrelationData = correlation_data
+    bmkg_metrics.track_publish(
+        client.publish(response_topic, bmkg_codec.encode(response_payload, response_codec), qos=1, properties=response_properties), 1, "response")
+    bmkg_metrics.request_timer.finish(correlation_data, "control", "error" if "error" in response_payload else "success")
+    log.debug("Response sent to %s", response_topic)
+
+def build_status():
+    log.debug("Responding to 'status' command")
+    return {
+        "status": "Publisher is running",
+        "timestamp": datetime.now().isoformat(),
+        "monitoring_adm4": ADM4_CODES,
+        "last_fetch_cycle": last_fetch_cycle,
+        "http_pools": bmkg_http.pool_stats(),
+        "dedup": published_payloads.stats(),
+        "delta": delta_tracker.stats() if bmkg_delta.DELTA_PUBLISHING else None,
+        "shard": shard_membership.status() if shard_membership.enabled else None,
+        "worker": PUBLISHER_WORKER_NAME or None,
+        "pid": os.getpid(),
+        "store": forecast_store.stats() if forecast_store else None,
+        "control_queue": control_queue.stats(),
+    }
+
+def refresh_region(adm4_original_code):
+    log.info("Force refreshing data for %s", adm4_original_code)
+    fetch_and_publish_weather_data(specific_adm4_original_format=adm4_original_code)
+    return {"status": f"Data refresh triggered for {adm4_original_code}"}
+
+def publish_history_response(response_topic, correlation_data, request_data, response_codec):
+    # Deret waktu dari forecast store, di-downsample lalu dipecah menjadi beberapa pesan
+    # dengan CorrelationData yang sama; User Property chunk/chunks menandai urutannya
+    adm4_code = request_data.get("adm4")
+    since = request_data.get("since") or time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(time.time() - HISTORY_DEFAULT_DAYS * 86400))
+    until = request_data.get("until")
+    header = {"command": "history", "adm4": adm4_code, "since": since, "until": until}
+    if not forecast_store:
+        chunks = [dict(header, error="History is not available: FORECAST_STORE_PATH is not set")]
+    elif adm4_code not in ADM4_CODES:
+        chunks = [dict(header, error=f"Invalid or not monitored adm4 code for history: {adm4_code}")]
+    else:
+        try:
+            max_points = min(int(request_data.get("max_points") or HISTORY_MAX_POINTS), HISTORY_MAX_POINTS)
+        except (TypeError, ValueError):
+            max_points = HISTORY_MAX_POINTS
+        try:
+            points, resolution_seconds = downsample(forecast_store.history(adm4_code, since, until), max_points)
+            header.update(resolution_seconds=resolution_seconds, total_points=len(points))
+            chunks = chunk_points(header, points, lambda obj: bmkg_codec.encode(obj, response_codec), HISTORY_CHUNK_MAX_BYTES)
+        except Exception as e:
+            # ControlQueue tidak punya reply untuk history, jadi kegagalan (mis. error SQLite)
+            # dikirim sebagai satu chunk error agar peminta tetap mendapat jawaban
+            log.exception("Error building history for %s: %s", adm4_code, e)
+            chunks = [dict(header, error=f"History query failed: {e}")]
+
+    for index, chunk in enumerate(chunks):
+        chunk.update(chunk=index, chunks=len(chunks))
+        response_properties = bmkg_codec.set_properties(props.Properties(PacketTypes.PUBLISH), response_codec)
+        response_properties.UserProperty = [("chunk", str(index)), ("chunks", str(len(chunks)))]
         if correlation_data:
             response_properties.CorrelationData = correlation_data
-        
-        client.publish(response_topic, json.dumps(response_payload), qos=1, properties=response_properties)
-        print(f"  Response sent to {response_topic}")
+        bmkg_metrics.track_publish(
+            client.publish(response_topic, bmkg_codec.encode(chunk, response_codec), qos=1, properties=response_properties), 1, "response")
+    bmkg_metrics.request_timer.finish(correlation_data, "control", "error" if "error" in chunks[0] else "success")
+    log.info("History for %s sent to %s in %s chunk(s)", adm4_code, response_topic, len(chunks))
+
+def fetch_and_publish_region(adm4_original_code, force=False):
+    adm4_api_code = adm4_original_code.replace(".", "") # Hapus titik untuk URL API
+    url = f"{API_BASE_URL}?adm4={adm4_api_code}"
+
+    log.debug("Fetching for %s (API code: %s) from %s", adm4_original_code, adm4_api_code, url)
+    try:
+        with region_lock(adm4_original_code):
+            response = bmkg_http.get(url, timeout=15)
+            response.raise_for_status()
+            # Dokumen BMKG diratakan menjadi record prakiraan ringkas (hanya field yang dipakai dashboard)
+            location, forecasts = parse_bmkg_response(response.json())
+            weather_data_list = [forecast.to_dict() for forecast in forecasts]
+
+            if not weather_data_list:
+                log.warning("No data or unexpected format for %s", adm4_original_code)
+                return False
+            if forecast_store:
+                forecast_store.save(adm4_original_code, {"location": location, "forecasts": weather_data_list}, response.headers)
+            return publish_region_forecasts(adm4_original_code, weather_data_list, force)
 
+    except requests.exceptions.RequestException as e:
+        log.warning("Error fetching API data for %s: %s", adm4_original_code, e)
     except json.JSONDecodeError:
-        print("  Error decoding JSON payload from control message.")
+        log.warning("Error decoding JSON for %s", adm4_original_code)
     except Exception as e:
-        print(f"  Error processing control message: {e}")
+        log.exception("Unexpected error for %s: %s", adm4_original_code, e)
+    return False
+
+def publish_region_forecasts(adm4_original_code, weather_data_list, force=False):
+    # Topik menggunakan format asli dari .env (mungkin dengan titik)
+    topic_base = f"bmkg/prakiraan/{adm4_original_code}"
+    payload = bmkg_codec.encode(weather_data_list) # Codec dari PAYLOAD_CODEC, ditandai lewat ContentType
+    should_publish, payload_digest = published_payloads.check(topic_base, payload)
+    if not should_publish and not force:
+        log.debug("Data for %s unchanged since last publish, skipping", adm4_original_code)
+        return True
+    if bmkg_delta.DELTA_PUBLISHING:
+        if publish_snapshot_or_delta(topic_base, weather_data_list, payload, force):
+            published_payloads.record(topic_base, payload_digest)
+            return True
+        return False
+
+    pub_props = bmkg_codec.set_properties(props.Properties(PacketTypes.PUBLISH))
+    pub_props.MessageExpiryInterval = int(FETCH_INTERVAL_SECONDS * 1.5) # Pesan berlaku 1.5x interval fetch
+
+    qos_to_use = DATA_QOS_LEVEL
+    result = bmkg_metrics.track_publish(client.publish(topic_base, payload, qos=qos_to_use, properties=pub_props), qos_to_use, "forecast")
+    
+    # result.wait_for_publish(timeout=5) # Bisa digunakan untuk QoS 1 & 2
+    if result.rc == mqtt.MQTT_ERR_SUCCESS:
+        published_payloads.record(topic_base, payload_digest)
+        log.debug("Data for %s published to %s with QoS %s", adm4_original_code, topic_base, qos_to_use)
+        return True
+    log.error("Failed to publish data for %s to %s, rc: %s", adm4_original_code, topic_base, result.rc)
+    return False
 
-def fetch_and_publish_weather_data(specific_adm4_original_format=None):
-    print(f"\n[{datetime.now()}] Fetching BMKG data...")
+def publish_stored_forecasts():
+    # Warm start: wilayah milik node ini langsung mendapat data terakhir dari disk,
+    # siklus fetch pertama hanya mempublish wilayah yang datanya berubah
+    if not forecast_store:
+        return
+    stored_codes = forecast_store.adm4_codes()
+    published = 0
+    for adm4_code in shard_membership.owned():
+        fetched_at = stored_codes.get(adm4_code)
+        if fetched_at is None or time.time() - fetched_at > WARM_START_MAX_AGE_SECONDS:
+            continue
+        try:
+            with region_lock(adm4_code):
+                stored = forecast_store.latest(adm4_code)
+                if stored and publish_region_forecasts(adm4_code, stored.data["forecasts"]):
+                    published += 1
+        except Exception as e:
+            log.exception("Unexpected error publishing stored data for %s: %s", adm4_code, e)
+    log.info("Warm start: published stored forecasts for %s regions from %s", published, forecast_store.path)
+
+def publish_snapshot_or_delta(topic_base, weather_data_list, payload, force_snapshot=False):
+    # Snapshot penuh (retained) ke topic_base, atau hanya periode yang berubah ke topic_base/delta
+    update = delta_tracker.plan(topic_base, weather_data_list, payload, force_snapshot=force_snapshot)
+    pub_props = bmkg_codec.set_properties(props.Properties(PacketTypes.PUBLISH))
+    pub_props.UserProperty = bmkg_delta.user_properties(update)
+    is_snapshot = update.kind == bmkg_delta.KIND_SNAPSHOT
+    if is_snapshot:
+        # Snapshot retained harus bertahan sampai snapshot berikutnya (paling lambat satu siklus fetch
+        # setelah DELTA_SNAPSHOT_INTERVAL_SECONDS), jadi expiry-nya lebih panjang dari mode non-delta.
+        # Subscriber baru bisa menerima snapshot yang sudah beberapa jam; delta pertama sesudahnya
+        # terdeteksi bolong (seq) dan dashboard meminta force_refresh. Jika publisher mati,
+        # broker tetap membuang snapshot setelah interval ini.
+        pub_props.MessageExpiryInterval = int(bmkg_delta.DELTA_SNAPSHOT_INTERVAL_SECONDS + FETCH_INTERVAL_SECONDS * 1.5)
+    else:
+        pub_props.MessageExpiryInterval = int(FETCH_INTERVAL_SECONDS * 1.5) # Delta basi tidak berguna bagi subscriber baru
+    result = bmkg_metrics.track_publish(
+        client.publish(update.topic, update.payload, qos=DATA_QOS_LEVEL, retain=is_snapshot, properties=pub_props),
+        DATA_QOS_LEVEL, "forecast" if is_snapshot else "delta")
+    if result.rc == mqtt.MQTT_ERR_SUCCESS:
+        delta_tracker.commit(topic_base, update)
+        log.debug("Published %s #%s to %s (%s B, QoS %s)", update.kind, update.seq, update.topic, len(update.payload), DATA_QOS_LEVEL)
+        return True
+    delta_tracker.invalidate(topic_base)
+    log.error("Failed to publish %s to %s, rc: %s", update.kind, update.topic, result.rc)
+    return False
+
+def fetch_and_publish_weather_data(specific_adm4_original_format=None, spread=False):
+    global last_fetch_cycle
+    log.info("Fetching BMKG data...")
     
     codes_to_fetch_original_format = []
     if specific_adm4_original_format:
         if specific_adm4_original_format in ADM4_CODES:
              codes_to_fetch_original_format = [specific_adm4_original_format]
         else:
-            print(f"  Specific ADM4 {specific_adm4_original_format} not in monitored list. Skipping.")
+            log.warning("Specific ADM4 %s not in monitored list. Skipping.", specific_adm4_original_format)
             return
     else:
-        codes_to_fetch_original_format = ADM4_CODES
+        codes_to_fetch_original_format = shard_membership.owned()
+
+    # Fetch paralel dengan token bucket (BMKG rate limit 60/menit), pengganti jeda tetap 1.1 detik
+    # Refresh manual (force_refresh) selalu dipublish walau datanya tidak berubah
+    force_publish = bool(specific_adm4_original_format)
+    cycle = run_fetch_cycle(
+        codes_to_fetch_original_format, lambda adm4_code: fetch_and_publish_region(adm4_code, force=force_publish),
+        interval_seconds=FETCH_INTERVAL_SECONDS, spread=spread, stop_event=shutdown_requested,
+    )
+    if not specific_adm4_original_format:
+        last_fetch_cycle = cycle
+    log.info("Data fetching cycle complete: %s/%s succeeded in %ss.", cycle['succeeded'], cycle['codes'], cycle['duration_seconds'])
 
-    for adm4_original_code in codes_to_fetch_original_format:
-        adm4_api_code = adm4_original_code.replace(".", "") # Hapus titik untuk URL API
-        url = f"{API_BASE_URL}?adm4={adm4_api_code}"
-        # Topik menggunakan format asli dari .env (mungkin dengan titik)
-        topic_base = f"bmkg/prakiraan/{adm4_original_code}" 
+def handle_shutdown_signal(signum, frame):
+    log.info("Signal %s received, draining: no new fetch cycles will start.", signum)
+    shutdown_requested.set()
 
-        print(f"  Fetching for {adm4_original_code} (API code: {adm4_api_code}) from {url}")
+def run_scheduled_fetch_cycle():
+    # Siklus berjalan di thread sendiri agar jadwal berikutnya dihitung dari awal siklus,
+    # bukan dari akhir siklus yang sudah disebar sepanjang interval
+    if shutdown_requested.is_set():
+        return
+    if not fetch_cycle_lock.acquire(blocking=False):
+        log.warning("Previous fetch cycle is still running, skipping this scheduled run.")
+        return
+
+    def cycle_worker():
         try:
-            response = requests.get(url, timeout=15)
-            response.raise_for_status()
-            weather_data_list = response.json()
-
-            if not isinstance(weather_data_list, list) or not weather_data_list:
-                print(f"    No data or unexpected format for {adm4_original_code}")
-                continue
-            
-            payload = json.dumps(weather_data_list)
-            pub_props = props.Properties(PacketTypes.PUBLISH)
-            pub_props.MessageExpiryInterval = int(FETCH_INTERVAL_SECONDS * 1.5) # Pesan berlaku 1.5x interval fetch
-
-            qos_to_use = DATA_QOS_LEVEL
-            result = client.publish(topic_base, payload, qos=qos_to_use, properties=pub_props)
-            
-            # result.wait_for_publish(timeout=5) # Bisa digunakan untuk QoS 1 & 2
-            if result.rc == mqtt.MQTT_ERR_SUCCESS:
-                print(f"    Data for {adm4_original_code} published to {topic_base} with QoS {qos_to_use}")
-            else:
-                print(f"    Failed to publish data for {adm4_original_code} to {topic_base}, rc: {result.rc}")
-
-            time.sleep(1.1) # Jeda antar request API (BMKG rate limit 60/menit)
-
-        except requests.exceptions.RequestException as e:
-            print(f"    Error fetching API data for {adm4_original_code}: {e}")
-        except json.JSONDecodeError:
-            print(f"    Error decoding JSON for {adm4_original_code}")
-        except Exception as e:
-            print(f"    Unexpected error for {adm4_original_code}: {e}")
-    print(f"[{datetime.now()}] Data fetching cycle complete.")
+            fetch_and_publish_weather_data(spread=True)
+        finally:
+            fetch_cycle_lock.release()
+
+    threading.Thread(target=cycle_worker, name="bmkg-fetch-cycle", daemon=True).start()
 
 if __name__ == "__main__":
+    setup_logging()
     if not ADM4_CODES:
-        print("ADM4_CODES_LIST tidak diset di file publisher/.env atau kosong. Publisher tidak akan mengambil data.")
+        log.error("ADM4_CODES_LIST tidak diset di file publisher/.env atau kosong. Publisher tidak akan mengambil data.")
         exit()
 
     if USE_TLS:
         if not CA_CERT_PATH or not os.path.exists(CA_CERT_PATH):
-            print(f"USE_TLS is True, but CA_CERT_PATH '{CA_CERT_PATH}' is not set or file does not exist. Exiting.")
+            log.error("USE_TLS is True, but CA_CERT_PATH '%s' is not set or file does not exist. Exiting.", CA_CERT_PATH)
             exit()
-        print(f"Connecting to {MQTT_BROKER_HOST}:{MQTT_PORT_TLS} using MQTTS (CA: {CA_CERT_PATH})")
+        log.info("Connecting to %s:%s using MQTTS (CA: %s)", MQTT_BROKER_HOST, MQTT_PORT_TLS, CA_CERT_PATH)
         client.tls_set(ca_certs=CA_CERT_PATH)
         port_to_use = MQTT_PORT_TLS
     else:
-        print(f"Connecting to {MQTT_BROKER_HOST}:{MQTT_PORT_NORMAL} using MQTT")
+        log.info("Connecting to %s:%s using MQTT", MQTT_BROKER_HOST, MQTT_PORT_NORMAL)
         port_to_use = MQTT_PORT_NORMAL
 
     client.on_connect = on_connect
+    client.on_disconnect = on_disconnect
+    client.on_publish = bmkg_metrics.inflight_tracker.on_publish
     client.message_callback_add(REQUEST_TOPIC_CONTROL, on_message_control)
+    shard_membership.attach(client)
     
     try:
         client.connect(MQTT_BROKER_HOST, port_to_use, 60)
     except Exception as e:
-        print(f"Could not connect to MQTT Broker: {e}")
+        log.error("Could not connect to MQTT Broker: %s", e)
         exit()
 
+    bmkg_metrics.start_http_server()
+    signal.signal(signal.SIGTERM, handle_shutdown_signal)
+    if hasattr(signal, "SIGBREAK"): # Windows: supervisor mengirim CTRL_BREAK_EVENT
+        signal.signal(signal.SIGBREAK, handle_shutdown_signal)
+
     client.loop_start()
+    if shard_membership.enabled and not shard_membership.wait_settled():
+        log.warning("Shard presence not confirmed yet, starting with the current node list.")
 
-    schedule.every(FETCH_INTERVAL_SECONDS).seconds.do(fetch_and_publish_weather_data)
-    fetch_and_publish_weather_data() # Jalankan sekali saat start
+    # Siklus terjadwal disebar sepanjang interval agar tidak menumpuk di awal jam
+    schedule.every(FETCH_INTERVAL_SECONDS).seconds.do(run_scheduled_fetch_cycle)
+    # Warm start + siklus pertama memegang fetch_cycle_lock seperti siklus terjadwal; force_refresh
+    # yang sudah antre menunggu per wilayah (region_lock), bukan berjalan bersamaan di wilayah yang sama
+    with fetch_cycle_lock:
+        publish_stored_forecasts()
+        fetch_and_publish_weather_data() # Jalankan sekali saat start (tanpa penyebaran)
 
-    print(f"Publisher started. Monitoring ADM4: {ADM4_CODES}. Fetching every {FETCH_INTERVAL_SECONDS}s. QoS: {DATA_QOS_LEVEL}")
-    print("Waiting for scheduled jobs or control messages. Press Ctrl+C to exit.")
+    log.info("Publisher started. Monitoring ADM4: %s. Fetching every %ss. QoS: %s", ADM4_CODES, FETCH_INTERVAL_SECONDS, DATA_QOS_LEVEL)
+    log.info("Waiting for scheduled jobs or control messages. Press Ctrl+C to exit.")
     try:
-        while True:
+        while not shutdown_requested.is_set():
             schedule.run_pending()
-            time.sleep(1)
+            shutdown_requested.wait(1)
     except KeyboardInterrupt:
-        print("\nPublisher shutting down...")
+        log.info("Publisher shutting down...")
     finally:
+        shutdown_requested.set()
+        # Tunggu fetch yang sedang berjalan selesai dipublish sebelum koneksi ditutup
+        if fetch_cycle_lock.acquire(timeout=SHUTDOWN_DRAIN_TIMEOUT_SECONDS):
+            fetch_cycle_lock.release()
+        else:
+            log.warning("Fetch cycle still running after %ss, exiting anyway.", SHUTDOWN_DRAIN_TIMEOUT_SECONDS)
         if client.is_connected():
+            shard_membership.leave(client)
             client.loop_stop()
             client.disconnect()
-        print("Publisher disconnected.")
\ No newline at end of file
+        log.info("Publisher disconnected.")
\ No newline at end of file
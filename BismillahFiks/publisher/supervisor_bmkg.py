@@ -0,0 +1,326 @@
+import os
+import sys
+import json
+import time
+import uuid
+import signal
+import subprocess
+import threading
+import logging
+from datetime import datetime
+import paho.mqtt.client as mqtt
+import paho.mqtt.properties as props
+from paho.mqtt.packettypes import PacketTypes
+from dotenv import load_dotenv
+# Load environment variables from .env file in the current directory
+# (sebelum modul bmkg_* di bawah membaca konfigurasinya saat di-import)
+load_dotenv()
+import bmkg_codec
+import bmkg_metrics
+from bmkg_logging import setup_logging
+from bmkg_sharding import HashRing
+
+# Supervisor untuk publisher_bmkg.py: menjalankan beberapa proses worker (masing-masing
+# dengan klien MQTT sendiri dan sebagian ADM4_CODES_LIST) supaya encode payload dan
+# pemrosesan respons BMKG memakai semua core, bukan satu proses yang dibatasi GIL.
+# Supervisor mengecek kesehatan worker lewat command 'status', me-restart worker yang
+# crash/macet, menguras worker saat SIGTERM, dan menjawab 'status' di topik kontrol
+# dengan ringkasan gabungan semua worker ('force_refresh'/'history' diteruskan ke worker pemilik ADM4).
+
+log = logging.getLogger("bmkg.supervisor")
+
+# --- Konfigurasi (diambil dari .env, sama dengan publisher_bmkg.py) ---
+MQTT_BROKER_HOST = os.getenv("MQTT_BROKER_HOST", "localhost")
+MQTT_PORT_NORMAL = int(os.getenv("MQTT_PORT_NORMAL", 1883))
+MQTT_PORT_TLS = int(os.getenv("MQTT_PORT_TLS", 8883))
+CA_CERT_PATH = os.getenv("CA_CERT_PATH")
+USE_TLS = os.getenv("USE_TLS", "False").lower() == "true"
+
+ADM4_CODES_STR = os.getenv("ADM4_CODES_LIST", "")
+ADM4_CODES = [code.strip() for code in ADM4_CODES_STR.split(',') if code.strip()] if ADM4_CODES_STR else []
+REQUEST_TOPIC_CONTROL = os.getenv("REQUEST_TOPIC_CONTROL", "bmkg/control/request")
+
+# Jumlah proses worker (default: jumlah core), tidak lebih dari jumlah kode ADM4
+PUBLISHER_WORKERS = int(os.getenv("PUBLISHER_WORKERS", os.cpu_count() or 1))
+PUBLISHER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "publisher_bmkg.py")
+# Health check: command 'status' ke tiap worker; worker yang tidak menjawab
+# HEALTH_MAX_MISSED kali berturut-turut dianggap macet dan di-restart
+HEALTH_CHECK_INTERVAL_SECONDS = float(os.getenv("SUPERVISOR_HEALTH_CHECK_INTERVAL_SECONDS", 15))
+HEALTH_MAX_MISSED = int(os.getenv("SUPERVISOR_HEALTH_MAX_MISSED", 3))
+RESTART_BACKOFF_MAX_SECONDS = float(os.getenv("SUPERVISOR_RESTART_BACKOFF_MAX_SECONDS", 60))
+# Worker yang hidup lebih lama dari ini dianggap stabil; backoff restart-nya di-reset
+WORKER_STABLE_SECONDS = 120
+# Worker diberi waktu menyelesaikan siklus fetch-nya sebelum di-kill (SIGTERM supervisor)
+DRAIN_TIMEOUT_SECONDS = float(os.getenv("SHUTDOWN_DRAIN_TIMEOUT_SECONDS", 30))
+
+supervisor_id = f"bmkg-supervisor-{uuid.uuid4().hex[:8]}"
+WORKER_TOPIC_BASE = f"bmkg/supervisor/{supervisor_id}"
+HEALTH_RESPONSE_TOPIC = f"{WORKER_TOPIC_BASE}/health"
+
+stop_requested = threading.Event()
+
+
+class PublisherWorker:
+    """Satu proses publisher_bmkg.py dengan bagian ADM4 dan topik kontrol privatnya sendiri."""
+
+    def __init__(self, name, adm4_codes, metrics_port=0):
+        self.name = name
+        self.adm4_codes = adm4_codes
+        self.metrics_port = metrics_port
+        self.control_topic = f"{WORKER_TOPIC_BASE}/{name}/control"
+        self.process = None
+        self.started_at = None
+        self.restarts = 0
+        self.crash_streak = 0
+        self.next_start_at = 0.0
+        self.last_health_at = None
+        self.last_status = None
+
+    def start(self):
+        env = os.environ.copy()
+        env.update({
+            "ADM4_CODES_LIST": ",".join(self.adm4_codes),
+            "REQUEST_TOPIC_CONTROL": self.control_topic, # Command dari luar diteruskan supervisor
+            "PUBLISHER_WORKER_NAME": self.name,
+            "SHARD_GROUP": "", # Pembagian wilayah sudah dilakukan supervisor
+            "METRICS_PORT": str(self.metrics_port or ""), # Setiap worker punya endpoint /metrics sendiri
+            "PYTHONUNBUFFERED": "1",
+        })
+        creationflags = subprocess.CREATE_NEW_PROCESS_GROUP if sys.platform == "win32" else 0
+        self.process = subprocess.Popen([sys.executable, PUBLISHER_SCRIPT], env=env,
+                                        cwd=os.path.dirname(PUBLISHER_SCRIPT), creationflags=creationflags)
+        self.started_at = time.monotonic()
+        self.last_health_at = None
+        log.info("Started %s (pid %s) for %s ADM4 codes", self.name, self.process.pid, len(self.adm4_codes))
+
+    def is_alive(self):
+        return self.process is not None and self.process.poll() is None
+
+    def is_unresponsive(self, now):
+        # Hitungan dimulai dari start, jadi worker baru punya waktu yang sama untuk menjawab pertama kali
+        last_seen = self.last_health_at or self.started_at
+        return now - last_seen > HEALTH_CHECK_INTERVAL_SECONDS * HEALTH_MAX_MISSED
+
+    def stop(self):
+        if not self.is_alive():
+            return
+        if sys.platform == "win32":
+            self.process.send_signal(signal.CTRL_BREAK_EVENT)
+        else:
+            self.process.terminate() # SIGTERM: worker menguras siklus fetch lalu keluar
+
+    def schedule_restart(self, reason):
+        now = time.monotonic()
+        if self.started_at and now - self.started_at > WORKER_STABLE_SECONDS:
+            self.crash_streak = 0
+        self.crash_streak += 1
+        delay = min(RESTART_BACKOFF_MAX_SECONDS, 2 ** (self.crash_streak - 1))
+        self.next_start_at = now + delay
+        self.process = None
+        self.last_status = None
+        log.warning("%s %s, restarting in %.0fs (restart #%s)", self.name, reason, delay, self.restarts + 1)
+
+    def summary(self):
+        return {
+            "name": self.name,
+            "pid": self.process.pid if self.is_alive() else None,
+            "alive": self.is_alive(),
+            "adm4_codes": len(self.adm4_codes),
+            "restarts": self.restarts,
+            "uptime_seconds": round(time.monotonic() - self.started_at) if self.is_alive() else 0,
+            "last_health_check_seconds_ago": round(time.monotonic() - self.last_health_at, 1) if self.last_health_at else None,
+            "last_fetch_cycle": (self.last_status or {}).get("last_fetch_cycle"),
+        }
+
+
+def split_adm4_codes(adm4_codes, worker_count):
+    # Consistent hashing: mengubah jumlah worker hanya memindahkan sebagian kecil wilayah
+    ring = HashRing([f"worker-{index}" for index in range(worker_count)])
+    shares = {f"worker-{index}": [] for index in range(worker_count)}
+    for adm4_code in adm4_codes:
+        shares[ring.owner(adm4_code)].append(adm4_code)
+    # Supervisor memakai METRICS_PORT, worker ke-N memakai METRICS_PORT + 1 + N
+    return [PublisherWorker(name, codes, bmkg_metrics.METRICS_PORT + 1 + index if bmkg_metrics.METRICS_PORT else 0)
+            for index, (name, codes) in enumerate(shares.items()) if codes]
+
+
+workers = split_adm4_codes(ADM4_CODES, max(1, min(PUBLISHER_WORKERS, len(ADM4_CODES))))
+workers_by_name = {worker.name: worker for worker in workers}
+workers_lock = threading.Lock()
+
+WORKER_RESTARTS = bmkg_metrics.Gauge("bmkg_supervisor_worker_restarts", "Restarts per publisher worker since the supervisor started.", ["worker"])
+for worker in workers:
+    WORKER_RESTARTS.set_function(lambda worker=worker: worker.restarts, worker=worker.name)
+
+# --- Klien MQTT supervisor (hanya untuk kontrol dan health check; data dipublish worker) ---
+client = mqtt.Client(client_id=supervisor_id, protocol=mqtt.MQTTv5)
+
+def on_connect(client, userdata, flags, rc, properties=None):
+    if rc == 0:
+        log.info("Connected to MQTT Broker (rc: %s)", rc)
+        client.subscribe(REQUEST_TOPIC_CONTROL, qos=1)
+        client.subscribe(HEALTH_RESPONSE_TOPIC, qos=1)
+    else:
+        log.error("Failed to connect, return code %s", rc)
+
+def on_health_response(client, userdata, msg):
+    worker_name = msg.properties.CorrelationData.decode() if getattr(msg.properties, "CorrelationData", None) else None
+    try:
+        status = bmkg_codec.decode(msg.payload, getattr(msg.properties, "ContentType", None))
+    except ValueError as e:
+        log.warning("Invalid health response from %s: %s", worker_name, e)
+        return
+    with workers_lock:
+        worker = workers_by_name.get(worker_name)
+        if worker and worker.is_alive() and isinstance(status, dict) and status.get("pid") == worker.process.pid:
+            worker.last_health_at = time.monotonic()
+            worker.last_status = status
+
+def send_health_checks():
+    with workers_lock:
+        targets = [worker for worker in workers if worker.is_alive()]
+    for worker in targets:
+        request_properties = props.Properties(PacketTypes.PUBLISH)
+        request_properties.ResponseTopic = HEALTH_RESPONSE_TOPIC
+        request_properties.CorrelationData = worker.name.encode()
+        request_properties.MessageExpiryInterval = int(HEALTH_CHECK_INTERVAL_SECONDS) # Ping basi tidak perlu dijawab
+        client.publish(worker.control_topic, json.dumps({"command": "status"}), qos=1, properties=request_properties)
+
+def aggregated_status():
+    with workers_lock:
+        worker_summaries = [worker.summary() for worker in workers]
+    cycles = [summary["last_fetch_cycle"] for summary in worker_summaries if summary["last_fetch_cycle"]]
+    return {
+        "status": "Supervisor is running",
+        "timestamp": datetime.now().isoformat(),
+        "supervisor": supervisor_id,
+        "monitoring_adm4": ADM4_CODES,
+        "workers_alive": sum(1 for summary in worker_summaries if summary["alive"]),
+        "workers_total": len(worker_summaries),
+        "last_fetch_cycle": {
+            "codes": sum(cycle["codes"] for cycle in cycles),
+            "succeeded": sum(cycle["succeeded"] for cycle in cycles),
+            "failed": sum(cycle["failed"] for cycle in cycles),
+        } if cycles else None,
+        "workers": worker_summaries,
+    }
+
+def on_message_control(client, userdata, msg):
+    log.debug("Control message received on topic %s", msg.topic)
+    try:
+        request_data = json.loads(msg.payload.decode())
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        log.warning("Error decoding JSON payload from control message.")
+        return
+    response_topic = getattr(msg.properties, "ResponseTopic", None) if msg.properties else None
+    if not response_topic:
+        log.warning("No Response Topic in request, cannot reply.")
+        return
+
+    command = request_data.get("command")
+    if command in ("force_refresh", "history"):
+        adm4_code = request_data.get("adm4")
+        with workers_lock:
+            owner = next((worker for worker in workers if adm4_code in worker.adm4_codes), None)
+        if owner and owner.is_alive():
+            # Diteruskan apa adanya (ResponseTopic/CorrelationData tetap), worker pemilik yang menjawab
+            client.publish(owner.control_topic, msg.payload, qos=1, properties=msg.properties)
+            log.info("Forwarded %s for %s to %s", command, adm4_code, owner.name)
+            return
+        response_payload = {"error": f"Invalid or not monitored adm4 code for {command}: {adm4_code}" if not owner
+                            else f"Worker {owner.name} for {adm4_code} is restarting, try again later"}
+    elif command == "status":
+        response_payload = aggregated_status()
+    else:
+        response_payload = {"error": "Unknown command"}
+
+    response_codec = bmkg_codec.requested_codec(msg.properties, request_data)
+    response_properties = bmkg_codec.set_properties(props.Properties(PacketTypes.PUBLISH), response_codec)
+    if getattr(msg.properties, "CorrelationData", None):
+        response_properties.CorrelationData = msg.properties.CorrelationData
+    client.publish(response_topic, bmkg_codec.encode(response_payload, response_codec), qos=1, properties=response_properties)
+    log.debug("Response sent to %s", response_topic)
+
+def supervise_workers():
+    now = time.monotonic()
+    with workers_lock:
+        for worker in workers:
+            if worker.process is None:
+                if now >= worker.next_start_at:
+                    if worker.started_at is not None:
+                        worker.restarts += 1
+                    worker.start()
+            elif not worker.is_alive():
+                worker.schedule_restart(f"exited with code {worker.process.returncode}")
+            elif worker.is_unresponsive(now):
+                log.error("%s missed %s health checks, killing pid %s", worker.name, HEALTH_MAX_MISSED, worker.process.pid)
+                worker.process.kill()
+                worker.process.wait()
+                worker.schedule_restart("was unresponsive")
+
+def drain_workers():
+    with workers_lock:
+        running = [worker for worker in workers if worker.is_alive()]
+    log.info("Draining %s workers (timeout %ss)...", len(running), DRAIN_TIMEOUT_SECONDS)
+    for worker in running:
+        worker.stop()
+    deadline = time.monotonic() + DRAIN_TIMEOUT_SECONDS + 5 # Sedikit lebih lama dari batas drain di worker
+    for worker in running:
+        try:
+            worker.process.wait(timeout=max(0.1, deadline - time.monotonic()))
+        except subprocess.TimeoutExpired:
+            log.warning("%s did not exit in time, killing pid %s", worker.name, worker.process.pid)
+            worker.process.kill()
+            worker.process.wait()
+
+def handle_shutdown_signal(signum, frame):
+    log.info("Signal %s received, shutting down...", signum)
+    stop_requested.set()
+
+if __name__ == "__main__":
+    setup_logging()
+    if not ADM4_CODES:
+        log.error("ADM4_CODES_LIST tidak diset di file publisher/.env atau kosong. Supervisor tidak menjalankan worker.")
+        exit()
+
+    if USE_TLS:
+        if not CA_CERT_PATH or not os.path.exists(CA_CERT_PATH):
+            log.error("USE_TLS is True, but CA_CERT_PATH '%s' is not set or file does not exist. Exiting.", CA_CERT_PATH)
+            exit()
+        client.tls_set(ca_certs=CA_CERT_PATH)
+        port_to_use = MQTT_PORT_TLS
+    else:
+        port_to_use = MQTT_PORT_NORMAL
+
+    client.on_connect = on_connect
+    client.message_callback_add(REQUEST_TOPIC_CONTROL, on_message_control)
+    client.message_callback_add(HEALTH_RESPONSE_TOPIC, on_health_response)
+    try:
+        client.connect(MQTT_BROKER_HOST, port_to_use, 60)
+    except Exception as e:
+        log.error("Could not connect to MQTT Broker: %s", e)
+        exit()
+
+    bmkg_metrics.start_http_server()
+    signal.signal(signal.SIGTERM, handle_shutdown_signal)
+    if hasattr(signal, "SIGBREAK"):
+        signal.signal(signal.SIGBREAK, handle_shutdown_signal)
+
+    client.loop_start()
+    log.info("%s supervising %s workers for %s ADM4 codes. Press Ctrl+C to exit.", supervisor_id, len(workers), len(ADM4_CODES))
+    last_health_check = time.monotonic()
+    try:
+        while not stop_requested.is_set():
+            supervise_workers()
+            if time.monotonic() - last_health_check >= HEALTH_CHECK_INTERVAL_SECONDS:
+                send_health_checks()
+                last_health_check = time.monotonic()
+            stop_requested.wait(1)
+    except KeyboardInterrupt:
+        log.info("Shutting down...")
+    finally:
+        drain_workers()
+        if client.is_connected():
+            client.loop_stop()
+            client.disconnect()
+        log.info("All workers stopped.")
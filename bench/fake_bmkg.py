@@ -0,0 +1,165 @@
+# fake_bmkg.py
+# Server HTTP pengganti api.bmkg.go.id untuk benchmark: menjawab ?adm4=<kode> dengan
+# dokumen berbentuk respons resmi (lokasi + data[0].cuaca, 3 hari x 8 periode 3-jam),
+# dengan latensi dan tingkat error yang bisa diatur. Bisa dijalankan sendiri:
+#   python bench/fake_bmkg.py --port 8765 --latency-ms 150 --error-rate 0.02
+import argparse
+import json
+import random
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+WEATHER = (
+    (0, "Cerah", "Sunny"), (1, "Cerah Berawan", "Partly Cloudy"), (3, "Berawan", "Mostly Cloudy"),
+    (4, "Berawan Tebal", "Overcast"), (61, "Hujan Ringan", "Light Rain"), (63, "Hujan Sedang", "Rain"),
+)
+WIND = (("N", "S"), ("NE", "SW"), ("E", "W"), ("SE", "NW"), ("S", "N"), ("SW", "NE"), ("W", "E"), ("NW", "SE"))
+DAYS = 3
+PERIODS_PER_DAY = 8
+
+
+def build_forecast_document(adm4, now=None, vary=False):
+    """Dokumen BMKG realistis untuk satu kode adm4.
+
+    Isinya deterministik per (adm4, jam analisis) seperti API aslinya; vary=True mengacak
+    nilainya di setiap request supaya dedup/delta publisher tidak menahan publish.
+    """
+    now = now or datetime.now(timezone.utc)
+    analysis = now.replace(minute=0, second=0, microsecond=0, hour=now.hour - now.hour % 3)
+    rng = random.Random() if vary else random.Random(f"{adm4}/{analysis.isoformat()}")
+    parts = adm4.split(".")
+    lokasi = {
+        "adm1": ".".join(parts[:1]), "adm2": ".".join(parts[:2]), "adm3": ".".join(parts[:3]), "adm4": adm4,
+        "provinsi": "Jawa Timur", "kotkab": "Kota Surabaya", "kecamatan": f"Kecamatan {parts[2] if len(parts) > 2 else '01'}",
+        "desa": f"Kelurahan {parts[-1]}", "lon": round(112.6 + rng.random() * 0.2, 6), "lat": round(-7.35 + rng.random() * 0.15, 6),
+        "timezone": "Asia/Jakarta",
+    }
+    days = []
+    for day in range(DAYS):
+        periods = []
+        for index in range(PERIODS_PER_DAY):
+            period = analysis + timedelta(hours=3 * (day * PERIODS_PER_DAY + index))
+            code, desc, desc_en = rng.choice(WEATHER)
+            wd, wd_to = rng.choice(WIND)
+            periods.append({
+                "datetime": period.strftime("%Y-%m-%dT%H:%M:%SZ"),
+                "t": rng.randint(24, 34), "tcc": rng.randint(0, 100), "tp": round(rng.random() * 5, 1) if code >= 60 else 0,
+                "weather": code, "weather_desc": desc, "weather_desc_en": desc_en,
+                "wd_deg": rng.randint(0, 359), "wd": wd, "wd_to": wd_to, "ws": round(rng.random() * 20, 1),
+                "hu": rng.randint(55, 95), "vs": rng.randint(5000, 10000), "vs_text": "> 10 km",
+                "time_index": f"{day * PERIODS_PER_DAY + index}-{day * PERIODS_PER_DAY + index + 1}",
+                "analysis_date": analysis.strftime("%Y-%m-%dT%H:%M:%S"),
+                "image": f"https://api-apps.bmkg.go.id/storage/icon/cuaca/{desc_en.lower().replace(' ', '%20')}-am.svg",
+                "utc_datetime": period.strftime("%Y-%m-%d %H:%M:%S"),
+                "local_datetime": (period + timedelta(hours=7)).strftime("%Y-%m-%d %H:%M:%S"),
+            })
+        days.append(periods)
+    return {"lokasi": lokasi, "data": [{"lokasi": lokasi, "cuaca": days}]}
+
+
+class FakeBmkgServer:
+    """ThreadingHTTPServer di thread latar; `stats()` (juga GET /_stats) menghitung request yang dilayani."""
+
+    def __init__(self, host="127.0.0.1", port=0, latency_ms=100.0, jitter_ms=50.0, error_rate=0.0, rate_limit_rate=0.0, vary=False):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.vary = vary
+        self._lock = threading.Lock()
+        self._counts = {"requests": 0, "ok": 0, "errors": 0, "rate_limited": 0, "bad_request": 0}
+        self._httpd = ThreadingHTTPServer((host, port), self._handler_class())
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}/publik/prakiraan-cuaca"
+
+    def _count(self, key):
+        with self._lock:
+            self._counts["requests"] += 1
+            self._counts[key] += 1
+
+    def stats(self):
+        with self._lock:
+            return dict(self._counts)
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # Keep-alive, seperti API aslinya
+
+            def do_GET(self):
+                if self.path == "/_stats":
+                    self._reply(200, server.stats())
+                    return
+                delay = max(0.0, random.gauss(server.latency_ms, server.jitter_ms)) / 1000 if server.jitter_ms else server.latency_ms / 1000
+                time.sleep(delay)
+                adm4 = (parse_qs(urlsplit(self.path).query).get("adm4") or [""])[0]
+                roll = random.random()
+                if not adm4:
+                    server._count("bad_request")
+                    self._reply(400, {"message": "adm4 wajib diisi"})
+                elif roll < server.rate_limit_rate:
+                    server._count("rate_limited")
+                    self._reply(429, {"message": "Too Many Requests"}, {"Retry-After": "1"})
+                elif roll < server.rate_limit_rate + server.error_rate:
+                    server._count("errors")
+                    self._reply(503, {"message": "Service Unavailable"})
+                else:
+                    server._count("ok")
+                    self._reply(200, build_forecast_document(adm4, vary=server.vary))
+
+            def _reply(self, status, document, headers=None):
+                body = json.dumps(document).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass  # Ribuan request per detik; access log hanya menambah noise
+
+        return Handler
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name="fake-bmkg", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Server BMKG palsu untuk benchmark")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-ms", type=float, default=100.0)
+    parser.add_argument("--jitter-ms", type=float, default=50.0)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraksi request yang dijawab 503")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="Fraksi request yang dijawab 429 + Retry-After")
+    parser.add_argument("--vary", action="store_true", help="Acak isi prakiraan di setiap request")
+    args = parser.parse_args()
+    server = FakeBmkgServer(args.host, args.port, args.latency_ms, args.jitter_ms, args.error_rate, args.rate_limit_rate, args.vary).start()
+    print(f"Fake BMKG API di {server.url}")
+    try:
+        while True:
+            time.sleep(10)
+            print(server.stats())
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,285 @@
+# fake_broker.py
+# Broker MQTT minimal (asyncio, tanpa dependensi) untuk benchmark di mesin tanpa mosquitto.
+# Mendukung MQTT 3.1.1 dan 5.0: CONNECT, PUBLISH QoS 0/1/2, SUBSCRIBE/UNSUBSCRIBE dengan
+# wildcard + dan #, $share/<group>/ (round-robin), retained message, no-local, PING, DISCONNECT.
+# Properti MQTT 5 (ResponseTopic, CorrelationData, ContentType, UserProperty) diteruskan apa
+# adanya ke subscriber v5. Sengaja tidak ada: session persisten, will message, auth, TLS,
+# retransmisi; pengiriman ke subscriber paling tinggi QoS 1.
+#   python bench/fake_broker.py --port 1884
+import argparse
+import asyncio
+import itertools
+import struct
+
+CONNECT, CONNACK, PUBLISH, PUBACK, PUBREC, PUBREL, PUBCOMP = 1, 2, 3, 4, 5, 6, 7
+SUBSCRIBE, SUBACK, UNSUBSCRIBE, UNSUBACK, PINGREQ, PINGRESP, DISCONNECT = 8, 9, 10, 11, 12, 13, 14
+
+
+def encode_varint(value):
+    out = bytearray()
+    while True:
+        value, digit = divmod(value, 128)
+        out.append(digit | (0x80 if value else 0))
+        if not value:
+            return bytes(out)
+
+
+def decode_varint(buffer, offset):
+    value, shift = 0, 0
+    while True:
+        byte = buffer[offset]
+        offset += 1
+        value |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return value, offset
+        shift += 7
+
+
+def read_string(buffer, offset):
+    (length,) = struct.unpack_from("!H", buffer, offset)
+    offset += 2
+    return bytes(buffer[offset:offset + length]), offset + length
+
+
+def encode_string(value):
+    return struct.pack("!H", len(value)) + value
+
+
+def packet(packet_type, body, flags=0):
+    return bytes([packet_type << 4 | flags]) + encode_varint(len(body)) + body
+
+
+def topic_matches(topic_filter, topic):
+    filter_levels = topic_filter.split("/")
+    topic_levels = topic.split("/")
+    if topic.startswith("$") and filter_levels[0] in ("+", "#"):
+        return False
+    for index, level in enumerate(filter_levels):
+        if level == "#":
+            return True
+        if index >= len(topic_levels):
+            return False
+        if level != "+" and level != topic_levels[index]:
+            return False
+    return len(filter_levels) == len(topic_levels)
+
+
+class Session:
+    def __init__(self, broker, reader, writer):
+        self.broker = broker
+        self.reader = reader
+        self.writer = writer
+        self.client_id = ""
+        self.protocol_level = 4
+        self.packet_ids = itertools.cycle(range(1, 65536))
+        self.subscriptions = {}  # filter (termasuk $share/...) -> opsi langganan
+
+    @property
+    def v5(self):
+        return self.protocol_level == 5
+
+    async def run(self):
+        try:
+            while True:
+                header = await self.reader.readexactly(1)
+                length, multiplier = 0, 1
+                while True:
+                    byte = (await self.reader.readexactly(1))[0]
+                    length += (byte & 0x7F) * multiplier
+                    multiplier *= 128
+                    if not byte & 0x80:
+                        break
+                body = await self.reader.readexactly(length) if length else b""
+                if not self.handle(header[0] >> 4, header[0] & 0x0F, body):
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self.broker.remove(self)
+            self.writer.close()
+
+    def send(self, data):
+        if not self.writer.is_closing():
+            self.writer.write(data)
+
+    def handle(self, packet_type, flags, body):
+        if packet_type == CONNECT:
+            self.on_connect(body)
+        elif packet_type == PUBLISH:
+            self.on_publish(flags, body)
+        elif packet_type == PUBREL:
+            self.send(packet(PUBCOMP, body[:2]))
+        elif packet_type == SUBSCRIBE:
+            self.on_subscribe(body)
+        elif packet_type == UNSUBSCRIBE:
+            self.on_unsubscribe(body)
+        elif packet_type == PINGREQ:
+            self.send(packet(PINGRESP, b""))
+        elif packet_type == DISCONNECT:
+            return False
+        # PUBACK/PUBREC/PUBCOMP dari subscriber: tidak ada retransmisi, cukup diabaikan
+        return True
+
+    def on_connect(self, body):
+        _, offset = read_string(body, 0)
+        self.protocol_level = body[offset]
+        offset += 4  # level, connect flags, keep alive
+        if self.v5:
+            properties_length, offset = decode_varint(body, offset)
+            offset += properties_length
+        client_id, _ = read_string(body, offset)
+        self.client_id = client_id.decode("utf-8", "replace")
+        self.broker.add(self)
+        self.send(packet(CONNACK, b"\x00\x00\x00" if self.v5 else b"\x00\x00"))
+
+    def on_publish(self, flags, body):
+        qos = (flags >> 1) & 0x03
+        retain = bool(flags & 0x01)
+        topic, offset = read_string(body, 0)
+        packet_id = b""
+        if qos:
+            packet_id = body[offset:offset + 2]
+            offset += 2
+        properties = b"\x00"
+        if self.v5:
+            properties_length, properties_start = decode_varint(body, offset)
+            properties = bytes(body[offset:properties_start + properties_length])
+            offset = properties_start + properties_length
+        payload = bytes(body[offset:])
+        if qos == 1:
+            self.send(packet(PUBACK, packet_id))
+        elif qos == 2:
+            self.send(packet(PUBREC, packet_id))
+        self.broker.route(self, topic.decode("utf-8"), qos, retain, properties, payload)
+
+    def deliver(self, topic, qos, retain, properties, payload):
+        body = encode_string(topic.encode("utf-8"))
+        if qos:
+            body += struct.pack("!H", next(self.packet_ids))
+        if self.v5:
+            body += properties
+        self.send(packet(PUBLISH, body + payload, qos << 1 | int(retain)))
+
+    def on_subscribe(self, body):
+        packet_id = body[:2]
+        offset = 2
+        if self.v5:
+            properties_length, offset = decode_varint(body, offset)
+            offset += properties_length
+        granted, new_filters = bytearray(), []
+        while offset < len(body):
+            topic_filter, offset = read_string(body, offset)
+            options = body[offset]
+            offset += 1
+            topic_filter = topic_filter.decode("utf-8")
+            qos = min(options & 0x03, 1)
+            self.subscriptions[topic_filter] = {"qos": qos, "no_local": bool(options & 0x04) and self.v5}
+            granted.append(qos)
+            new_filters.append(topic_filter)
+        self.send(packet(SUBACK, packet_id + (b"\x00" if self.v5 else b"") + bytes(granted)))
+        for topic_filter in new_filters:
+            self.broker.send_retained(self, topic_filter)
+
+    def on_unsubscribe(self, body):
+        packet_id = body[:2]
+        offset = 2
+        if self.v5:
+            properties_length, offset = decode_varint(body, offset)
+            offset += properties_length
+        reasons = bytearray()
+        while offset < len(body):
+            topic_filter, offset = read_string(body, offset)
+            reasons.append(0x00 if self.subscriptions.pop(topic_filter.decode("utf-8"), None) else 0x11)
+        self.send(packet(UNSUBACK, packet_id + (b"\x00" + bytes(reasons) if self.v5 else b"")))
+
+
+class FakeBroker:
+    def __init__(self, host="127.0.0.1", port=1884):
+        self.host = host
+        self.port = port
+        self.sessions = set()
+        self.retained = {}  # topic -> (qos, properties, payload)
+        self._share_cursor = {}  # (group, filter) -> jumlah pesan yang sudah dibagikan
+        self.routed = 0
+        self.delivered = 0
+        self._server = None
+
+    def add(self, session):
+        # Client ID sama menendang koneksi lama, seperti broker sungguhan
+        for other in [s for s in self.sessions if s.client_id == session.client_id and session.client_id]:
+            other.writer.close()
+            self.sessions.discard(other)
+        self.sessions.add(session)
+
+    def remove(self, session):
+        self.sessions.discard(session)
+
+    def route(self, sender, topic, qos, retain, properties, payload):
+        self.routed += 1
+        if retain:
+            if payload:
+                self.retained[topic] = (qos, properties, payload)
+            else:
+                self.retained.pop(topic, None)
+        shared = {}  # (group, filter) -> [(session, qos)]
+        for session in list(self.sessions):
+            best_qos = None
+            for topic_filter, options in session.subscriptions.items():
+                if topic_filter.startswith("$share/"):
+                    _, group, inner = topic_filter.split("/", 2)
+                    if topic_matches(inner, topic):
+                        shared.setdefault((group, inner), []).append((session, options["qos"]))
+                    continue
+                if options["no_local"] and session is sender:
+                    continue
+                if topic_matches(topic_filter, topic):
+                    best_qos = max(best_qos or 0, options["qos"])
+            if best_qos is not None:
+                session.deliver(topic, min(qos, best_qos), False, properties, payload)
+                self.delivered += 1
+        for key, members in shared.items():
+            members.sort(key=lambda member: member[0].client_id)
+            cursor = self._share_cursor.get(key, 0)
+            self._share_cursor[key] = cursor + 1
+            session, sub_qos = members[cursor % len(members)]
+            session.deliver(topic, min(qos, sub_qos), False, properties, payload)
+            self.delivered += 1
+
+    def send_retained(self, session, topic_filter):
+        if topic_filter.startswith("$share/"):
+            return
+        for topic, (qos, properties, payload) in list(self.retained.items()):
+            if topic_matches(topic_filter, topic):
+                session.deliver(topic, min(qos, session.subscriptions[topic_filter]["qos"]), True, properties, payload)
+
+    async def _accept(self, reader, writer):
+        await Session(self, reader, writer).run()
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._accept, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def serve_forever(self):
+        await self._server.serve_forever()
+
+
+async def _main(host, port):
+    broker = await FakeBroker(host, port).start()
+    print(f"Fake MQTT broker di {host}:{broker.port}")
+    await broker.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Broker MQTT minimal untuk benchmark")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=1884)
+    args = parser.parse_args()
+    try:
+        asyncio.run(_main(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,476 @@
+# run_bench.py
+# Benchmark publisher/responder: menjalankan server BMKG palsu (bench/fake_bmkg.py), broker MQTT
+# lokal (mosquitto jika ada di PATH, selain itu bench/fake_broker.py) dan satu entry point sebagai
+# proses terpisah, lalu memberi beban ke topiknya dan mengukur pesan/detik, latensi request-
+# response p50/p99, serta CPU dan RSS proses target. Hasil disimpan ke bench/results/ sebagai JSON
+# (bersama commit git) supaya bisa dibandingkan antar commit:
+#   python bench/run_bench.py --scenario responder-weather --duration 30 --concurrency 32
+#   python bench/run_bench.py --scenario all --latency-ms 200 --error-rate 0.02
+#   python bench/run_bench.py --compare bench/results/<lama>.json bench/results/<baru>.json
+import argparse
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+import uuid
+from datetime import datetime
+
+import paho.mqtt.client as mqtt
+import paho.mqtt.properties as mqtt_props
+from paho.mqtt.packettypes import PacketTypes
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+RESULTS_DIR = os.path.join(BENCH_DIR, "results")
+
+# kind: periodic (hitung publish di `observe`), weather/cuaca/control (request-response)
+SCENARIOS = {
+    "publisher-periodic": {"script": "publisher_bmkg.py", "kind": "periodic", "observe": "bmkg/weather/forecast/#"},
+    "fiks-periodic": {"script": "BismillahFiks/publisher/publisher_bmkg.py", "kind": "periodic", "observe": "bmkg/prakiraan/#"},
+    "async-periodic": {"script": "bmkg_async_publisher.py", "kind": "periodic", "observe": "bmkg/prakiraan/#"},
+    "responder-weather": {"script": "publisher5_bmkg.py", "kind": "weather"},
+    "fetcher-cuaca": {"script": "bmkg-fiks_publisher.py", "kind": "cuaca"},
+    "fiks-control": {"script": "BismillahFiks/publisher/publisher_bmkg.py", "kind": "control"},
+    "async-weather": {"script": "bmkg_async_publisher.py", "kind": "weather"},
+    "async-cuaca": {"script": "bmkg_async_publisher.py", "kind": "cuaca"},
+    "async-control": {"script": "bmkg_async_publisher.py", "kind": "control"},
+}
+# Metrik yang dibandingkan --compare; True = makin besar makin baik
+COMPARED_METRICS = {
+    "messages_per_s": True, "latency_p50_ms": False, "latency_p99_ms": False, "error_rate": False,
+    "time_to_all_regions_s": False, "cpu_percent": False, "rss_max_mb": False,
+}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"Port {port} tidak terbuka dalam {timeout}s")
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, round(fraction * len(sorted_values) + 0.5) - 1))
+    return sorted_values[index]
+
+
+def git_revision():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=REPO_DIR, capture_output=True, text=True).stdout.strip()
+        return commit + ("-dirty" if dirty else "")
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def region_codes(count):
+    return [f"35.78.{index // 1000 + 1:02d}.{1001 + index % 1000}" for index in range(count)]
+
+
+def new_client(client_id):
+    # paho 2.x butuh CallbackAPIVersion; callback di sini memakai signature 1.x
+    if hasattr(mqtt, "CallbackAPIVersion"):
+        return mqtt.Client(mqtt.CallbackAPIVersion.VERSION1, client_id=client_id, protocol=mqtt.MQTTv5)
+    return mqtt.Client(client_id=client_id, protocol=mqtt.MQTTv5)
+
+
+class ProcessSampler:
+    """Sampling CPU (utime+stime) dan RSS proses target dari /proc, atau psutil jika terpasang."""
+
+    def __init__(self, pid, interval=0.5):
+        self.pid = pid
+        self.interval = interval
+        self.rss_samples = []
+        self.cpu_start = self.cpu_end = None
+        self.started = self.ended = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        try:
+            import psutil
+        except ImportError:
+            psutil = None
+        self._process = psutil.Process(pid) if psutil else None
+        self._process_errors = (psutil.Error,) if psutil else ()
+        self._ticks = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+
+    def _read(self):
+        """(detik CPU, RSS byte) atau None jika proses sudah selesai."""
+        try:
+            if self._process is not None:
+                times = self._process.cpu_times()
+                return times.user + times.system, self._process.memory_info().rss
+            with open(f"/proc/{self.pid}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+            with open(f"/proc/{self.pid}/statm") as f:
+                rss_pages = int(f.read().split()[1])
+            return (int(fields[11]) + int(fields[12])) / self._ticks, rss_pages * os.sysconf("SC_PAGE_SIZE")
+        except (OSError, IndexError, ValueError) + self._process_errors:
+            return None
+
+    def start(self):
+        sample = self._read()
+        self.started = time.monotonic()
+        self.cpu_start = sample[0] if sample else 0.0
+        self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            sample = self._read()
+            if sample is None:
+                return
+            self.cpu_end, self.ended = sample[0], time.monotonic()
+            self.rss_samples.append(sample[1])
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        if self.cpu_end is None:
+            return {"cpu_seconds": None, "cpu_percent": None, "rss_max_mb": None, "rss_avg_mb": None}
+        cpu_seconds = self.cpu_end - self.cpu_start
+        return {
+            "cpu_seconds": round(cpu_seconds, 3),
+            "cpu_percent": round(100 * cpu_seconds / max(1e-9, self.ended - self.started), 1),
+            "rss_max_mb": round(max(self.rss_samples) / 2**20, 1),
+            "rss_avg_mb": round(sum(self.rss_samples) / len(self.rss_samples) / 2**20, 1),
+        }
+
+
+class LoadDriver:
+    """Klien MQTT pemberi beban: closed loop dengan `concurrency` request yang selalu in-flight.
+
+    Setiap request membawa ResponseTopic + CorrelationData unik; latensi diukur dari publish
+    sampai respons dengan CorrelationData yang sama diterima. Request tanpa respons setelah
+    `timeout` detik dihitung timeout dan slotnya dipakai request berikutnya.
+    """
+
+    def __init__(self, broker_port, kind, codes, concurrency, timeout, observe=None):
+        self.kind = kind
+        self.codes = codes
+        self._code_set = set(codes)
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.observe = observe
+        self.response_base = f"bench/response/{uuid.uuid4()}"
+        self._lock = threading.Lock()
+        self._pending = {}  # correlation data -> waktu kirim
+        self._next_code = 0
+        self.recording = False
+        self.running = False
+        self.sent = 0
+        self.latencies = []
+        self.errors = 0
+        self.timeouts = 0
+        self.observed = 0
+        self.observed_regions = {}  # adm4 -> waktu pesan pertama
+        self.first_observed = self.last_observed = None
+        self.client = new_client(f"bench-driver-{uuid.uuid4().hex[:8]}")
+        self.client.on_message = self._on_message
+        self.client.connect("127.0.0.1", broker_port)
+        # Tanpa TCP_NODELAY, PUBACK + PUBLISH berikutnya tertahan Nagle/delayed ACK (~40ms) di sisi driver
+        self.client.socket().setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.client.loop_start()
+        self.client.subscribe(f"{self.response_base}/#", qos=1)
+        if observe:
+            self.client.subscribe(observe, qos=1)
+
+    def _request(self):
+        code = self.codes[self._next_code % len(self.codes)]
+        self._next_code += 1
+        correlation = uuid.uuid4().bytes
+        properties = mqtt_props.Properties(PacketTypes.PUBLISH)
+        properties.ResponseTopic = f"{self.response_base}/{self.kind}"
+        properties.CorrelationData = correlation
+        if self.kind == "weather":
+            topic, payload = "bmkg/weather/request", {"adm4_code": code, "response_qos": 1}
+        elif self.kind == "cuaca":
+            topic, payload = f"bmkg/req/cuaca/{code}", {}
+        else:
+            topic, payload = "bmkg/control/request", {"command": "status"}
+        with self._lock:
+            self._pending[correlation] = time.monotonic()
+            self.sent += 1
+        self.client.publish(topic, json.dumps(payload), qos=1, properties=properties)
+
+    def _on_message(self, client, userdata, msg):
+        now = time.monotonic()
+        if self.observe and not msg.topic.startswith(self.response_base):
+            if self.recording:
+                self.observed += 1
+                self.first_observed = self.first_observed or now
+                self.last_observed = now
+            adm4 = next((level for level in msg.topic.split("/") if level in self._code_set), None)
+            if adm4 is not None:
+                self.observed_regions.setdefault(adm4, now)
+            return
+        correlation = getattr(msg.properties, "CorrelationData", None)
+        with self._lock:
+            sent_at = self._pending.pop(correlation, None)
+        if sent_at is None:
+            return  # Respons untuk request yang sudah timeout atau duplikat
+        try:
+            body = json.loads(msg.payload)
+            failed = isinstance(body, dict) and ("error" in body or body.get("status") == "error")
+        except (ValueError, UnicodeDecodeError):
+            failed = True
+        if self.recording:
+            self.latencies.append(now - sent_at)
+            self.errors += failed
+        if self.running:
+            self._request()
+
+    def probe(self, timeout, alive):
+        """Kirim satu request sampai dijawab; memastikan target sudah subscribe sebelum beban dimulai."""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline and alive():
+            before = len(self._pending)
+            self._request()
+            wait_until = time.monotonic() + 2
+            while time.monotonic() < wait_until:
+                with self._lock:
+                    if len(self._pending) <= before:
+                        return True
+                time.sleep(0.05)
+            with self._lock:
+                self._pending.clear()
+        return False
+
+    def run(self, warmup, duration):
+        self.running = True
+        for _ in range(self.concurrency):
+            self._request()
+        started = time.monotonic()
+        recording_started = started + warmup
+        end = recording_started + duration
+        while time.monotonic() < end:
+            time.sleep(0.1)
+            if not self.recording and time.monotonic() >= recording_started:
+                self.recording = True
+            self._expire()
+        self.running = False
+        self.recording = False
+        return duration
+
+    def _expire(self):
+        now = time.monotonic()
+        with self._lock:
+            expired = [correlation for correlation, sent_at in self._pending.items() if now - sent_at > self.timeout]
+            for correlation in expired:
+                del self._pending[correlation]
+        if self.recording:
+            self.timeouts += len(expired)
+        if self.running:
+            for _ in expired:
+                self._request()
+
+    def close(self):
+        self.client.loop_stop()
+        self.client.disconnect()
+
+
+def start_broker(kind, port, workdir):
+    if kind == "auto":
+        kind = "mosquitto" if shutil.which("mosquitto") else "builtin"
+    if kind == "mosquitto":
+        config = os.path.join(workdir, "mosquitto.conf")
+        with open(config, "w") as f:
+            f.write(f"listener {port} 127.0.0.1\nallow_anonymous true\npersistence false\nmax_queued_messages 100000\n")
+        command = ["mosquitto", "-c", config]
+    else:
+        command = [sys.executable, os.path.join(BENCH_DIR, "fake_broker.py"), "--port", str(port)]
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    wait_for_port(port)
+    return kind, process
+
+
+def stop_process(process, timeout=10):
+    if process.poll() is None:
+        process.terminate()
+        try:
+            process.wait(timeout)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+
+
+def run_scenario(name, args, broker_port, bmkg_url, workdir):
+    scenario = SCENARIOS[name]
+    codes = region_codes(args.regions)
+    env = dict(os.environ)
+    env.update({
+        "BMKG_API_URL": bmkg_url,
+        "MQTT_BROKER_HOST": "127.0.0.1", "MQTT_BROKER_PORT": str(broker_port),
+        "MQTT_BROKER_PORT_MQTT": str(broker_port), "MQTT_PORT_NORMAL": str(broker_port),
+        "USE_MQTTS": "false", "USE_TLS": "false",
+        "ADM4_CODES_LIST": ",".join(codes), "FETCH_INTERVAL_SECONDS": str(args.fetch_interval),
+        "FORECAST_STORE_PATH": os.path.join(workdir, f"{name}.sqlite3"),
+        "METRICS_PORT": "", "LOG_LEVEL": args.log_level,
+        # Server palsu tidak punya kuota; tanpa ini semua skenario periodic terkunci di 60 fetch/menit.
+        # --env BMKG_RATE_LIMIT_PER_MINUTE=60 untuk mengukur dengan throttling produksi.
+        "BMKG_RATE_LIMIT_PER_MINUTE": "600000", "BMKG_RATE_BURST": "1000", "FETCH_SPREAD_RATIO": "0",
+    })
+    env.update(dict(item.split("=", 1) for item in args.env))
+    log_path = os.path.join(workdir, f"{name}.log")
+    print(f"[{name}] {scenario['script']} ({args.regions} wilayah, log: {log_path})")
+    with open(log_path, "wb") as log_file:
+        target = subprocess.Popen([sys.executable, os.path.join(REPO_DIR, scenario["script"])], cwd=workdir, env=env,
+                                  stdout=log_file, stderr=subprocess.STDOUT)
+    target_started = time.monotonic()
+    driver = LoadDriver(broker_port, scenario["kind"], codes, args.concurrency, args.timeout, scenario.get("observe"))
+    try:
+        if scenario["kind"] == "periodic":
+            sampler = ProcessSampler(target.pid).start()
+            driver.recording = True
+            time.sleep(args.warmup + args.duration)
+            driver.recording = False
+            window = (driver.last_observed - driver.first_observed) if driver.observed > 1 else None
+            covered = list(driver.observed_regions.values())
+            result = {
+                "messages": driver.observed,
+                "messages_per_s": round(driver.observed / window, 1) if window else None,
+                "regions_covered": len(covered),
+                "time_to_all_regions_s": round(max(covered) - target_started, 2) if len(covered) == len(codes) else None,
+            }
+        else:
+            if not driver.probe(args.startup_timeout, lambda: target.poll() is None):
+                if target.poll() is not None:
+                    raise RuntimeError(f"{scenario['script']} berhenti dengan kode {target.returncode}, lihat {log_path}")
+                raise RuntimeError(f"{scenario['script']} tidak menjawab request dalam {args.startup_timeout}s, lihat {log_path}")
+            sampler = ProcessSampler(target.pid).start()
+            window = driver.run(args.warmup, args.duration)
+            latencies = sorted(latency * 1000 for latency in driver.latencies)
+            completed = len(latencies) + driver.timeouts
+            result = {
+                "requests": completed,
+                "responses": len(latencies),
+                "errors": driver.errors,
+                "timeouts": driver.timeouts,
+                "error_rate": round((driver.errors + driver.timeouts) / completed, 4) if completed else None,
+                "messages_per_s": round(len(latencies) / window, 1),
+                "latency_p50_ms": round(percentile(latencies, 0.50), 2) if latencies else None,
+                "latency_p90_ms": round(percentile(latencies, 0.90), 2) if latencies else None,
+                "latency_p99_ms": round(percentile(latencies, 0.99), 2) if latencies else None,
+                "latency_max_ms": round(latencies[-1], 2) if latencies else None,
+            }
+        result.update(sampler.stop())
+        exited = target.poll()
+        if exited is not None:
+            result["target_exit_code"] = exited
+    finally:
+        driver.close()
+        stop_process(target)
+    return {"scenario": name, "script": scenario["script"], "kind": scenario["kind"], **result}
+
+
+def compare(base_path, new_path):
+    with open(base_path) as f:
+        base = {entry["scenario"]: entry for entry in json.load(f)["results"]}
+    with open(new_path) as f:
+        new_run = json.load(f)
+    print(f"{'scenario':<20} {'metric':<22} {'base':>12} {'new':>12} {'change':>9}")
+    regressions = 0
+    for entry in new_run["results"]:
+        old = base.get(entry["scenario"])
+        if old is None:
+            continue
+        for metric, higher_is_better in COMPARED_METRICS.items():
+            old_value, new_value = old.get(metric), entry.get(metric)
+            if old_value is None or new_value is None:
+                continue
+            change = (new_value - old_value) / old_value * 100 if old_value else 0.0
+            worse = change < -10 if higher_is_better else change > 10
+            regressions += worse
+            print(f"{entry['scenario']:<20} {metric:<22} {old_value:>12} {new_value:>12} {change:>+8.1f}%{'  <-- regresi' if worse else ''}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark publisher BMKG dengan server BMKG palsu dan broker lokal")
+    parser.add_argument("--scenario", action="append", choices=sorted(SCENARIOS) + ["all"], help="Boleh diulang; default all")
+    parser.add_argument("--duration", type=float, default=20.0, help="Detik pengukuran per skenario")
+    parser.add_argument("--warmup", type=float, default=3.0, help="Detik awal yang tidak dihitung (cache dingin, koneksi baru)")
+    parser.add_argument("--concurrency", type=int, default=16, help="Request in-flight untuk skenario request-response")
+    parser.add_argument("--timeout", type=float, default=30.0, help="Detik sebelum request dianggap timeout")
+    parser.add_argument("--startup-timeout", type=float, default=30.0)
+    parser.add_argument("--regions", type=int, default=50, help="Jumlah kode adm4 yang diminta/dipantau")
+    parser.add_argument("--fetch-interval", type=int, default=5, help="FETCH_INTERVAL_SECONDS untuk skenario periodic")
+    parser.add_argument("--latency-ms", type=float, default=100.0, help="Latensi rata-rata server BMKG palsu")
+    parser.add_argument("--jitter-ms", type=float, default=30.0)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraksi respons 503 dari server BMKG palsu")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="Fraksi respons 429 dari server BMKG palsu")
+    parser.add_argument("--vary", action="store_true", help="Server BMKG palsu mengacak prakiraan di setiap request")
+    parser.add_argument("--broker", choices=("auto", "mosquitto", "builtin"), default="auto")
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE", help="Env tambahan untuk proses target")
+    parser.add_argument("--log-level", default="WARNING", help="LOG_LEVEL proses target")
+    parser.add_argument("--output", help="File hasil; default bench/results/<waktu>-<commit>.json")
+    parser.add_argument("--compare", nargs="+", metavar="RESULT", help="Bandingkan BASE [NEW]; NEW default hasil run ini")
+    args = parser.parse_args()
+
+    if args.compare and len(args.compare) == 2:
+        sys.exit(1 if compare(*args.compare) else 0)
+
+    names = sorted(SCENARIOS) if not args.scenario or "all" in args.scenario else args.scenario
+    revision = git_revision()
+    workdir = tempfile.mkdtemp(prefix="bmkg-bench-")
+    broker_port, bmkg_port = free_port(), free_port()
+    broker_kind, broker = start_broker(args.broker, broker_port, workdir)
+    fake_bmkg = subprocess.Popen([
+        sys.executable, os.path.join(BENCH_DIR, "fake_bmkg.py"), "--port", str(bmkg_port),
+        "--latency-ms", str(args.latency_ms), "--jitter-ms", str(args.jitter_ms),
+        "--error-rate", str(args.error_rate), "--rate-limit-rate", str(args.rate_limit_rate),
+    ] + (["--vary"] if args.vary else []), stdout=subprocess.DEVNULL)
+    results = []
+    try:
+        wait_for_port(bmkg_port)
+        bmkg_url = f"http://127.0.0.1:{bmkg_port}/publik/prakiraan-cuaca"
+        for name in names:
+            try:
+                results.append(run_scenario(name, args, broker_port, bmkg_url, workdir))
+            except Exception as e:
+                print(f"[{name}] GAGAL: {e}")
+                results.append({"scenario": name, "script": SCENARIOS[name]["script"], "failed": str(e)})
+            print(f"[{name}] {json.dumps(results[-1])}")
+        with urllib.request.urlopen(f"http://127.0.0.1:{bmkg_port}/_stats", timeout=5) as response:
+            bmkg_stats = json.load(response)
+    finally:
+        stop_process(fake_bmkg)
+        stop_process(broker)
+
+    run = {
+        "revision": revision,
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": sys.version.split()[0],
+        "broker": broker_kind,
+        "params": {key: value for key, value in vars(args).items() if key not in ("compare", "output")},
+        "fake_bmkg": bmkg_stats,
+        "results": results,
+    }
+    output = args.output or os.path.join(RESULTS_DIR, f"{datetime.now():%Y%m%d-%H%M%S}-{revision}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(run, f, indent=2)
+    print(f"Hasil disimpan ke {output} (log proses target di {workdir})")
+    if args.compare:
+        sys.exit(1 if compare(args.compare[0], output) else 0)
+
+
+if __name__ == "__main__":
+    main()
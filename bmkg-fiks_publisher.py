@@ -8,9 +8,25 @@ import time
 import os
 import ssl
 import uuid
+import threading
+import logging
 from dotenv import load_dotenv
+load_dotenv() # Muat variabel dari .env (sebelum modul bmkg_* membaca konfigurasinya)
+from bmkg_logging import setup_logging, SAMPLED
+from bmkg_cache import ForecastCache
+from bmkg_singleflight import SingleFlight
+from bmkg_dispatch import RequestDispatcher
+from bmkg_ratelimit import bmkg_rate_limiter, run_fetch_cycle
+import bmkg_http
+from bmkg_dedup import PayloadHashStore
+import bmkg_delta
+import bmkg_codec
+import bmkg_metrics
+from bmkg_forecast import normalize_bmkg_response
+from bmkg_sharding import ShardMembership, shared_topic
+from bmkg_store import open_store
 
-load_dotenv() # Muat variabel dari .env
+log = logging.getLogger("bmkg.fetcher")
 
 # Konfigurasi dari .env atau hardcode
 MQTT_BROKER_HOST = os.getenv("MQTT_BROKER_HOST", "localhost")
@@ -22,80 +38,184 @@ CA_CERT_PATH = os.getenv("CA_CERT_PATH", "C:/mosquitto_certs/ca.crt") # Sesuaika
 USE_MQTTS = os.getenv("USE_MQTTS", "true").lower() == "true"
 
 KODE_WILAYAH_MONITOR = ["35.78.09.1001"]
-API_BASE_URL = "https://api.bmkg.go.id/publik/prakiraan-cuaca"
+API_BASE_URL = os.getenv("BMKG_API_URL", "https://api.bmkg.go.id/publik/prakiraan-cuaca")
 FETCH_INTERVAL_SECONDS = 3600 # Ambil data setiap 1 jam
 REGULAR_PUBLISH_QOS = 1 # QoS untuk publikasi reguler
+BMKG_REQUEST_TIMEOUT_SECONDS = 15
+
+# Request on-demand diproses di worker pool (sama dengan publisher5_bmkg.py), bukan di thread network paho,
+# supaya request bersamaan benar-benar berjalan paralel dan bisa digabung oleh single-flight
+RESPONDER_DISPATCH_MODE = os.getenv("RESPONDER_DISPATCH_MODE", "pool").lower()
+RESPONDER_WORKERS = int(os.getenv("RESPONDER_WORKERS", 8))
+RESPONDER_QUEUE_SIZE = int(os.getenv("RESPONDER_QUEUE_SIZE", 64))
+RESPONDER_REQUEST_DEADLINE_SECONDS = float(os.getenv("RESPONDER_REQUEST_DEADLINE_SECONDS", 30))
+
+# Cache untuk request on-demand (bmkg/req/cuaca/+), TTL & ukuran dari .env
+forecast_cache = ForecastCache()
+# Request on-demand bersamaan untuk kode yang sama berbagi satu fetch ke BMKG
+bmkg_fetch_flight = SingleFlight()
+# Salinan prakiraan di disk: warm start cache dan cadangan request on-demand saat BMKG gagal
+forecast_store = open_store()
+request_dispatcher = None
+if RESPONDER_DISPATCH_MODE == "pool":
+    request_dispatcher = RequestDispatcher(RESPONDER_WORKERS, RESPONDER_QUEUE_SIZE, RESPONDER_REQUEST_DEADLINE_SECONDS)
+    bmkg_metrics.QUEUE_DEPTH.set_function(request_dispatcher.queue_depth, queue="responder")
+# Hash payload retained terakhir per topik, agar prakiraan yang tidak berubah tidak dikirim ulang
+published_payloads = PayloadHashStore()
+# Snapshot/delta terakhir untuk topik 3harian (hanya dipakai jika DELTA_PUBLISHING=true)
+delta_tracker = bmkg_delta.DeltaTracker(encoder=bmkg_codec.encode)
+
+def on_shard_rebalance(gained, lost):
+    # Dipanggil dari thread network paho: wilayah baru dipublish di thread terpisah
+    for kode_wilayah in lost:
+        base_topic = f"bmkg/prakiraan-cuaca/{kode_wilayah}"
+        published_payloads.forget([f"{base_topic}/3harian", f"{base_topic}/terdekat"])
+        delta_tracker.invalidate(f"{base_topic}/3harian")
+    if gained and shard_client is not None:
+        log.info("Took over %s regions after rebalance: %s", len(gained), gained)
+        threading.Thread(target=run_fetch_cycle, name="bmkg-rebalance", daemon=True,
+                         args=(gained, lambda kode_wilayah: publish_region_forecast(shard_client, kode_wilayah))).start()
+
+# Dengan SHARD_GROUP, KODE_WILAYAH_MONITOR dibagi ke semua fetcher yang hidup (consistent hashing)
+shard_membership = ShardMembership(KODE_WILAYAH_MONITOR, on_change=on_shard_rebalance)
+shard_client = None
 
 # --- Fungsi untuk Fetcher ---
-def fetch_bmkg_data(kode_wilayah):
+def fetch_bmkg_data(kode_wilayah, use_cache=False, timeout=BMKG_REQUEST_TIMEOUT_SECONDS, deadline=None):
+    cached_entry = forecast_cache.lookup(kode_wilayah) if use_cache else None
+    if cached_entry and cached_entry.is_fresh():
+        log.debug("Cache hit for %s", kode_wilayah)
+        return cached_entry.data
+    # Fetch reguler sudah mengambil token di run_fetch_cycle; request on-demand mengambilnya di sini
+    # agar cache miss beruntun tidak melewati kuota BMKG, dan menyerah jika token baru ada setelah deadline
+    if use_cache:
+        token_timeout = timeout if deadline is None else max(0.0, min(timeout, deadline - time.monotonic()))
+        if not bmkg_rate_limiter.acquire(timeout=token_timeout):
+            log.warning("BMKG rate limit reached for on-demand request %s, answering from stale data", kode_wilayah)
+            return cached_entry.data if cached_entry else stored_forecast(kode_wilayah)
     try:
         url = f"{API_BASE_URL}?adm4={kode_wilayah}"
-        response = requests.get(url, timeout=15)
+        request_headers = cached_entry.validators() if cached_entry else {}
+        response = bmkg_http.get(url, headers=request_headers, timeout=timeout, deadline=deadline)
+        if response.status_code == 304 and cached_entry:
+            log.debug("BMKG data for %s not modified, using cached copy", kode_wilayah)
+            if forecast_store:
+                forecast_store.touch(kode_wilayah, response.headers)
+            return forecast_cache.revalidated(kode_wilayah, cached_entry, response.headers).data
         response.raise_for_status()
-        return response.json()
+        # Respons BMKG dinormalisasi sekali di sini: {"location": {...}, "forecasts": [...]}
+        data = normalize_bmkg_response(response.json())
+        # Hasil fetch reguler juga mengisi cache agar request on-demand berikutnya tidak ke BMKG lagi
+        forecast_cache.store(kode_wilayah, data, response.headers)
+        if forecast_store:
+            forecast_store.save(kode_wilayah, data, response.headers)
+        return data
     except requests.exceptions.RequestException as e:
-        print(f"[Fetcher] Error fetching BMKG data for {kode_wilayah}: {e}")
+        log.warning("Error fetching BMKG data for %s: %s", kode_wilayah, e)
     except json.JSONDecodeError as e:
-        print(f"[Fetcher] Error decoding JSON for {kode_wilayah}: {e}")
+        log.error("Error decoding JSON for %s: %s", kode_wilayah, e)
+    # Request on-demand tetap dijawab dengan data terakhir yang tersimpan; publikasi reguler tidak
+    return stored_forecast(kode_wilayah) if use_cache else None
+
+def stored_forecast(kode_wilayah):
+    stored = forecast_store.latest(kode_wilayah) if forecast_store else None
+    if stored:
+        log.warning("Serving stored forecast for %s (fetched %s)", kode_wilayah, time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(stored.fetched_at)))
+        return stored.data
     return None
 
 # --- Callback MQTT ---
 def on_connect(client, userdata, flags, rc, properties=None):
     if rc == 0:
-        print(f"[Fetcher] Connected to MQTT Broker (TLS: {USE_MQTTS})!")
+        log.info("Connected to MQTT Broker (TLS: %s)!", USE_MQTTS)
+        bmkg_metrics.record_connect()
+        # Broker bisa saja kehilangan retained message, jadi publikasi berikutnya dikirim penuh
+        published_payloads.clear()
+        delta_tracker.invalidate()
+        shard_membership.announce(client)
         # Subscribe ke topik request untuk MQTT 5.0 Request-Response
         # Struktur topik: bmkg/req/cuaca/{kode_wilayah}
-        client.subscribe("bmkg/req/cuaca/+", qos=1)
-        print("[Fetcher] Subscribed to bmkg/req/cuaca/+")
+        # Dengan RESPONDER_SHARE_GROUP menjadi $share/<group>/bmkg/req/cuaca/+ (broker membagi request)
+        request_subscription = shared_topic("bmkg/req/cuaca/+")
+        client.subscribe(request_subscription, qos=1)
+        log.info("Subscribed to %s", request_subscription)
     else:
-        print(f"[Fetcher] Failed to connect, return code {rc}\n")
+        log.error("Failed to connect, return code %s", rc)
+
+def on_disconnect(client, userdata, flags, reason_code, properties=None):
+    log.warning("Disconnected from MQTT Broker (%s), paho will reconnect", reason_code)
+    bmkg_metrics.record_disconnect()
 
 def on_message(client, userdata, msg):
-    print(f"[Fetcher] Received request on topic {msg.topic}")
+    # Thread network paho hanya membaca properti request; fetch dan publish respons jalan di worker
+    log.debug("Received request on topic %s", msg.topic)
     if msg.properties:
         properties = msg.properties
         response_topic = None
         correlation_data = None
 
+        # Di paho 2.x ResponseTopic berupa str dan CorrelationData berupa bytes (bukan list)
         if hasattr(properties, 'ResponseTopic'):
-            response_topic_list = getattr(properties, 'ResponseTopic')
-            if response_topic_list: response_topic = response_topic_list[0]
+            response_topic = getattr(properties, 'ResponseTopic') or None
 
         if hasattr(properties, 'CorrelationData'):
-            correlation_data_list = getattr(properties, 'CorrelationData')
-            if correlation_data_list: correlation_data = correlation_data_list[0]
+            correlation_data = getattr(properties, 'CorrelationData') or None
         
         if response_topic:
-            try:
-                # Ekstrak kode_wilayah dari topic request
-                # bmkg/req/cuaca/{kode_wilayah}
-                parts = msg.topic.split('/')
-                if len(parts) == 4 and parts[0] == "bmkg" and parts[1] == "req" and parts[2] == "cuaca":
-                    kode_wilayah_req = parts[3]
-                    print(f"[Fetcher] Processing request for {kode_wilayah_req}...")
-                    
-                    data_cuaca = fetch_bmkg_data(kode_wilayah_req)
-                    payload_response = json.dumps(data_cuaca if data_cuaca else {"error": "Data not found or failed to fetch"})
-                    
-                    response_properties = props.Properties(PacketTypes.PUBLISH)
-                    if correlation_data:
-                        response_properties.CorrelationData = correlation_data
-                    
-                    client.publish(response_topic, payload_response, qos=1, properties=response_properties)
-                    print(f"[Fetcher] Sent response to {response_topic} for {kode_wilayah_req}")
-                else:
-                    print(f"[Fetcher] Invalid request topic format: {msg.topic}")
-
-            except Exception as e:
-                print(f"[Fetcher] Error processing request: {e}")
-                # Kirim pesan error jika mungkin
-                error_payload = json.dumps({"error": str(e)})
-                response_properties = props.Properties(PacketTypes.PUBLISH)
-                if correlation_data:
-                    response_properties.CorrelationData = correlation_data
-                client.publish(response_topic, error_payload, qos=1, properties=response_properties)
+            bmkg_metrics.request_timer.start(correlation_data, "cuaca")
+            # Ekstrak kode_wilayah dari topic request
+            # bmkg/req/cuaca/{kode_wilayah}
+            parts = msg.topic.split('/')
+            if not (len(parts) == 4 and parts[0] == "bmkg" and parts[1] == "req" and parts[2] == "cuaca"):
+                log.warning("Invalid request topic format: %s", msg.topic)
+                publish_cuaca_response(client, response_topic, correlation_data, {"error": f"Invalid request topic: {msg.topic}"})
+                return
+            kode_wilayah_req = parts[3]
+            # Codec respons mengikuti User Property "accept" dari request (default JSON)
+            response_codec = bmkg_codec.requested_codec(properties)
+            if request_dispatcher is None:
+                process_cuaca_request(client, kode_wilayah_req, response_topic, correlation_data, response_codec)
+            elif not request_dispatcher.submit(
+                process_cuaca_request, client, kode_wilayah_req, response_topic, correlation_data, response_codec,
+                on_expired=reply_cuaca_expired,
+            ):
+                log.warning("Worker queue full (%s requests), rejecting request for %s", request_dispatcher.queue_depth(), kode_wilayah_req)
+                publish_cuaca_response(client, response_topic, correlation_data, {"error": "Responder busy, try again later"})
         else:
-            print("[Fetcher] No ResponseTopic in request properties.")
+            log.warning("No ResponseTopic in request properties.")
+
+def publish_cuaca_response(client, response_topic, correlation_data, payload_content, codec=bmkg_codec.CODEC_JSON):
+    response_properties = bmkg_codec.set_properties(props.Properties(PacketTypes.PUBLISH), codec)
+    if correlation_data:
+        response_properties.CorrelationData = correlation_data
+    bmkg_metrics.track_publish(client.publish(response_topic, bmkg_codec.encode(payload_content, codec), qos=1, properties=response_properties), 1, "response")
+    bmkg_metrics.request_timer.finish(correlation_data, "cuaca", "error" if "error" in payload_content else "success")
+
+def process_cuaca_request(client, kode_wilayah_req, response_topic, correlation_data, response_codec=bmkg_codec.CODEC_JSON, deadline=None):
+    try:
+        log.debug("Processing request for %s...", kode_wilayah_req)
+        fetch_timeout = BMKG_REQUEST_TIMEOUT_SECONDS
+        wait_timeout = None
+        if deadline is not None:
+            wait_timeout = max(0.0, deadline - time.monotonic())
+            fetch_timeout = max(1.0, min(fetch_timeout, wait_timeout))
+        try:
+            # Request bersamaan untuk kode yang sama (di worker berbeda) menunggu satu fetch yang sama
+            data_cuaca = bmkg_fetch_flight.do(kode_wilayah_req, fetch_bmkg_data, kode_wilayah_req, use_cache=True,
+                                              timeout=fetch_timeout, deadline=deadline, wait_timeout=wait_timeout)
+        except TimeoutError:
+            data_cuaca = None
+        publish_cuaca_response(client, response_topic, correlation_data,
+                               data_cuaca if data_cuaca else {"error": "Data not found or failed to fetch"}, response_codec)
+        log.info("Sent response to %s for %s", response_topic, kode_wilayah_req, extra=SAMPLED)
+    except Exception as e:
+        log.exception("Error processing request: %s", e)
+        # Kirim pesan error jika mungkin
+        publish_cuaca_response(client, response_topic, correlation_data, {"error": str(e)})
+
+def reply_cuaca_expired(client, kode_wilayah_req, response_topic, correlation_data, response_codec=bmkg_codec.CODEC_JSON):
+    log.warning("Request for %s expired in the worker queue before it was processed", kode_wilayah_req)
+    publish_cuaca_response(client, response_topic, correlation_data, {"error": "Request expired before it could be processed"})
 
 
 def setup_mqtt_client():
@@ -107,7 +227,7 @@ def setup_mqtt_client():
 
     if USE_MQTTS:
         if not os.path.exists(CA_CERT_PATH):
-            print(f"[Fetcher] ERROR: CA Certificate not found at {CA_CERT_PATH}. MQTTS will likely fail.")
+            log.error("CA Certificate not found at %s. MQTTS will likely fail.", CA_CERT_PATH)
             # exit() # Atau handle lebih baik
         client.tls_set(ca_certs=CA_CERT_PATH, cert_reqs=ssl.CERT_REQUIRED, tls_version=ssl.PROTOCOL_TLS_CLIENT)
         client.tls_insecure_set(False) # Pastikan hostname diverifikasi
@@ -117,55 +237,124 @@ def setup_mqtt_client():
 
     client.on_connect = on_connect
     client.on_message = on_message # Untuk handle request-response
+    client.on_disconnect = on_disconnect
+    client.on_publish = bmkg_metrics.inflight_tracker.on_publish
+    shard_membership.attach(client) # Last Will + presence, sebelum connect
 
     try:
         client.connect(MQTT_BROKER_HOST, port, 60)
     except Exception as e:
-        print(f"[Fetcher] MQTT Connection Error: {e}")
+        log.error("MQTT Connection Error: %s", e)
         return None
     return client
 
-def regular_data_publish(client):
-    print("[Fetcher] Performing regular data publish...")
-    for kode_wilayah in KODE_WILAYAH_MONITOR:
-        data_cuaca_array = fetch_bmkg_data(kode_wilayah)
-        if data_cuaca_array:
-            # Publish seluruh prakiraan 3 harian
-            topic_3harian = f"bmkg/prakiraan-cuaca/{kode_wilayah}/3harian"
-            payload_3harian = json.dumps(data_cuaca_array)
-            client.publish(topic_3harian, payload_3harian, qos=REGULAR_PUBLISH_QOS, retain=True)
-            print(f"[Fetcher] Published to {topic_3harian} (QoS {REGULAR_PUBLISH_QOS}, Retain=True)")
-
-            # Publish prakiraan terdekat (ambil elemen pertama dari array)
-            if isinstance(data_cuaca_array, list) and len(data_cuaca_array) > 0:
-                topic_terdekat = f"bmkg/prakiraan-cuaca/{kode_wilayah}/terdekat"
-                payload_terdekat = json.dumps(data_cuaca_array[0])
-                client.publish(topic_terdekat, payload_terdekat, qos=REGULAR_PUBLISH_QOS, retain=True)
-                print(f"[Fetcher] Published to {topic_terdekat} (QoS {REGULAR_PUBLISH_QOS}, Retain=True)")
-        time.sleep(1.1) # Jaga-jaga rate limit BMKG jika banyak kode wilayah
+def publish_region_forecast(client, kode_wilayah):
+    data_cuaca = fetch_bmkg_data(kode_wilayah)
+    if not data_cuaca or not data_cuaca["forecasts"]:
+        return False
+    data_cuaca_array = data_cuaca["forecasts"]
+    # Publish seluruh prakiraan 3 harian
+    topic_3harian = f"bmkg/prakiraan-cuaca/{kode_wilayah}/3harian"
+    payload_3harian = bmkg_codec.encode(data_cuaca_array)
+    # Dengan DELTA_PUBLISHING, hanya periode yang berubah dikirim ke .../3harian/delta
+    publish_retained_if_changed(client, topic_3harian, payload_3harian,
+                                forecasts=data_cuaca_array if bmkg_delta.DELTA_PUBLISHING else None)
+
+    # Publish prakiraan terdekat (ambil elemen pertama dari array)
+    if len(data_cuaca_array) > 0:
+        topic_terdekat = f"bmkg/prakiraan-cuaca/{kode_wilayah}/terdekat"
+        payload_terdekat = bmkg_codec.encode(data_cuaca_array[0])
+        publish_retained_if_changed(client, topic_terdekat, payload_terdekat)
+    return True
+
+def publish_retained_if_changed(client, topic, payload, forecasts=None):
+    should_publish, payload_digest = published_payloads.check(topic, payload)
+    if not should_publish:
+        log.debug("Payload for %s unchanged, skipping publish", topic)
+        return
+    if forecasts is not None:
+        published = publish_snapshot_or_delta(client, topic, forecasts, payload)
+    else:
+        publish_properties = bmkg_codec.set_properties(props.Properties(PacketTypes.PUBLISH))
+        result = bmkg_metrics.track_publish(
+            client.publish(topic, payload, qos=REGULAR_PUBLISH_QOS, retain=True, properties=publish_properties), REGULAR_PUBLISH_QOS, "forecast")
+        published = result.rc == mqtt.MQTT_ERR_SUCCESS
+        if published:
+            log.debug("Published to %s (QoS %s, Retain=True)", topic, REGULAR_PUBLISH_QOS)
+        else:
+            log.error("Failed to publish to %s, rc: %s", topic, result.rc)
+    if published:
+        published_payloads.record(topic, payload_digest)
+
+def publish_snapshot_or_delta(client, topic, forecasts, payload):
+    update = delta_tracker.plan(topic, forecasts, payload)
+    publish_properties = bmkg_codec.set_properties(props.Properties(PacketTypes.PUBLISH))
+    publish_properties.UserProperty = bmkg_delta.user_properties(update)
+    is_snapshot = update.kind == bmkg_delta.KIND_SNAPSHOT
+    result = bmkg_metrics.track_publish(
+        client.publish(update.topic, update.payload, qos=REGULAR_PUBLISH_QOS, retain=is_snapshot, properties=publish_properties),
+        REGULAR_PUBLISH_QOS, "forecast" if is_snapshot else "delta")
+    if result.rc != mqtt.MQTT_ERR_SUCCESS:
+        delta_tracker.invalidate(topic)
+        log.error("Failed to publish %s to %s, rc: %s", update.kind, update.topic, result.rc)
+        return False
+    delta_tracker.commit(topic, update)
+    log.debug("Published %s #%s to %s (%s B, QoS %s, Retain=%s)", update.kind, update.seq, update.topic, len(update.payload), REGULAR_PUBLISH_QOS, is_snapshot)
+    return True
+
+def regular_data_publish(client, spread=False):
+    kode_wilayah_owned = shard_membership.owned()
+    log.info("Performing regular data publish for %s/%s regions (spread: %s)...", len(kode_wilayah_owned), len(KODE_WILAYAH_MONITOR), spread)
+    # Fetch berjalan paralel, dibatasi token bucket sesuai rate limit BMKG (60 request/menit)
+    cycle = run_fetch_cycle(
+        kode_wilayah_owned, lambda kode_wilayah: publish_region_forecast(client, kode_wilayah),
+        interval_seconds=FETCH_INTERVAL_SECONDS, spread=spread,
+    )
+    log.info("Regular publish cycle complete: %s/%s regions in %ss (dedup: %s, delta: %s, shard: %s)", cycle['succeeded'], cycle['codes'], cycle['duration_seconds'], published_payloads.stats(), delta_tracker.stats(), shard_membership.status())
+    return cycle
+
+def warm_start_cache():
+    if not forecast_store:
+        return
+    for kode_wilayah, fetched_at in forecast_store.adm4_codes().items():
+        stored = forecast_store.latest(kode_wilayah)
+        if stored:
+            forecast_cache.warm(kode_wilayah, stored.data, stored.etag, stored.last_modified, time.time() - fetched_at)
+    log.info("Warm start from %s: %s", forecast_store.path, forecast_store.stats())
 
 def main():
+    global shard_client
+    setup_logging()
+    warm_start_cache()
+    bmkg_metrics.start_http_server()
     client = setup_mqtt_client()
     if not client:
-        print("[Fetcher] Exiting due to MQTT connection failure.")
+        log.error("Exiting due to MQTT connection failure.")
         return
 
     client.loop_start() # Handle network traffic, callbacks, dan reconnections
+    shard_client = client
+    if shard_membership.enabled and not shard_membership.wait_settled():
+        log.warning("Shard presence not confirmed yet, starting with the current node list.")
 
     last_fetch_time = 0
     try:
         while True:
             current_time = time.time()
             if current_time - last_fetch_time > FETCH_INTERVAL_SECONDS:
-                regular_data_publish(client)
+                # Siklus pertama langsung jalan; siklus berikutnya disebar sepanjang interval
+                regular_data_publish(client, spread=last_fetch_time > 0)
                 last_fetch_time = current_time
             time.sleep(10) # Cek setiap 10 detik untuk fetch berikutnya atau untuk loop tetap aktif
     except KeyboardInterrupt:
-        print("[Fetcher] Shutting down...")
+        log.info("Shutting down...")
     finally:
+        shard_membership.leave(client) # Wilayah node ini langsung diambil alih node lain
+        if request_dispatcher:
+            request_dispatcher.shutdown(wait=False)
         client.loop_stop()
         client.disconnect()
-        print("[Fetcher] Disconnected.")
+        log.info("Disconnected.")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,385 @@
+# bmkg_async_publisher.py
+# Engine publisher berbasis asyncio: satu event loop, satu ClientSession aiohttp
+# (koneksi keep-alive di-pool ke api.bmkg.go.id) dan satu klien MQTT async (aiomqtt).
+# Publikasi periodik dan semua handler request/response berjalan sebagai coroutine,
+# jadi ribuan kode ADM4 bisa dilayani dari satu proses tanpa thread per panggilan blocking.
+#
+# Dependensi: aiohttp, aiomqtt (>= 2.0, memakai paho-mqtt >= 2.0), python-dotenv
+# (opsional msgpack / zstandard untuk PAYLOAD_CODEC selain json)
+import asyncio
+import json
+import logging
+import os
+import ssl
+import sys
+import time
+import uuid
+from datetime import datetime
+
+import aiohttp
+import aiomqtt
+import paho.mqtt.properties as props
+from paho.mqtt.packettypes import PacketTypes
+from dotenv import load_dotenv
+
+load_dotenv() # Sebelum modul bmkg_* membaca konfigurasinya saat di-import
+
+import bmkg_codec
+import bmkg_metrics
+from bmkg_logging import setup_logging
+from bmkg_cache import ForecastCache
+from bmkg_forecast import normalize_bmkg_response
+from bmkg_sharding import shared_topic
+from bmkg_ratelimit import AsyncTokenBucket, FETCH_SPREAD_RATIO
+from bmkg_http import HTTP_MAX_RETRIES, RETRY_STATUS_CODES, USER_AGENT, compute_backoff, parse_retry_after
+
+log = logging.getLogger("bmkg.async_publisher")
+
+# --- Konfigurasi (nama variabel sama dengan publisher lain di repo ini) ---
+MQTT_BROKER_HOST = os.getenv("MQTT_BROKER_HOST", "localhost")
+MQTT_BROKER_PORT_MQTT = int(os.getenv("MQTT_BROKER_PORT_MQTT", 1883))
+MQTT_BROKER_PORT_MQTTS = int(os.getenv("MQTT_BROKER_PORT_MQTTS", 8883))
+MQTT_USERNAME = os.getenv("MQTT_FETCHER_USERNAME")
+MQTT_PASSWORD = os.getenv("MQTT_FETCHER_PASSWORD")
+CA_CERT_PATH = os.getenv("CA_CERT_PATH", "C:/mosquitto_certs/ca.crt")
+USE_MQTTS = os.getenv("USE_MQTTS", "true").lower() == "true"
+
+ADM4_CODES_STR = os.getenv("ADM4_CODES_LIST", "")
+ADM4_CODES = [code.strip() for code in ADM4_CODES_STR.split(',') if code.strip()]
+API_BASE_URL = os.getenv("BMKG_API_URL", "https://api.bmkg.go.id/publik/prakiraan-cuaca")
+FETCH_INTERVAL_SECONDS = int(os.getenv("FETCH_INTERVAL_SECONDS", 3600))
+DATA_QOS_LEVEL = int(os.getenv("DATA_QOS_LEVEL", 1))
+
+# "prakiraan" -> bmkg/prakiraan/{adm4} (BismillahFiks)
+# "prakiraan-cuaca" -> bmkg/prakiraan-cuaca/{kode}/3harian & /terdekat (bmkg-fiks_publisher.py)
+PERIODIC_TOPIC_LAYOUT = os.getenv("PERIODIC_TOPIC_LAYOUT", "prakiraan")
+
+WEATHER_REQUEST_TOPIC = "bmkg/weather/request"   # Format request publisher5_bmkg.py
+CUACA_REQUEST_TOPIC = "bmkg/req/cuaca/+"         # Format request bmkg-fiks_publisher.py
+REQUEST_TOPIC_CONTROL = os.getenv("REQUEST_TOPIC_CONTROL", "bmkg/control/request")
+
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", 20))              # Koneksi keep-alive maksimum ke BMKG
+MAX_CONCURRENT_FETCHES = int(os.getenv("MAX_CONCURRENT_FETCHES", 10))
+MAX_CONCURRENT_HANDLERS = int(os.getenv("MAX_CONCURRENT_HANDLERS", 200))
+BMKG_REQUEST_TIMEOUT_SECONDS = float(os.getenv("BMKG_REQUEST_TIMEOUT_SECONDS", 20))
+REQUEST_DEADLINE_SECONDS = float(os.getenv("RESPONDER_REQUEST_DEADLINE_SECONDS", 30))
+MQTT_RECONNECT_INTERVAL_SECONDS = 5
+
+
+class AsyncBmkgPublisher:
+    def __init__(self, adm4_codes):
+        self.adm4_codes = adm4_codes
+        self.cache = ForecastCache()
+        self.http = None
+        self.mqtt = None
+        self._fetch_slots = asyncio.Semaphore(MAX_CONCURRENT_FETCHES)
+        self._handler_slots = asyncio.Semaphore(MAX_CONCURRENT_HANDLERS)
+        self._inflight = {}  # adm4 -> asyncio.Task (single-flight)
+        self._rate_limiter = AsyncTokenBucket()  # Kuota BMKG_RATE_LIMIT_PER_MINUTE, termasuk percobaan ulang
+        self._background_tasks = set()  # Referensi kuat ke task fire-and-forget sampai selesai
+        self.started_at = datetime.now()
+        self.last_cycle_seconds = None
+        self._publishing = 0  # Publish QoS > 0 yang masih menunggu ACK (aiomqtt menunggu ACK di dalam publish)
+        self._active_handlers = 0
+        bmkg_metrics.MQTT_INFLIGHT.set_function(lambda: self._publishing)
+        bmkg_metrics.QUEUE_DEPTH.set_function(lambda: self._active_handlers, queue="handlers")
+
+    # --- HTTP (BMKG) ---
+    async def get_forecast(self, adm4, allow_cached=True):
+        cached_entry = self.cache.lookup(adm4)
+        if allow_cached and cached_entry and cached_entry.is_fresh():
+            return cached_entry.data
+        task = self._inflight.get(adm4)
+        if task is None:
+            task = asyncio.ensure_future(self._fetch_upstream(adm4, cached_entry))
+            self._inflight[adm4] = task
+            task.add_done_callback(lambda _t, key=adm4: self._inflight.pop(key, None))
+        # shield: pembatalan satu peminta (mis. deadline) tidak membatalkan fetch bersama
+        return await asyncio.shield(task)
+
+    async def _fetch_upstream(self, adm4, cached_entry):
+        url = f"{API_BASE_URL}?adm4={adm4}"
+        request_headers = cached_entry.validators() if cached_entry else {}
+        async with self._fetch_slots:
+            return await self._fetch_with_retries(adm4, url, request_headers, cached_entry)
+
+    async def _fetch_with_retries(self, adm4, url, request_headers, cached_entry):
+        started = time.monotonic()
+        for attempt in range(1, HTTP_MAX_RETRIES + 2):
+            retry_after = None
+            await self._rate_limiter.acquire()
+            try:
+                async with self.http.get(url, headers=request_headers) as response:
+                    if response.status == 304 and cached_entry:
+                        bmkg_metrics.record_fetch(response.status, time.monotonic() - started)
+                        return self.cache.revalidated(adm4, cached_entry, response.headers).data
+                    if response.status in RETRY_STATUS_CODES and attempt <= HTTP_MAX_RETRIES:
+                        retry_after = parse_retry_after(response.headers.get("Retry-After"))
+                    else:
+                        bmkg_metrics.record_fetch(response.status, time.monotonic() - started)
+                        response.raise_for_status()
+                        data = normalize_bmkg_response(await response.json(content_type=None))
+                        self.cache.store(adm4, data, response.headers)
+                        return data
+            except aiohttp.ClientResponseError as e:
+                log.warning("HTTP error fetching BMKG data for %s: %s %s", adm4, e.status, e.message)
+                return None
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if attempt > HTTP_MAX_RETRIES:
+                    bmkg_metrics.record_fetch("error", time.monotonic() - started)
+                    log.warning("Error fetching BMKG data for %s: %r", adm4, e)
+                    return None
+            except json.JSONDecodeError as e:
+                log.error("Error decoding JSON for %s: %s", adm4, e)
+                return None
+            delay = compute_backoff(attempt, retry_after)
+            log.warning("Retrying BMKG fetch for %s in %.1fs (attempt %s/%s)", adm4, delay, attempt, HTTP_MAX_RETRIES)
+            await asyncio.sleep(delay)
+        return None
+
+    # --- MQTT publish helpers ---
+    async def publish_payload(self, topic, payload_obj, qos=1, retain=False, properties=None, codec=bmkg_codec.PAYLOAD_CODEC,
+                              kind="forecast"):
+        properties = bmkg_codec.set_properties(properties or props.Properties(PacketTypes.PUBLISH), codec)
+        awaits_ack = qos > 0
+        if awaits_ack:
+            self._publishing += 1
+        try:
+            await self.mqtt.publish(topic, bmkg_codec.encode(payload_obj, codec), qos=qos, retain=retain, properties=properties)
+        finally:
+            if awaits_ack:
+                self._publishing -= 1
+        bmkg_metrics.MQTT_PUBLISHED.inc(kind=kind)
+
+    async def publish_response(self, response_topic, correlation_data, qos, payload_obj, codec=bmkg_codec.CODEC_JSON,
+                               request_kind="weather"):
+        response_properties = props.Properties(PacketTypes.PUBLISH)
+        if correlation_data:
+            response_properties.CorrelationData = correlation_data
+        await self.publish_payload(response_topic, payload_obj, qos=qos, properties=response_properties, codec=codec, kind="response")
+        outcome = "error" if "error" in payload_obj or payload_obj.get("status") == "error" else "success"
+        bmkg_metrics.request_timer.finish(correlation_data, request_kind, outcome)
+
+    # --- Publikasi periodik ---
+    async def publish_region(self, adm4):
+        data = await self.get_forecast(adm4, allow_cached=False)
+        if not data:
+            log.warning("No data for %s, nothing published", adm4)
+            return False
+        if PERIODIC_TOPIC_LAYOUT == "prakiraan-cuaca":
+            forecasts = data["forecasts"]
+            await self.publish_payload(f"bmkg/prakiraan-cuaca/{adm4}/3harian", forecasts, qos=DATA_QOS_LEVEL, retain=True)
+            if forecasts:
+                await self.publish_payload(f"bmkg/prakiraan-cuaca/{adm4}/terdekat", forecasts[0], qos=DATA_QOS_LEVEL, retain=True)
+        else:
+            pub_props = props.Properties(PacketTypes.PUBLISH)
+            pub_props.MessageExpiryInterval = int(FETCH_INTERVAL_SECONDS * 1.5)
+            await self.publish_payload(f"bmkg/prakiraan/{adm4}", data["forecasts"], qos=DATA_QOS_LEVEL, properties=pub_props)
+        return True
+
+    async def _publish_region_after(self, adm4, delay):
+        await asyncio.sleep(delay)
+        return await self.publish_region(adm4)
+
+    async def periodic_publish_loop(self):
+        while True:
+            started = time.monotonic()
+            # Waktu mulai tiap kode disebar sepanjang FETCH_SPREAD_RATIO * interval (sama seperti
+            # bmkg_ratelimit.run_fetch_cycle) supaya refresh tidak menumpuk di awal siklus
+            step_seconds = FETCH_INTERVAL_SECONDS * FETCH_SPREAD_RATIO / len(self.adm4_codes) if self.adm4_codes else 0
+            results = await asyncio.gather(
+                *(self._publish_region_after(adm4, index * step_seconds) for index, adm4 in enumerate(self.adm4_codes)),
+                return_exceptions=True,
+            )
+            ok_count = sum(1 for r in results if r is True)
+            for adm4, result in zip(self.adm4_codes, results):
+                if isinstance(result, Exception):
+                    log.error("Unexpected error publishing %s: %r", adm4, result, exc_info=result)
+            self.last_cycle_seconds = time.monotonic() - started
+            log.info("Cycle complete: %s/%s regions in %.1fs", ok_count, len(self.adm4_codes), self.last_cycle_seconds)
+            await asyncio.sleep(max(0, FETCH_INTERVAL_SECONDS - self.last_cycle_seconds))
+
+    # --- Request/response handlers ---
+    async def handle_weather_request(self, message):
+        """bmkg/weather/request, format publisher5_bmkg.py."""
+        try:
+            request_data = json.loads(message.payload)
+        except (json.JSONDecodeError, UnicodeDecodeError) as e:
+            log.warning("Invalid weather request payload: %s", e)
+            return
+        properties = message.properties
+        response_topic = request_data.get("response_topic_in_payload") or getattr(properties, "ResponseTopic", None)
+        correlation_data = getattr(properties, "CorrelationData", None)
+        if not response_topic:
+            log.warning("Weather request without response topic, ignored")
+            return
+        bmkg_metrics.request_timer.start(correlation_data, "weather")
+        adm4_code = request_data.get("adm4_code")
+        response_payload = {
+            "adm4_code_requested": adm4_code,
+            "timestamp_response": time.strftime('%Y-%m-%d %H:%M:%S %Z'),
+        }
+        try:
+            weather_data = await asyncio.wait_for(self.get_forecast(adm4_code), REQUEST_DEADLINE_SECONDS)
+        except asyncio.TimeoutError:
+            weather_data = None
+            response_payload["message"] = "Deadline request terlewati saat menunggu data BMKG"
+        if weather_data:
+            response_payload.update({"status": "success", "location": weather_data["location"], "forecasts": weather_data["forecasts"]})
+        else:
+            response_payload["status"] = "error"
+            response_payload.setdefault("message", "Gagal mengambil data dari BMKG")
+        await self.publish_response(response_topic, correlation_data, int(request_data.get("response_qos", 1)), response_payload,
+                                    codec=bmkg_codec.requested_codec(properties, request_data))
+
+    async def handle_cuaca_request(self, message):
+        """bmkg/req/cuaca/{kode_wilayah}, format bmkg-fiks_publisher.py."""
+        properties = message.properties
+        response_topic = getattr(properties, "ResponseTopic", None)
+        if not response_topic:
+            log.warning("No ResponseTopic in request properties.")
+            return
+        kode_wilayah = message.topic.value.split('/')[-1]
+        bmkg_metrics.request_timer.start(getattr(properties, "CorrelationData", None), "cuaca")
+        try:
+            data_cuaca = await asyncio.wait_for(self.get_forecast(kode_wilayah), REQUEST_DEADLINE_SECONDS)
+        except asyncio.TimeoutError:
+            data_cuaca = None
+        await self.publish_response(
+            response_topic, getattr(properties, "CorrelationData", None), 1,
+            data_cuaca if data_cuaca else {"error": "Data not found or failed to fetch"},
+            codec=bmkg_codec.requested_codec(properties), request_kind="cuaca",
+        )
+
+    async def handle_control_request(self, message):
+        """bmkg/control/request, format BismillahFiks/publisher."""
+        properties = message.properties
+        response_topic = getattr(properties, "ResponseTopic", None)
+        if not response_topic:
+            log.warning("No Response Topic in control request, cannot reply.")
+            return
+        try:
+            request_data = json.loads(message.payload)
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            log.warning("Error decoding JSON payload from control message.")
+            return
+        command = request_data.get("command")
+        bmkg_metrics.request_timer.start(getattr(properties, "CorrelationData", None), "control")
+        if command == "status":
+            response_payload = {
+                "status": "Publisher is running",
+                "timestamp": datetime.now().isoformat(),
+                "monitoring_adm4": self.adm4_codes,
+                "last_cycle_seconds": self.last_cycle_seconds,
+                "cache": self.cache.stats(),
+            }
+        elif command == "force_refresh":
+            adm4 = request_data.get("adm4")
+            if adm4 and adm4 in self.adm4_codes:
+                self._spawn(self.publish_region(adm4))
+                response_payload = {"status": f"Data refresh triggered for {adm4}"}
+            else:
+                response_payload = {"error": f"Invalid or not monitored adm4 code for refresh: {adm4}"}
+        else:
+            response_payload = {"error": "Unknown command"}
+        await self.publish_response(response_topic, getattr(properties, "CorrelationData", None), 1, response_payload,
+                                    codec=bmkg_codec.requested_codec(properties, request_data), request_kind="control")
+
+    def _spawn(self, coro):
+        """Jalankan coroutine di latar belakang tanpa membiarkan task-nya di-garbage-collect."""
+        task = asyncio.ensure_future(coro)
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+        return task
+
+    async def _run_handler(self, handler, message):
+        self._active_handlers += 1
+        try:
+            await handler(message)
+        except aiomqtt.MqttError as e:
+            log.warning("MQTT error while answering %s: %s", message.topic.value, e)
+        except Exception as e:
+            log.exception("Error processing message on %s: %r", message.topic.value, e)
+        finally:
+            self._active_handlers -= 1
+            self._handler_slots.release()
+
+    async def message_loop(self):
+        handlers = (
+            (WEATHER_REQUEST_TOPIC, self.handle_weather_request),
+            (CUACA_REQUEST_TOPIC, self.handle_cuaca_request),
+            (REQUEST_TOPIC_CONTROL, self.handle_control_request),
+        )
+        for topic, _ in handlers:
+            # Request data dibagi antar instance lewat RESPONDER_SHARE_GROUP; topik kontrol tetap diterima semua
+            subscription = topic if topic == REQUEST_TOPIC_CONTROL else shared_topic(topic)
+            await self.mqtt.subscribe(subscription, qos=1)
+            log.info("Subscribed to %s", subscription)
+        async for message in self.mqtt.messages:
+            for topic, handler in handlers:
+                if message.topic.matches(topic):
+                    # Setiap request jadi task sendiri; loop pembaca tidak pernah menunggu BMKG
+                    await self._handler_slots.acquire()
+                    self._spawn(self._run_handler(handler, message))
+                    break
+
+    # --- Lifecycle ---
+    def _mqtt_client_kwargs(self):
+        kwargs = {
+            "hostname": MQTT_BROKER_HOST,
+            "port": MQTT_BROKER_PORT_MQTT,
+            "identifier": f"bmkg-async-publisher-{uuid.uuid4()}",
+            "protocol": aiomqtt.ProtocolVersion.V5,
+            "username": MQTT_USERNAME if MQTT_USERNAME and MQTT_PASSWORD else None,
+            "password": MQTT_PASSWORD if MQTT_USERNAME and MQTT_PASSWORD else None,
+        }
+        if USE_MQTTS:
+            if not os.path.exists(CA_CERT_PATH):
+                log.error("CA Certificate not found at %s. MQTTS will likely fail.", CA_CERT_PATH)
+            kwargs["port"] = MQTT_BROKER_PORT_MQTTS
+            kwargs["tls_params"] = aiomqtt.TLSParameters(
+                ca_certs=CA_CERT_PATH, cert_reqs=ssl.CERT_REQUIRED, tls_version=ssl.PROTOCOL_TLS_CLIENT
+            )
+        return kwargs
+
+    async def run(self):
+        connector = aiohttp.TCPConnector(limit=HTTP_POOL_SIZE, limit_per_host=HTTP_POOL_SIZE, ttl_dns_cache=300, keepalive_timeout=60)
+        timeout = aiohttp.ClientTimeout(total=BMKG_REQUEST_TIMEOUT_SECONDS)
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout, headers={"User-Agent": USER_AGENT}) as http:
+            self.http = http
+            while True:
+                try:
+                    async with aiomqtt.Client(**self._mqtt_client_kwargs()) as mqtt_client:
+                        self.mqtt = mqtt_client
+                        log.info("Connected to MQTT Broker (TLS: %s)!", USE_MQTTS)
+                        bmkg_metrics.record_connect()
+                        tasks = [asyncio.ensure_future(self.message_loop())]
+                        if self.adm4_codes:
+                            tasks.append(asyncio.ensure_future(self.periodic_publish_loop()))
+                        try:
+                            await asyncio.gather(*tasks)
+                        finally:
+                            for task in tasks:
+                                task.cancel()
+                except aiomqtt.MqttError as e:
+                    log.warning("MQTT connection lost: %s. Reconnecting in %ss...", e, MQTT_RECONNECT_INTERVAL_SECONDS)
+                    bmkg_metrics.record_disconnect()
+                    await asyncio.sleep(MQTT_RECONNECT_INTERVAL_SECONDS)
+
+
+def main():
+    if sys.platform.lower() == "win32":
+        # aiomqtt butuh add_reader/add_writer yang tidak ada di ProactorEventLoop
+        asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+    setup_logging()
+    publisher = AsyncBmkgPublisher(ADM4_CODES)
+    bmkg_metrics.start_http_server()
+    log.info("Monitoring %s ADM4 codes every %ss (layout: %s, max %s concurrent BMKG fetches)", len(ADM4_CODES), FETCH_INTERVAL_SECONDS, PERIODIC_TOPIC_LAYOUT, MAX_CONCURRENT_FETCHES)
+    try:
+        asyncio.run(publisher.run())
+    except KeyboardInterrupt:
+        log.info("Shutting down...")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+# bmkg_cache.py
+# Cache in-process untuk respons BMKG API, dipakai bersama oleh responder
+# request/response (publisher5_bmkg.py dan bmkg-fiks_publisher.py).
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from bmkg_metrics import CACHE_LOOKUPS
+
+# Prakiraan BMKG hanya berubah sekitar sekali per jam
+CACHE_TTL_SECONDS = int(os.getenv("BMKG_CACHE_TTL_SECONDS", 900))
+CACHE_MAX_ENTRIES = int(os.getenv("BMKG_CACHE_MAX_ENTRIES", 512))
+
+
+class CacheEntry:
+    __slots__ = ("data", "etag", "last_modified", "stored_at", "ttl_seconds")
+
+    def __init__(self, data, etag, last_modified, ttl_seconds):
+        self.data = data
+        self.etag = etag
+        self.last_modified = last_modified
+        self.stored_at = time.monotonic()
+        self.ttl_seconds = ttl_seconds
+
+    def is_fresh(self):
+        return time.monotonic() - self.stored_at < self.ttl_seconds
+
+    def validators(self):
+        """Header untuk conditional GET (revalidasi entri yang sudah kedaluwarsa)."""
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+
+class ForecastCache:
+    """Cache LRU ber-TTL untuk data BMKG dengan kunci kode ADM4.
+
+    Entri yang sudah kedaluwarsa tidak langsung dibuang: ETag/Last-Modified-nya
+    masih dipakai untuk revalidasi, sehingga jawaban 304 dari BMKG cukup
+    memperpanjang umur entri tanpa mengunduh ulang payload.
+    """
+
+    def __init__(self, ttl_seconds=CACHE_TTL_SECONDS, max_entries=CACHE_MAX_ENTRIES):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+
+    def lookup(self, adm4):
+        """Kembalikan CacheEntry (segar atau kedaluwarsa) atau None."""
+        with self._lock:
+            entry = self._entries.get(adm4)
+            if entry is None:
+                self.misses += 1
+                CACHE_LOOKUPS.inc(result="miss")
+                return None
+            self._entries.move_to_end(adm4)
+            if entry.is_fresh():
+                self.hits += 1
+                CACHE_LOOKUPS.inc(result="hit")
+            else:
+                self.misses += 1
+                CACHE_LOOKUPS.inc(result="stale")
+            return entry
+
+    def store(self, adm4, data, response_headers=None):
+        headers = response_headers or {}
+        entry = CacheEntry(data, headers.get("ETag"), headers.get("Last-Modified"), self.ttl_seconds)
+        with self._lock:
+            self._put_locked(adm4, entry)
+        return entry
+
+    def warm(self, adm4, data, etag=None, last_modified=None, age_seconds=0):
+        """Isi cache dari penyimpanan persisten saat start; umur entri mengikuti waktu fetch aslinya."""
+        entry = CacheEntry(data, etag, last_modified, self.ttl_seconds)
+        entry.stored_at -= max(0, age_seconds)
+        with self._lock:
+            self._put_locked(adm4, entry)
+        return entry
+
+    def revalidated(self, adm4, entry, response_headers=None):
+        """Dipanggil saat BMKG menjawab 304 Not Modified untuk `entry`."""
+        headers = response_headers or {}
+        refreshed = CacheEntry(
+            entry.data,
+            headers.get("ETag") or entry.etag,
+            headers.get("Last-Modified") or entry.last_modified,
+            self.ttl_seconds,
+        )
+        with self._lock:
+            self.revalidations += 1
+            CACHE_LOOKUPS.inc(result="revalidated")
+            self._put_locked(adm4, refreshed)
+        return refreshed
+
+    def _put_locked(self, adm4, entry):
+        self._entries[adm4] = entry
+        self._entries.move_to_end(adm4)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)  # Buang entri yang paling lama tidak dipakai
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "revalidations": self.revalidations,
+            }
@@ -0,0 +1,129 @@
+# bmkg_delta.py
+# Publikasi delta prakiraan: hanya periode yang berubah (dikunci dengan `datetime`)
+# dikirim ke sub-topik "<topik>/delta", sedangkan snapshot penuh tetap dikirim
+# berkala ke topik aslinya sebagai retained message. Setiap pesan membawa nomor
+# urut (User Property "seq") supaya subscriber bisa mendeteksi delta yang hilang
+# dan resync dari snapshot berikutnya.
+import json
+import os
+import threading
+import time
+from collections import namedtuple
+
+DELTA_PUBLISHING = os.getenv("DELTA_PUBLISHING", "false").lower() == "true"
+DELTA_TOPIC_SUFFIX = os.getenv("DELTA_TOPIC_SUFFIX", "/delta")
+# Snapshot penuh tetap dikirim minimal sekali per interval ini
+DELTA_SNAPSHOT_INTERVAL_SECONDS = int(os.getenv("DELTA_SNAPSHOT_INTERVAL_SECONDS", 6 * 3600))
+# Jika payload delta lebih besar dari rasio ini terhadap snapshot, kirim snapshot saja
+DELTA_MAX_SIZE_RATIO = float(os.getenv("DELTA_MAX_SIZE_RATIO", 0.6))
+
+KIND_SNAPSHOT = "snapshot"
+KIND_DELTA = "delta"
+
+DeltaUpdate = namedtuple("DeltaUpdate", ["kind", "topic", "payload", "seq", "forecasts"])
+
+
+def delta_topic(topic):
+    return f"{topic}{DELTA_TOPIC_SUFFIX}"
+
+
+def forecast_key(forecast):
+    return forecast.get("datetime") or forecast.get("local_datetime")
+
+
+def index_forecasts(forecasts):
+    """dict datetime -> periode prakiraan, atau None jika data bukan list periode."""
+    if not isinstance(forecasts, list):
+        return None
+    indexed = {}
+    for forecast in forecasts:
+        key = forecast_key(forecast) if isinstance(forecast, dict) else None
+        if key is None:
+            return None
+        indexed[key] = forecast
+    return indexed
+
+
+def diff_forecasts(previous, current):
+    """(periode baru/berubah, key periode yang hilang) antara dua hasil index_forecasts."""
+    changed = [forecast for key, forecast in current.items() if previous.get(key) != forecast]
+    removed = [key for key in previous if key not in current]
+    return changed, removed
+
+
+def user_properties(update):
+    """User Property MQTT 5 untuk sebuah DeltaUpdate."""
+    return [("kind", update.kind), ("seq", str(update.seq))]
+
+
+class DeltaTracker:
+    """Menyimpan prakiraan terakhir yang dipublish per topik dan memilih snapshot atau delta.
+
+    Pola pemakaian sama dengan PayloadHashStore: `plan()` sebelum publish,
+    lalu `commit()` jika publish sukses atau `invalidate()` jika gagal
+    (publikasi berikutnya untuk topik itu dipaksa snapshot).
+    """
+
+    def __init__(self, snapshot_interval_seconds=DELTA_SNAPSHOT_INTERVAL_SECONDS, max_size_ratio=DELTA_MAX_SIZE_RATIO,
+                 encoder=json.dumps):
+        self.snapshot_interval_seconds = snapshot_interval_seconds
+        self.encoder = encoder  # Harus sama dengan codec snapshot, mis. bmkg_codec.encode
+        self.max_size_ratio = max_size_ratio
+        self._states = {}  # topic -> [forecasts terindeks, waktu snapshot terakhir]
+        self._seq = {}  # topic -> seq terakhir; tidak pernah direset agar subscriber tidak salah urut
+        self._lock = threading.Lock()
+        self.snapshots = 0
+        self.deltas = 0
+
+    def plan(self, topic, forecasts, snapshot_payload, force_snapshot=False):
+        """Tentukan publikasi berikutnya untuk `topic`.
+
+        `snapshot_payload` adalah payload penuh yang biasa dikirim ke topik ini;
+        snapshot tetap memakai payload itu sehingga subscriber lama tidak terpengaruh.
+        """
+        current = index_forecasts(forecasts)
+        with self._lock:
+            seq = self._seq.get(topic, 0) + 1
+            self._seq[topic] = seq
+            state = self._states.get(topic)
+
+        snapshot = DeltaUpdate(KIND_SNAPSHOT, topic, snapshot_payload, seq, current)
+        if (force_snapshot or current is None or state is None
+                or time.monotonic() - state[1] >= self.snapshot_interval_seconds):
+            return snapshot
+
+        changed, removed = diff_forecasts(state[0], current)
+        if not changed and not removed:
+            # Hanya terjadi saat keep-alive/force: kirim ulang snapshot, bukan delta kosong
+            return snapshot
+        delta_payload = self.encoder({"seq": seq, "changed": changed, "removed": removed})
+        if len(delta_payload) > len(snapshot_payload) * self.max_size_ratio:
+            return snapshot
+        return DeltaUpdate(KIND_DELTA, delta_topic(topic), delta_payload, seq, current)
+
+    def commit(self, base_topic, update):
+        """Catat publikasi yang berhasil."""
+        with self._lock:
+            if update.kind == KIND_DELTA:
+                self.deltas += 1
+                state = self._states.get(base_topic)
+                if state:
+                    state[0] = update.forecasts
+                return
+            self.snapshots += 1
+            if update.forecasts is None:  # Data bukan list periode, tidak bisa di-delta
+                self._states.pop(base_topic, None)
+            else:
+                self._states[base_topic] = [update.forecasts, time.monotonic()]
+
+    def invalidate(self, base_topic=None):
+        """Paksa snapshot untuk publikasi berikutnya (satu topik, atau semua jika None)."""
+        with self._lock:
+            if base_topic is None:
+                self._states.clear()
+            else:
+                self._states.pop(base_topic, None)
+
+    def stats(self):
+        with self._lock:
+            return {"topics": len(self._states), "snapshots": self.snapshots, "deltas": self.deltas}
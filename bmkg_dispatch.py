@@ -0,0 +1,76 @@
+# bmkg_dispatch.py
+# Worker pool untuk responder: pekerjaan berat (fetch BMKG + publish respons)
+# dipindah dari thread network paho ke thread worker dengan antrian terbatas.
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+log = logging.getLogger(__name__)
+
+
+class RequestDispatcher:
+    """Thread pool dengan antrian terbatas dan deadline per request.
+
+    `submit` tidak pernah memblokir: jika semua worker sibuk dan antrian
+    penuh, request langsung ditolak (return False) supaya pemanggil bisa
+    menjawab "sibuk" alih-alih menahan thread network paho.
+    """
+
+    def __init__(self, max_workers, max_queue, deadline_seconds):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.deadline_seconds = deadline_seconds
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="bmkg-worker")
+        self._slots = threading.BoundedSemaphore(max_workers + max_queue)
+        self._lock = threading.Lock()
+        self._pending = 0
+        self.rejected = 0
+        self.expired = 0
+
+    def submit(self, handler, *args, on_expired=None):
+        """Jadwalkan handler(*args, deadline=...) di worker pool.
+
+        `on_expired(*args)` dipanggil (di worker) jika request sudah melewati
+        deadline sebelum sempat dikerjakan.
+        """
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+            return False
+        deadline = time.monotonic() + self.deadline_seconds
+        with self._lock:
+            self._pending += 1
+        try:
+            self._executor.submit(self._run, handler, args, deadline, on_expired)
+        except RuntimeError:  # Executor sudah di-shutdown
+            self._release()
+            return False
+        return True
+
+    def _run(self, handler, args, deadline, on_expired):
+        try:
+            if time.monotonic() >= deadline:
+                with self._lock:
+                    self.expired += 1
+                if on_expired:
+                    on_expired(*args)
+                return
+            handler(*args, deadline=deadline)
+        except Exception as e:
+            log.exception("Error tak terduga di worker: %s", e)
+        finally:
+            self._release()
+
+    def _release(self):
+        with self._lock:
+            self._pending -= 1
+        self._slots.release()
+
+    def queue_depth(self):
+        """Jumlah request yang sedang dikerjakan atau menunggu worker."""
+        with self._lock:
+            return self._pending
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait, cancel_futures=True)
@@ -0,0 +1,149 @@
+# bmkg_fanout.py
+# Flow control untuk fan-out banyak pesan QoS 1 kecil: jumlah pesan yang menunggu
+# PUBACK dibatasi (window), publish tidak menunggu ACK per pesan, dan penyelesaian
+# dikonfirmasi per batch lewat callback on_publish paho.
+import os
+import threading
+import time
+from collections import OrderedDict
+
+MQTT_MAX_INFLIGHT = int(os.getenv("MQTT_MAX_INFLIGHT", 100))
+# Lama menunggu slot window kosong sebelum publish dianggap gagal (broker macet/putus)
+PUBLISH_WINDOW_TIMEOUT_SECONDS = float(os.getenv("PUBLISH_WINDOW_TIMEOUT_SECONDS", 30))
+
+
+class PublishBatch:
+    """Sekelompok publish (mis. semua periode satu wilayah) yang ditunggu ACK-nya bersama."""
+
+    __slots__ = ("name", "submitted", "acked", "failed", "started_at", "finished_at",
+                 "closed", "on_complete", "_done")
+
+    def __init__(self, name, on_complete=None):
+        self.name = name
+        self.submitted = 0
+        self.acked = 0
+        self.failed = 0
+        self.started_at = time.monotonic()
+        self.finished_at = None
+        self.closed = False
+        self.on_complete = on_complete
+        self._done = threading.Event()
+
+    def duration_ms(self):
+        end = self.finished_at if self.finished_at is not None else time.monotonic()
+        return round((end - self.started_at) * 1000, 1)
+
+    def wait(self, timeout=None):
+        """Tunggu sampai semua pesan batch di-ACK (opsional, untuk pemanggil yang perlu sinkron)."""
+        return self._done.wait(timeout)
+
+
+class PublishWindow:
+    """Window in-flight untuk client.publish QoS > 0.
+
+    `publish()` memblokir hanya jika sudah ada `max_inflight` pesan yang belum
+    di-ACK; pasang `on_publish` sebagai callback paho (atau panggil dari
+    callback yang sudah ada) agar slot dilepas saat PUBACK datang.
+    """
+
+    def __init__(self, max_inflight=MQTT_MAX_INFLIGHT, slot_timeout=PUBLISH_WINDOW_TIMEOUT_SECONDS):
+        self.max_inflight = max_inflight
+        self.slot_timeout = slot_timeout
+        self._slots = threading.Semaphore(max_inflight)
+        self._lock = threading.Lock()
+        self._pending = {}  # mid -> PublishBatch
+        self._early_acks = OrderedDict()  # mid -> waktu PUBACK; ACK bisa datang sebelum publish() sempat mencatat mid
+
+    def configure_client(self, client):
+        """Samakan batas in-flight/antrian paho dengan window ini."""
+        client.max_inflight_messages_set(self.max_inflight)
+        client.max_queued_messages_set(self.max_inflight * 2)
+
+    def begin_batch(self, name, on_complete=None):
+        return PublishBatch(name, on_complete)
+
+    def publish(self, client, batch, topic, payload, qos=1, retain=False):
+        if qos == 0:
+            result = client.publish(topic, payload, qos=0, retain=retain)
+            with self._lock:
+                batch.submitted += 1
+                if result.rc == 0:
+                    batch.acked += 1
+                else:
+                    batch.failed += 1
+            return result.rc == 0
+
+        if not self._slots.acquire(timeout=self.slot_timeout):
+            with self._lock:
+                batch.submitted += 1
+                batch.failed += 1
+            return False
+        result = client.publish(topic, payload, qos=qos, retain=retain)
+        with self._lock:
+            batch.submitted += 1
+            if result.rc != 0:
+                batch.failed += 1
+                self._slots.release()
+                return False
+            if self._early_acks.pop(result.mid, None) is not None:
+                batch.acked += 1
+                self._slots.release()
+            else:
+                self._pending[result.mid] = batch
+        return True
+
+    def close_batch(self, batch):
+        """Tandai batch selesai di-submit; on_complete dipanggil setelah ACK terakhir."""
+        with self._lock:
+            batch.closed = True
+        self._maybe_complete(batch)
+
+    def on_publish(self, client, userdata, mid, *args):
+        with self._lock:
+            batch = self._pending.pop(mid, None)
+            if batch is None:
+                self._remember_early_ack_locked(mid)
+                return
+            batch.acked += 1
+        self._slots.release()
+        self._maybe_complete(batch)
+
+    def _remember_early_ack_locked(self, mid):
+        # ACK tanpa pasangan yang tidak pernah diklaim publish() (mis. pesan lama yang dikirim ulang
+        # setelah reconnect) dibuang satu per satu dari yang tertua: setelah slot_timeout, atau saat
+        # jumlahnya melebihi 2x window. mid paho bisa dipakai ulang, jadi ACK baru pindah ke ekor.
+        now = time.monotonic()
+        self._early_acks[mid] = now
+        self._early_acks.move_to_end(mid)
+        while self._early_acks:
+            oldest_at = next(iter(self._early_acks.values()))
+            if len(self._early_acks) <= self.max_inflight * 2 and now - oldest_at < self.slot_timeout:
+                break
+            self._early_acks.popitem(last=False)
+
+    def inflight(self):
+        """Jumlah pesan QoS > 0 yang sudah dikirim tapi belum di-ACK."""
+        with self._lock:
+            return len(self._pending)
+
+    def reset(self):
+        """Dipanggil saat koneksi putus: pesan yang belum di-ACK dianggap gagal dan slot dikembalikan."""
+        with self._lock:
+            orphaned = list(self._pending.values())
+            self._pending.clear()
+            self._early_acks.clear()
+            for batch in orphaned:
+                batch.failed += 1
+        for batch in orphaned:
+            self._slots.release()
+        for batch in set(orphaned):
+            self._maybe_complete(batch)
+
+    def _maybe_complete(self, batch):
+        with self._lock:
+            if not batch.closed or batch._done.is_set() or batch.acked + batch.failed < batch.submitted:
+                return
+            batch.finished_at = time.monotonic()
+            batch._done.set()
+        if batch.on_complete:
+            batch.on_complete(batch)
@@ -0,0 +1,179 @@
+# bmkg_http.py
+# Klien HTTP bersama untuk semua pemanggilan BMKG API: satu requests.Session
+# dengan connection pool keep-alive, gzip, retry ber-backoff eksponensial (dengan
+# jitter, menghormati Retry-After, lewat rate limiter bersama) dan statistik per host.
+import os
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from bmkg_metrics import record_fetch
+from bmkg_ratelimit import bmkg_rate_limiter
+
+HTTP_POOL_MAXSIZE = int(os.getenv("HTTP_POOL_MAXSIZE", 20))
+HTTP_MAX_RETRIES = int(os.getenv("HTTP_MAX_RETRIES", 3))
+HTTP_BACKOFF_FACTOR = float(os.getenv("HTTP_BACKOFF_FACTOR", 0.5))
+HTTP_BACKOFF_MAX = float(os.getenv("HTTP_BACKOFF_MAX", 30))
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+USER_AGENT = "INSIS-MQTT-BMKG-Publisher/1.0"
+
+
+def compute_backoff(attempt, retry_after=None):
+    """Jeda sebelum retry ke-`attempt` (mulai dari 1).
+
+    Retry-After dari server selalu didahulukan; selain itu backoff eksponensial
+    dengan "equal jitter" supaya banyak publisher tidak retry serempak.
+    """
+    if retry_after is not None:
+        return min(HTTP_BACKOFF_MAX, retry_after)
+    delay = min(HTTP_BACKOFF_MAX, HTTP_BACKOFF_FACTOR * (2 ** (attempt - 1)))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+def parse_retry_after(value):
+    """Retry-After bisa berupa jumlah detik atau HTTP-date; None jika tidak valid."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class _HostStats:
+    __slots__ = ("requests", "errors", "retries", "total_latency", "last_status")
+
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.retries = 0
+        self.total_latency = 0.0
+        self.last_status = None
+
+
+_stats_lock = threading.Lock()
+_host_stats = {}
+
+
+def _record(host, latency, status=None, retries=0, error=False):
+    with _stats_lock:
+        stats = _host_stats.setdefault(host, _HostStats())
+        stats.requests += 1
+        stats.retries += retries
+        stats.total_latency += latency
+        if error or (status is not None and status >= 400):
+            stats.errors += 1
+        stats.last_status = status if status is not None else "exception"
+
+
+def build_session():
+    # Retry tidak diserahkan ke urllib3: get() yang mengulang, supaya setiap percobaan
+    # lewat rate limiter dan tidak melewati deadline request
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=HTTP_POOL_MAXSIZE, max_retries=0)
+    new_session = requests.Session()
+    new_session.mount("https://", adapter)
+    new_session.mount("http://", adapter)
+    new_session.headers.update({"Accept-Encoding": "gzip, deflate", "User-Agent": USER_AGENT})
+    return new_session
+
+
+session = build_session()
+
+
+def _wait_for_retry(attempt, retry_after, deadline, limiter):
+    """Tunggu backoff dan ambil token rate limit untuk percobaan berikutnya.
+
+    Return False (tanpa menunggu) jika percobaan berikutnya tidak akan sempat
+    dimulai sebelum `deadline`.
+    """
+    delay = compute_backoff(attempt, retry_after)
+    retry_at = time.monotonic() + delay
+    if deadline is not None and retry_at >= deadline:
+        return False
+    if limiter is not None:
+        token_timeout = None if deadline is None else deadline - time.monotonic()
+        if not limiter.acquire(timeout=token_timeout):
+            return False
+    remaining_delay = retry_at - time.monotonic()
+    if remaining_delay > 0:
+        time.sleep(remaining_delay)
+    return True
+
+
+def get(url, deadline=None, limiter=bmkg_rate_limiter, **kwargs):
+    """Pengganti requests.get yang memakai session bersama dan mencatat statistik.
+
+    Status RETRY_STATUS_CODES, error koneksi dan timeout diulang sampai
+    HTTP_MAX_RETRIES kali. Token untuk percobaan pertama diambil pemanggil
+    (mis. run_fetch_cycle); setiap percobaan ulang mengambil token dari `limiter`.
+    `deadline` (time.monotonic()) membatasi total waktu termasuk backoff: timeout
+    tiap percobaan dipotong ke sisa waktu dan retry yang tidak sempat dibatalkan.
+    """
+    parts = urlsplit(url)
+    started = time.monotonic()
+    for attempt in range(1, HTTP_MAX_RETRIES + 2):
+        response = error = retry_after = None
+        attempt_kwargs = kwargs
+        if deadline is not None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                error = requests.exceptions.Timeout(f"Deadline request terlewati sebelum percobaan ke-{attempt}")
+                break
+            timeout = kwargs.get("timeout")
+            attempt_kwargs = dict(kwargs, timeout=remaining if timeout is None else min(timeout, remaining))
+        try:
+            response = session.get(url, **attempt_kwargs)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            error = e
+        except requests.exceptions.RequestException as e:
+            error = e
+            break
+        if response is not None:
+            if response.status_code not in RETRY_STATUS_CODES:
+                break
+            retry_after = parse_retry_after(response.headers.get("Retry-After"))
+        if attempt > HTTP_MAX_RETRIES or not _wait_for_retry(attempt, retry_after, deadline, limiter):
+            break
+    latency = time.monotonic() - started
+    if response is None:
+        _record(parts.netloc, latency, retries=attempt - 1, error=True)
+        record_fetch("error", latency)
+        raise error
+    # Setelah retry habis, status error ditangani raise_for_status() pemanggil
+    _record(parts.netloc, latency, response.status_code, attempt - 1)
+    record_fetch(response.status_code, latency)
+    return response
+
+
+def pool_stats():
+    """Statistik per host: jumlah request, error, retry, latensi rata-rata dan koneksi pool."""
+    result = {}
+    with _stats_lock:
+        for host, stats in _host_stats.items():
+            result[host] = {
+                "requests": stats.requests,
+                "errors": stats.errors,
+                "retries": stats.retries,
+                "avg_latency_ms": round(stats.total_latency / stats.requests * 1000, 1) if stats.requests else None,
+                "last_status": stats.last_status,
+            }
+    adapter = session.get_adapter("https://")
+    for pool_key in list(adapter.poolmanager.pools.keys()):
+        pool = adapter.poolmanager.pools.get(pool_key)
+        if pool is None:
+            continue
+        host = pool.host if pool.port in (None, 80, 443) else f"{pool.host}:{pool.port}"
+        entry = result.setdefault(host, {})
+        entry["connections_opened"] = pool.num_connections
+        entry["pool_requests"] = pool.num_requests
+        entry["idle_connections"] = sum(1 for conn in pool.pool.queue if conn is not None) if pool.pool is not None else 0
+    return result
@@ -0,0 +1,129 @@
+# bmkg_logging.py
+# Logging terstruktur untuk publisher, responder dan dashboard, pengganti print():
+# level diatur lewat LOG_LEVEL (pesan di bawah level tidak diformat sama sekali),
+# argumen diformat lazy gaya %, event berfrekuensi tinggi bisa di-sampling, dan
+# penulisan ke stderr dilakukan thread terpisah lewat QueueHandler (thread network
+# paho / worker tidak pernah menunggu I/O konsol). LOG_FORMAT=json untuk satu objek
+# JSON per baris (field `extra` ikut ditulis), cocok untuk log collector.
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+import time
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text").lower()  # text | json
+# Event yang di-sampling (extra=SAMPLED) ditulis paling banyak sekali per interval ini per template pesan
+LOG_SAMPLE_SECONDS = float(os.getenv("LOG_SAMPLE_SECONDS", 10))
+# Record yang tidak muat di antrian dibuang (dihitung), bukan memblokir pemanggil
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", 10000))
+
+TEXT_FORMAT = "%(asctime)s %(levelname)-7s %(name)s: %(message)s"
+# Penanda untuk log.info(..., extra=SAMPLED)
+SAMPLED = {"sampled": True}
+
+# Atribut bawaan LogRecord; atribut lain berasal dari `extra` dan ikut ditulis JsonFormatter
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "taskName"}
+
+_listener = None
+_setup_lock = threading.Lock()
+
+
+class LazyJson:
+    """Bungkus objek agar json.dumps hanya dijalankan jika record benar-benar ditulis.
+
+    log.debug("Payload: %s", LazyJson(data)) tidak berbiaya apa-apa saat DEBUG nonaktif.
+    """
+
+    __slots__ = ("obj",)
+
+    def __init__(self, obj):
+        self.obj = obj
+
+    def __str__(self):
+        return json.dumps(self.obj, ensure_ascii=False, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """Loloskan record ber-`sampled` paling banyak sekali per `interval` per (logger, template pesan).
+
+    Record yang lolos membawa jumlah record yang dibuang sejak record terakhir.
+    """
+
+    def __init__(self, interval=LOG_SAMPLE_SECONDS):
+        super().__init__()
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._windows = {}  # (logger, msg) -> [waktu record terakhir ditulis, jumlah yang dibuang]
+
+    def filter(self, record):
+        if not getattr(record, "sampled", False) or self.interval <= 0:
+            return True
+        key = (record.name, record.msg)
+        now = time.monotonic()
+        with self._lock:
+            window = self._windows.get(key)
+            if window is not None and now - window[0] < self.interval:
+                window[1] += 1
+                return False
+            suppressed = window[1] if window is not None else 0
+            self._windows[key] = [now, 0]
+        if suppressed:
+            record.msg = f"{record.msg} (+{suppressed} similar in the last {self.interval:g}s)"
+        return True
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler yang membuang record saat antrian penuh alih-alih memblokir atau mencetak traceback."""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": self.formatTime(record, "%Y-%m-%dT%H:%M:%S") + f".{int(record.msecs):03d}",
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES and key != "sampled":
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def setup_logging(level=LOG_LEVEL, log_format=LOG_FORMAT):
+    """Pasang QueueHandler di root logger dan jalankan listener yang menulis ke stderr.
+
+    Aman dipanggil berkali-kali (mis. setiap rerun Streamlit); hanya panggilan pertama yang berpengaruh.
+    """
+    global _listener
+    with _setup_lock:
+        if _listener is not None:
+            return
+        stream_handler = logging.StreamHandler(sys.stderr)
+        stream_handler.setFormatter(JsonFormatter() if log_format == "json" else logging.Formatter(TEXT_FORMAT))
+        log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+        queue_handler = NonBlockingQueueHandler(log_queue)
+        queue_handler.addFilter(SamplingFilter())
+        root = logging.getLogger()
+        root.addHandler(queue_handler)
+        root.setLevel(level)
+        _listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+        _listener.start()
+        atexit.register(_listener.stop)  # Record yang masih antre tetap ditulis saat proses keluar
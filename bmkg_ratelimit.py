@@ -0,0 +1,133 @@
+# bmkg_ratelimit.py
+# Scheduler fetch paralel yang menghormati rate limit BMKG (60 request/menit).
+import asyncio
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+log = logging.getLogger(__name__)
+
+BMKG_RATE_LIMIT_PER_MINUTE = float(os.getenv("BMKG_RATE_LIMIT_PER_MINUTE", 60))
+BMKG_RATE_BURST = int(os.getenv("BMKG_RATE_BURST", 1))
+FETCH_MAX_WORKERS = int(os.getenv("FETCH_MAX_WORKERS", 8))
+# Porsi interval yang dipakai untuk menyebar refresh (0 = semua langsung, 1 = seluruh interval)
+FETCH_SPREAD_RATIO = float(os.getenv("FETCH_SPREAD_RATIO", 0.8))
+
+
+class TokenBucket:
+    """Token bucket thread-safe: `rate_per_minute` token diisi ulang secara merata."""
+
+    def __init__(self, rate_per_minute=BMKG_RATE_LIMIT_PER_MINUTE, burst=BMKG_RATE_BURST):
+        self.rate_per_second = rate_per_minute / 60.0
+        self.capacity = max(1, burst)
+        self._tokens = float(self.capacity)
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill_locked(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate_per_second)
+        self._updated_at = now
+
+    def _take_locked(self):
+        """Ambil satu token jika ada (return 0), selain itu return detik tunggu ke token berikutnya."""
+        self._refill_locked()
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return 0
+        return (1 - self._tokens) / self.rate_per_second
+
+    def acquire(self, timeout=None):
+        """Blokir sampai satu token tersedia, lalu ambil token tersebut (return True).
+
+        Jika `timeout` diberikan dan token berikutnya baru tersedia setelahnya,
+        return False tanpa mengambil token.
+        """
+        give_up_at = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                wait_seconds = self._take_locked()
+            if not wait_seconds:
+                return True
+            if give_up_at is not None and time.monotonic() + wait_seconds > give_up_at:
+                return False
+            time.sleep(wait_seconds)
+
+
+class AsyncTokenBucket(TokenBucket):
+    """Token bucket untuk event loop asyncio (bmkg_async_publisher.py).
+
+    Menunggu token dengan `await asyncio.sleep` sehingga event loop tidak
+    terblokir; peminta dilayani bergiliran (FIFO) lewat asyncio.Lock.
+    """
+
+    def __init__(self, rate_per_minute=BMKG_RATE_LIMIT_PER_MINUTE, burst=BMKG_RATE_BURST):
+        super().__init__(rate_per_minute, burst)
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                wait_seconds = self._take_locked()
+                if not wait_seconds:
+                    return
+                await asyncio.sleep(wait_seconds)
+
+
+# Satu bucket per proses: fetch reguler dan refresh manual berbagi kuota yang sama
+bmkg_rate_limiter = TokenBucket()
+
+
+def run_fetch_cycle(codes, fetch_fn, interval_seconds=0, spread=False,
+                    limiter=bmkg_rate_limiter, max_workers=FETCH_MAX_WORKERS, stop_event=None):
+    """Jalankan fetch_fn(code) untuk semua kode secara paralel dalam batas rate limit.
+
+    Jika `spread` aktif, waktu mulai tiap kode disebar merata sepanjang
+    FETCH_SPREAD_RATIO * interval_seconds supaya refresh tidak menumpuk di awal jam.
+    fetch_fn mengembalikan nilai truthy jika kode berhasil diproses.
+    Jika `stop_event` di-set (mis. saat shutdown), kode yang belum dimulai
+    dilewati dan hanya fetch yang sedang berjalan yang ditunggu.
+    Mengembalikan ringkasan siklus: jumlah sukses/gagal/dilewati dan durasi.
+    """
+    started_at = time.monotonic()
+    step_seconds = 0.0
+    if spread and codes:
+        step_seconds = interval_seconds * FETCH_SPREAD_RATIO / len(codes)
+
+    # Token diambil tepat sebelum worker mulai, jadi antrian executor tidak bisa
+    # melepaskan burst request ke BMKG saat beberapa worker selesai bersamaan
+    worker_slots = threading.Semaphore(max_workers)
+
+    def run_one(code):
+        try:
+            return bool(fetch_fn(code))
+        except Exception as e:
+            log.exception("Unexpected error for %s: %s", code, e)
+            return False
+        finally:
+            worker_slots.release()
+
+    futures = []
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="bmkg-fetch") as executor:
+        for index, code in enumerate(codes):
+            delay = started_at + index * step_seconds - time.monotonic()
+            if stop_event is not None:
+                if stop_event.wait(max(delay, 0)):
+                    break
+            elif delay > 0:
+                time.sleep(delay)
+            worker_slots.acquire()
+            limiter.acquire()
+            futures.append(executor.submit(run_one, code))
+        succeeded = sum(1 for future in futures if future.result())
+
+    return {
+        "codes": len(codes),
+        "succeeded": succeeded,
+        "failed": len(futures) - succeeded,
+        "skipped": len(codes) - len(futures),
+        "duration_seconds": round(time.monotonic() - started_at, 2),
+        "completed_at": time.strftime('%Y-%m-%d %H:%M:%S'),
+    }
@@ -0,0 +1,163 @@
+# bmkg_sharding.py
+# Pembagian kerja antar beberapa proses/node publisher:
+# - Responder: subscription MQTT 5 "$share/<group>/<topik>" sehingga broker membagi
+#   request ke N proses (RESPONDER_SHARE_GROUP).
+# - Publisher periodik: consistent hashing kode ADM4 ke node yang hidup, supaya setiap
+#   wilayah di-fetch tepat oleh satu node (SHARD_GROUP). Keanggotaan dilacak lewat
+#   retained message presence + Last Will, jadi wilayah otomatis dibagi ulang saat
+#   node bergabung atau mati.
+import bisect
+import hashlib
+import json
+import logging
+import os
+import socket
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+RESPONDER_SHARE_GROUP = os.getenv("RESPONDER_SHARE_GROUP", "")
+SHARD_GROUP = os.getenv("SHARD_GROUP", "")
+SHARD_NODE_ID = os.getenv("SHARD_NODE_ID") or f"{socket.gethostname()}-{os.getpid()}"
+SHARD_VNODES = int(os.getenv("SHARD_VNODES", 64))
+SHARD_PRESENCE_TOPIC_BASE = os.getenv("SHARD_PRESENCE_TOPIC_BASE", "bmkg/nodes")
+# Lama menunggu presence node lain (retained) sebelum siklus fetch pertama
+SHARD_SETTLE_SECONDS = float(os.getenv("SHARD_SETTLE_SECONDS", 5))
+
+
+def shared_topic(topic, group=RESPONDER_SHARE_GROUP):
+    """Filter subscription shared jika group diset, selain itu topik apa adanya."""
+    return f"$share/{group}/{topic}" if group else topic
+
+
+def _hash(value):
+    return int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """Consistent hash ring dengan virtual node; pindah node hanya memindahkan ~1/N kunci."""
+
+    def __init__(self, nodes=(), vnodes=SHARD_VNODES):
+        self.vnodes = vnodes
+        self.nodes = frozenset(nodes)
+        points = sorted((_hash(f"{node}#{i}"), node) for node in self.nodes for i in range(vnodes))
+        self._hashes = [point for point, _ in points]
+        self._owners = [node for _, node in points]
+
+    def owner(self, key):
+        if not self._hashes:
+            return None
+        index = bisect.bisect(self._hashes, _hash(key)) % len(self._hashes)
+        return self._owners[index]
+
+
+class ShardMembership:
+    """Keanggotaan node dalam satu SHARD_GROUP dan kepemilikan kode ADM4.
+
+    Tanpa SHARD_GROUP semua kode dimiliki node ini (perilaku lama).
+    `on_change(gained, lost)` dipanggil dari thread network paho ketika
+    pembagian `keys` berubah karena node bergabung/keluar.
+    """
+
+    def __init__(self, keys=(), group=SHARD_GROUP, node_id=SHARD_NODE_ID, on_change=None):
+        self.group = group
+        self.node_id = node_id
+        self.keys = list(keys)
+        self.on_change = on_change
+        self._lock = threading.Lock()
+        self._ring = HashRing([node_id])
+        self._owned = set(self.keys)
+        self._settled = threading.Event()
+        self.rebalances = 0
+
+    @property
+    def enabled(self):
+        return bool(self.group)
+
+    @property
+    def presence_filter(self):
+        return f"{SHARD_PRESENCE_TOPIC_BASE}/{self.group}/+"
+
+    @property
+    def presence_topic(self):
+        return f"{SHARD_PRESENCE_TOPIC_BASE}/{self.group}/{self.node_id}"
+
+    def attach(self, client):
+        """Pasang Last Will (hapus presence retained) dan handler presence; panggil sebelum connect."""
+        if not self.enabled:
+            return
+        client.will_set(self.presence_topic, payload=None, qos=1, retain=True)
+        client.message_callback_add(self.presence_filter, self._on_presence)
+
+    def announce(self, client):
+        """Umumkan node ini dan ikuti presence node lain; panggil dari on_connect."""
+        if not self.enabled:
+            return
+        presence = json.dumps({"node_id": self.node_id, "since": time.strftime('%Y-%m-%d %H:%M:%S')})
+        # Subscribe dulu: presence retained node lain terkirim sebelum gema presence node ini
+        client.subscribe(self.presence_filter, qos=1)
+        client.publish(self.presence_topic, presence, qos=1, retain=True)
+
+    def wait_settled(self, timeout=SHARD_SETTLE_SECONDS):
+        """Tunggu sampai daftar node awal diketahui agar siklus pertama tidak mengambil semua wilayah."""
+        if not self.enabled:
+            return True
+        return self._settled.wait(timeout)
+
+    def leave(self, client):
+        """Keluar dengan rapi: hapus presence retained supaya wilayah langsung dibagi ulang."""
+        if self.enabled and client.is_connected():
+            client.publish(self.presence_topic, payload=None, qos=1, retain=True).wait_for_publish(timeout=5)
+
+    def owns(self, key):
+        if not self.enabled:
+            return True
+        with self._lock:
+            return self._ring.owner(key) == self.node_id
+
+    def is_coordinator(self):
+        """True jika node ini yang menjawab request tanpa pemilik wilayah (status, kode tak dikenal).
+
+        Satu node dipilih lewat ring yang sama sehingga semua node sepakat tanpa koordinasi tambahan.
+        """
+        if not self.enabled:
+            return True
+        with self._lock:
+            return self._ring.owner(f"{self.group}/coordinator") == self.node_id
+
+    def owned(self, keys=None):
+        """Kode milik node ini, urutan dipertahankan."""
+        return [key for key in (self.keys if keys is None else keys) if self.owns(key)]
+
+    def _on_presence(self, client, userdata, msg):
+        node_id = msg.topic.rsplit("/", 1)[-1]
+        if node_id == self.node_id and msg.payload:
+            self._settled.set()
+        with self._lock:
+            nodes = set(self._ring.nodes)
+            if msg.payload:
+                nodes.add(node_id)
+            elif node_id != self.node_id:
+                nodes.discard(node_id)
+            if nodes == self._ring.nodes:
+                return
+            self._ring = HashRing(nodes)
+            owned = {key for key in self.keys if self._ring.owner(key) == self.node_id}
+            gained, lost = owned - self._owned, self._owned - owned
+            self._owned = owned
+            self.rebalances += 1
+        log.info("Node %s: %s. %s node aktif, node ini memegang %s/%s wilayah (+%s -%s).", 'joined' if msg.payload else 'left', node_id, len(nodes), len(owned), len(self.keys), len(gained), len(lost))
+        if self.on_change and (gained or lost):
+            self.on_change(sorted(gained), sorted(lost))
+
+    def status(self):
+        with self._lock:
+            return {
+                "group": self.group or None,
+                "node_id": self.node_id,
+                "nodes": sorted(self._ring.nodes),
+                "owned": len(self._owned),
+                "total": len(self.keys),
+                "rebalances": self.rebalances,
+            }
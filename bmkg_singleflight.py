@@ -0,0 +1,59 @@
+# bmkg_singleflight.py
+# Request coalescing: beberapa request bersamaan untuk kode ADM4 yang sama
+# menunggu satu panggilan upstream yang sedang berjalan dan berbagi hasilnya.
+import threading
+
+
+class _Call:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.coalesced = 0
+
+    def do(self, key, fn, *args, wait_timeout=None, **kwargs):
+        """Jalankan fn(*args, **kwargs) sekali per `key` yang sedang in-flight.
+
+        Pemanggil pertama (leader) benar-benar mengeksekusi fn; pemanggil lain
+        dengan key yang sama menunggu lalu menerima hasil (atau exception) yang sama.
+        Jika `wait_timeout` terlewati sebelum leader selesai, pemanggil yang
+        menunggu mendapat TimeoutError.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            if not call.done.wait(wait_timeout):
+                raise TimeoutError(f"Menunggu fetch in-flight untuk {key} melewati batas waktu")
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn(*args, **kwargs)
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._calls)
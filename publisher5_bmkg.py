@@ -6,62 +6,132 @@ import paho.mqtt.client as mqtt
 import paho.mqtt.properties as mqtt_props
 from paho.mqtt.packettypes import PacketTypes
 import sys
+import os
+import logging
+from bmkg_logging import setup_logging, LazyJson, SAMPLED
+from bmkg_cache import ForecastCache
+from bmkg_singleflight import SingleFlight
+from bmkg_dispatch import RequestDispatcher
+import bmkg_http
+from bmkg_ratelimit import bmkg_rate_limiter
+import bmkg_codec
+import bmkg_metrics
+from bmkg_forecast import normalize_bmkg_response
+from bmkg_sharding import RESPONDER_SHARE_GROUP, shared_topic
+from bmkg_store import open_store
 
-BMKG_API_URL = "https://api.bmkg.go.id/publik/prakiraan-cuaca"
+log = logging.getLogger("bmkg.responder")
 
-MQTT_BROKER_HOST = "localhost"
-MQTT_BROKER_PORT = 1883
+BMKG_API_URL = os.getenv("BMKG_API_URL", "https://api.bmkg.go.id/publik/prakiraan-cuaca") # bench/ mengarahkan ke server BMKG palsu
+
+MQTT_BROKER_HOST = os.getenv("MQTT_BROKER_HOST", "localhost")
+MQTT_BROKER_PORT = int(os.getenv("MQTT_BROKER_PORT", 1883))
 MQTT_CLIENT_ID = "bmkg_responder_py_003" # Ganti client ID jika perlu
 
 MQTT_REQUEST_TOPIC = "bmkg/weather/request"
+# Dengan RESPONDER_SHARE_GROUP, beberapa proses responder berlangganan $share/<group>/bmkg/weather/request
+# dan broker membagi request di antara mereka; client ID tiap proses diberi akhiran PID agar tidak bentrok
+if RESPONDER_SHARE_GROUP:
+    MQTT_CLIENT_ID = f"{MQTT_CLIENT_ID}-{os.getpid()}"
 
 DEFAULT_RESPONSE_QOS = 1
+BMKG_REQUEST_TIMEOUT_SECONDS = 20
+
+# Mode dispatch responder: "pool" (fetch di worker thread) atau "inline" (langsung di thread network paho)
+RESPONDER_DISPATCH_MODE = os.getenv("RESPONDER_DISPATCH_MODE", "pool").lower()
+RESPONDER_WORKERS = int(os.getenv("RESPONDER_WORKERS", 8))
+RESPONDER_QUEUE_SIZE = int(os.getenv("RESPONDER_QUEUE_SIZE", 64))
+RESPONDER_REQUEST_DEADLINE_SECONDS = float(os.getenv("RESPONDER_REQUEST_DEADLINE_SECONDS", 30))
 
 # Identifier Integer untuk Properti MQTT 5.0
 MQTT_PROP_CORRELATION_DATA_ID = 9
 
-def fetch_bmkg_data(api_url, adm4):
+# Cache prakiraan per ADM4 (TTL & ukuran diatur lewat BMKG_CACHE_TTL_SECONDS / BMKG_CACHE_MAX_ENTRIES)
+forecast_cache = ForecastCache()
+# Request bersamaan untuk ADM4 yang sama hanya memicu satu fetch ke BMKG
+bmkg_fetch_flight = SingleFlight()
+# Salinan di disk (FORECAST_STORE_PATH): cache diisi ulang saat start, dan jadi cadangan saat BMKG gagal
+forecast_store = open_store()
+
+request_dispatcher = None
+if RESPONDER_DISPATCH_MODE == "pool":
+    request_dispatcher = RequestDispatcher(RESPONDER_WORKERS, RESPONDER_QUEUE_SIZE, RESPONDER_REQUEST_DEADLINE_SECONDS)
+    bmkg_metrics.QUEUE_DEPTH.set_function(request_dispatcher.queue_depth, queue="responder")
+
+def fetch_bmkg_data(api_url, adm4, timeout=BMKG_REQUEST_TIMEOUT_SECONDS, deadline=None):
+    cached_entry = forecast_cache.lookup(adm4)
+    if cached_entry and cached_entry.is_fresh():
+        log.debug("Cache hit untuk ADM4 %s, BMKG API tidak dipanggil.", adm4)
+        return cached_entry.data
+    # Token percobaan pertama diambil di sini (bmkg_http.get hanya mengambil token untuk retry), jadi cache
+    # miss beruntun untuk banyak ADM4 tetap dalam kuota BMKG. Jika token baru ada setelah deadline, jawab
+    # dengan data lama bila ada.
+    token_timeout = timeout if deadline is None else max(0.0, min(timeout, deadline - time.monotonic()))
+    if not bmkg_rate_limiter.acquire(timeout=token_timeout):
+        log.warning("Kuota request BMKG habis untuk ADM4 %s sebelum deadline.", adm4)
+        stored = cached_entry or (forecast_store.latest(adm4) if forecast_store else None)
+        if stored:
+            return stored.data
+        return {"error": True, "message": "Responder sibuk (batas request BMKG), coba lagi nanti"}
+
     full_url = f"{api_url}?adm4={adm4}"
+    response = None
     try:
-        print(f"\n[{time.strftime('%Y-%m-%d %H:%M:%S')}] Responder: Meminta data dari BMKG API untuk ADM4 {adm4}: {full_url}")
-        response = requests.get(full_url, timeout=20)
+        log.debug("Meminta data dari BMKG API untuk ADM4 %s: %s", adm4, full_url)
+        request_headers = cached_entry.validators() if cached_entry else {}
+        response = bmkg_http.get(full_url, headers=request_headers, timeout=timeout, deadline=deadline)
+        if response.status_code == 304 and cached_entry:
+            log.debug("BMKG API menjawab 304 Not Modified, memakai data dari cache.")
+            if forecast_store:
+                forecast_store.touch(adm4, response.headers)
+            return forecast_cache.revalidated(adm4, cached_entry, response.headers).data
         response.raise_for_status()
-        print(f"Responder: Status Respons BMKG API: {response.status_code}")
-        return response.json()
+        log.debug("Status Respons BMKG API: %s", response.status_code)
+        # Normalisasi sekali per fetch; cache dan semua respons memakai record ringkas ini
+        weather_data = normalize_bmkg_response(response.json())
+        forecast_cache.store(adm4, weather_data, response.headers)
+        if forecast_store:
+            forecast_store.save(adm4, weather_data, response.headers)
+        return weather_data
     except requests.exceptions.Timeout:
-        print(f"Error: Timeout saat menghubungi BMKG API {full_url}")
+        log.warning("Timeout saat menghubungi BMKG API %s", full_url)
         return {"error": True, "message": "Timeout saat menghubungi BMKG API"}
     except requests.exceptions.HTTPError as http_err:
-        print(f"Error HTTP saat menghubungi BMKG API: {http_err} - Respons: {response.text if response else 'Tidak ada respons'}")
+        log.error("Error HTTP saat menghubungi BMKG API: %s - Respons: %s", http_err, response.text if response else 'Tidak ada respons')
         return {"error": True, "message": f"Error HTTP dari BMKG: {http_err.response.status_code if http_err.response else 'N/A'}"}
     except requests.exceptions.RequestException as e:
-        print(f"Error mengambil data dari BMKG: {e}")
+        log.error("Error mengambil data dari BMKG: %s", e)
         return {"error": True, "message": f"Error umum saat mengambil data BMKG: {e}"}
     except json.JSONDecodeError:
-        print(f"Error decoding JSON dari BMKG. Teks Respons: {response.text if response else 'Tidak ada respons'}")
+        log.error("Error decoding JSON dari BMKG. Teks Respons: %s", response.text if response else 'Tidak ada respons')
         return {"error": True, "message": "Error decoding JSON dari BMKG"}
 
 def on_connect(client, userdata, flags, rc, properties=None):
     if rc == 0:
-        print(f"Responder: Terhubung ke MQTT Broker ({MQTT_BROKER_HOST}:{MQTT_BROKER_PORT}) dengan sukses (MQTTv5).")
-        client.subscribe(MQTT_REQUEST_TOPIC, qos=1)
-        print(f"Responder: Berlangganan ke topik request: {MQTT_REQUEST_TOPIC}")
+        log.info("Terhubung ke MQTT Broker (%s:%s) dengan sukses (MQTTv5).", MQTT_BROKER_HOST, MQTT_BROKER_PORT)
+        bmkg_metrics.record_connect()
+        request_subscription = shared_topic(MQTT_REQUEST_TOPIC)
+        client.subscribe(request_subscription, qos=1)
+        log.info("Berlangganan ke topik request: %s", request_subscription)
     else:
-        print(f"Responder: Gagal terhubung ke MQTT Broker, return code {rc}")
+        log.error("Gagal terhubung ke MQTT Broker, return code %s", rc)
 
 def on_disconnect(client, userdata, rc, properties=None):
-    print(f"Responder: Terputus dari MQTT Broker dengan kode: {rc}.")
+    log.warning("Terputus dari MQTT Broker dengan kode: %s.", rc)
+    bmkg_metrics.record_disconnect()
 
 def on_message(client, userdata, msg):
     try:
-        print(f"\n[{time.strftime('%Y-%m-%d %H:%M:%S')}] Responder: Menerima request pada topik: {msg.topic}")
+        log.debug("Menerima request pada topik: %s", msg.topic)
         
         request_payload_str = msg.payload.decode()
-        print(f"Responder: Payload Request: {request_payload_str}")
+        log.debug("Payload Request: %s", request_payload_str)
         request_data = json.loads(request_payload_str)
         
         adm4_code = request_data.get("adm4_code")
         client_requested_qos = request_data.get("response_qos", DEFAULT_RESPONSE_QOS)
+        # Klien boleh meminta codec respons lewat field/User Property "accept"; default tetap JSON
+        response_codec = bmkg_codec.requested_codec(getattr(msg, 'properties', None), request_data)
         
         # Inisialisasi variabel
         response_topic_from_payload = None
@@ -70,171 +140,197 @@ def on_message(client, userdata, msg):
         # Check response_topic dalam payload
         response_topic_from_payload = request_data.get("response_topic_in_payload")
         if response_topic_from_payload:
-            print(f"Responder: Response Topic dari PAYLOAD: {response_topic_from_payload}")
+            log.debug("Response Topic dari PAYLOAD: %s", response_topic_from_payload)
         else:
-            print("Responder: response_topic_in_payload TIDAK DITEMUKAN di payload JSON")
+            log.debug("response_topic_in_payload TIDAK DITEMUKAN di payload JSON")
             # Cek properti MQTTv5
             if hasattr(msg, 'properties') and msg.properties:
-                print(f"Responder: Properti MQTTv5 ditemukan pada pesan. Tipe: {type(msg.properties)}")
+                log.debug("Properti MQTTv5 ditemukan pada pesan. Tipe: %s", type(msg.properties))
                 
                 # Cek ResponseTopic dari properti
                 if hasattr(msg.properties, 'ResponseTopic'):
                     response_topic_from_payload = msg.properties.ResponseTopic
-                    print(f"Responder: Response Topic dari PROPERTI: {response_topic_from_payload}")
+                    log.debug("Response Topic dari PROPERTI: %s", response_topic_from_payload)
                 else:
-                    print("Responder: Objek Properties ADA, TAPI TIDAK memiliki atribut 'ResponseTopic'.")
+                    log.warning("Objek Properties ADA, TAPI TIDAK memiliki atribut 'ResponseTopic'.")
                     return
                 
                 # Cek CorrelationData dari properti (tambahkan ini)
                 if hasattr(msg.properties, 'CorrelationData'):
                     correlation_data_value = msg.properties.CorrelationData
-                    print(f"Responder: CorrelationData ditemukan dalam properti pesan.")
+                    log.debug("CorrelationData ditemukan dalam properti pesan.")
                 else:
-                    print("Responder: Objek Properties ADA, TAPI TIDAK memiliki atribut 'CorrelationData'.")
+                    log.debug("Objek Properties ADA, TAPI TIDAK memiliki atribut 'CorrelationData'.")
             else:
-                print("Responder: Tidak ada properti MQTT 5.0 yang ditemukan dalam pesan.")
+                log.warning("Tidak ada properti MQTT 5.0 yang ditemukan dalam pesan.")
                 return
             
         # Jika tidak ada response topic valid
         if not response_topic_from_payload:
-            print("Responder: Peringatan - Tidak ada Response Topic yang valid ditemukan dalam permintaan. Tidak bisa merespons.")
+            log.warning("Tidak ada Response Topic yang valid ditemukan dalam permintaan. Tidak bisa merespons.")
             return
-            
-        weather_data = fetch_bmkg_data(BMKG_API_URL, adm4_code)
+
+        bmkg_metrics.request_timer.start(correlation_data_value, "weather")
+        if request_dispatcher is None:
+            process_weather_request(client, adm4_code, response_topic_from_payload, correlation_data_value, client_requested_qos, response_codec)
+        elif not request_dispatcher.submit(
+            process_weather_request, client, adm4_code, response_topic_from_payload, correlation_data_value, client_requested_qos, response_codec,
+            on_expired=reply_request_expired,
+        ):
+            log.warning("Antrian worker penuh (%s request), request ADM4 %s ditolak.", request_dispatcher.queue_depth(), adm4_code)
+            publish_response(client, response_topic_from_payload, correlation_data_value, client_requested_qos, {
+                "adm4_code_requested": adm4_code,
+                "timestamp_response": time.strftime('%Y-%m-%d %H:%M:%S %Z'),
+                "status": "error",
+                "message": "Responder sedang sibuk, coba lagi nanti",
+            }, response_codec)
+
+    except json.JSONDecodeError as e:
+        log.error("Error decoding JSON dari payload request: %s - Error: %s", msg.payload.decode(), e)
+    except Exception as e:
+        log.exception("Error tak terduga saat memproses pesan: %s", e)
+
+def publish_response(client, response_topic, correlation_data_value, client_requested_qos, response_payload_content, codec=bmkg_codec.CODEC_JSON):
+    response_properties_obj = mqtt_props.Properties(PacketTypes.PUBLISH)
+    bmkg_codec.set_properties(response_properties_obj, codec)
+    if correlation_data_value:
+        response_properties_obj.CorrelationData = correlation_data_value
+        log.debug("Menambahkan CorrelationData ke properti respons.")
+    else:
+        log.debug("Tidak ada CorrelationData dari request untuk ditambahkan ke respons.")
+
+    response_payload_encoded = bmkg_codec.encode(response_payload_content, codec)
+    
+    log.debug("Mengirim respons ke (dari payload): %s dengan QoS %s (%s, %s B)", response_topic, client_requested_qos, codec, len(response_payload_encoded))
+    
+    publish_result = client.publish(
+        response_topic,
+        payload=response_payload_encoded,
+        qos=int(client_requested_qos),
+        properties=response_properties_obj
+    )
+    
+    bmkg_metrics.track_publish(publish_result, int(client_requested_qos), "response")
+    bmkg_metrics.request_timer.finish(correlation_data_value, "weather", response_payload_content.get("status", "success"))
+    if publish_result.rc == mqtt.MQTT_ERR_SUCCESS:
+        # Satu baris INFO per request di-sampling; detail per request ada di level DEBUG
+        log.info("Respons berhasil dikirim ke %s (MID: %s).", response_topic, publish_result.mid, extra=SAMPLED)
+        log.debug("Payload respons: %s", LazyJson(response_payload_content))
+    else:
+        log.error("Gagal mengirim respons, error code: %s", publish_result.rc)
+
+def process_weather_request(client, adm4_code, response_topic_from_payload, correlation_data_value, client_requested_qos,
+                            response_codec=bmkg_codec.CODEC_JSON, deadline=None):
+    try:
+        fetch_timeout = BMKG_REQUEST_TIMEOUT_SECONDS
+        wait_timeout = None
+        if deadline is not None:
+            wait_timeout = max(0.0, deadline - time.monotonic())
+            fetch_timeout = max(1.0, min(fetch_timeout, wait_timeout))
+        try:
+            weather_data = bmkg_fetch_flight.do(
+                adm4_code, fetch_bmkg_data, BMKG_API_URL, adm4_code, timeout=fetch_timeout, deadline=deadline,
+                wait_timeout=wait_timeout,
+            )
+        except TimeoutError:
+            weather_data = {"error": True, "message": "Deadline request terlewati saat menunggu data BMKG"}
         response_payload_content = {
             "adm4_code_requested": adm4_code,
             "timestamp_response": time.strftime('%Y-%m-%d %H:%M:%S %Z'),
         }
 
+        if (not weather_data or weather_data.get("error")) and forecast_store:
+            # BMKG lambat/gagal: jawab dengan prakiraan terakhir yang tersimpan, ditandai stale
+            stored = forecast_store.latest(adm4_code)
+            if stored:
+                log.warning("BMKG gagal (%s), memakai data tersimpan untuk ADM4 %s.", weather_data.get('message') if weather_data else 'tidak ada data', adm4_code)
+                weather_data = stored.data
+                response_payload_content["stale"] = True
+                response_payload_content["data_fetched_at"] = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(stored.fetched_at))
+
         if weather_data and not weather_data.get("error"):
             try:
-                # Tambahkan logging lengkap untuk seluruh struktur data
-                print(f"Responder: STRUKTUR LENGKAP weather_data: {json.dumps(weather_data, indent=2)}")
-                
-                # Cek struktur yang dibutuhkan frontend
-                print(f"Responder: Tipe weather_data: {type(weather_data)}")
-                if 'data' in weather_data:
-                    print(f"Responder: Tipe weather_data['data']: {type(weather_data['data'])}")
-                    if isinstance(weather_data['data'], list) and len(weather_data['data']) > 0:
-                        print(f"Responder: Keys dalam weather_data['data'][0]: {list(weather_data['data'][0].keys() if isinstance(weather_data['data'][0], dict) else [])}")
-                
-                # Ekstraksi data lokasi
-                location_info = {}
-                if isinstance(weather_data, dict) and 'lokasi' in weather_data:
-                    location_info = weather_data['lokasi']
-                    print(f"Responder: Data lokasi ditemukan: {location_info}")
-                else:
-                    print(f"Responder: WARNING - 'lokasi' tidak ditemukan dalam weather_data")
-                    
-                # Coba berbagai kemungkinan nama properti untuk data forecast
-                forecasts = []
-                potential_forecast_keys = ['cuaca', 'forecast', 'forecasts', 'prakiraan', 'weather', 'isi']
-                
-                for key in potential_forecast_keys:
-                    if isinstance(weather_data, dict) and key in weather_data and isinstance(weather_data[key], list):
-                        forecasts = weather_data[key]
-                        print(f"Responder: Menemukan data forecast dalam key '{key}', jumlah: {len(forecasts)}")
-                        break
-                
-                # Jika masih belum menemukan forecast, coba lihat apakah weather_data sendiri adalah array forecast
-                if not forecasts and isinstance(weather_data, list):
-                    if len(weather_data) > 0 and isinstance(weather_data[0], dict):
-                        # Jika item pertama memiliki properti tanggal/waktu, kemungkinan ini forecast
-                        sample = weather_data[0]
-                        time_indicators = ['timestamp', 'datetime', 'date', 'time', 'waktu', 'jam']
-                        if any(indicator in sample for indicator in time_indicators):
-                            forecasts = weather_data
-                            print(f"Responder: weather_data sendiri tampaknya array forecast, jumlah: {len(forecasts)}")
-                
-                # Jika masih belum menemukan, coba lihat secara rekursif dalam weather_data
-                if not forecasts and isinstance(weather_data, dict):
-                    for key, value in weather_data.items():
-                        if isinstance(value, list) and len(value) > 0 and isinstance(value[0], dict):
-                            # Ini kandidat kuat untuk data forecast
-                            forecasts = value
-                            print(f"Responder: Menemukan array dalam key '{key}' yang mungkin forecast, jumlah: {len(forecasts)}")
-                            break
-                
-                # Tambahkan ke respons
+                # weather_data sudah dinormalisasi saat fetch (bmkg_forecast), tidak perlu menebak struktur BMKG lagi
+                forecasts = weather_data["forecasts"]
                 response_payload_content["status"] = "success"
-                response_payload_content["data_bmkg"] = weather_data  # Data mentah
-                response_payload_content["bmkg_data_keys"] = list(weather_data.keys()) if isinstance(weather_data, dict) else []
-                response_payload_content["location"] = location_info
+                response_payload_content["location"] = weather_data["location"]
                 response_payload_content["forecasts"] = forecasts
                 
                 if forecasts:
-                    print(f"Responder: Berhasil mengekstrak {len(forecasts)} item prakiraan cuaca")
-                    if len(forecasts) > 0:
-                        print(f"Responder: Contoh item forecast pertama: {json.dumps(forecasts[0], indent=2)[:200]}...")
+                    log.debug("%s item prakiraan cuaca untuk %s", len(forecasts), weather_data['location'].get('desa', adm4_code))
                 else:
-                    print("Responder: GAGAL menemukan array forecast dalam data BMKG")
+                    log.warning("GAGAL menemukan array forecast dalam data BMKG")
             except Exception as e:
-                print(f"Responder: ERROR saat memformat data cuaca: {e}")
+                log.exception("ERROR saat memformat data cuaca: %s", e)
                 response_payload_content["status"] = "error"
                 response_payload_content["message"] = f"Error memformat data cuaca: {str(e)}"
-                import traceback
-                traceback.print_exc()
         else:
             error_message = weather_data.get("message", "Error tidak diketahui") if weather_data else "Tidak ada data"
-            print(f"Responder: Gagal mendapatkan data cuaca: {error_message}")
+            log.warning("Gagal mendapatkan data cuaca: %s", error_message)
             response_payload_content["status"] = "error"
             response_payload_content["message"] = error_message
             
-        response_properties_obj = mqtt_props.Properties(PacketTypes.PUBLISH)
-        if correlation_data_value:
-            response_properties_obj.CorrelationData = correlation_data_value
-            print(f"Responder: Menambahkan CorrelationData ke properti respons.")
-        else:
-            print("Responder: Tidak ada CorrelationData dari request untuk ditambahkan ke respons.")
+        publish_response(client, response_topic_from_payload, correlation_data_value, client_requested_qos, response_payload_content, response_codec)
+    except Exception as e:
+        log.exception("Error tak terduga saat memproses request ADM4 %s: %s", adm4_code, e)
 
-        response_payload_json = json.dumps(response_payload_content)
-        
-        print(f"Responder: Mengirim respons ke (dari payload): {response_topic_from_payload} dengan QoS {client_requested_qos}")
-        
-        publish_result = client.publish(
-            response_topic_from_payload,
-            payload=response_payload_json,
-            qos=int(client_requested_qos),
-            properties=response_properties_obj
-        )
-        
-        if publish_result.rc == mqtt.MQTT_ERR_SUCCESS:
-            print(f"Responder: Respons berhasil dikirim (MID: {publish_result.mid}).")
-        else:
-            print(f"Responder: Gagal mengirim respons, error code: {publish_result.rc}")
+def reply_request_expired(client, adm4_code, response_topic_from_payload, correlation_data_value, client_requested_qos,
+                          response_codec=bmkg_codec.CODEC_JSON):
+    log.warning("Request ADM4 %s melewati deadline di antrian, tidak diproses.", adm4_code)
+    publish_response(client, response_topic_from_payload, correlation_data_value, client_requested_qos, {
+        "adm4_code_requested": adm4_code,
+        "timestamp_response": time.strftime('%Y-%m-%d %H:%M:%S %Z'),
+        "status": "error",
+        "message": "Request kedaluwarsa sebelum sempat diproses",
+    }, response_codec)
 
-    except json.JSONDecodeError as e:
-        print(f"Responder: Error decoding JSON dari payload request: {msg.payload.decode()} - Error: {e}")
-    except Exception as e:
-        print(f"Responder: Error tak terduga saat memproses pesan: {e}")
-        import traceback
-        traceback.print_exc()
+def warm_start_cache():
+    # Setelah restart, cache diisi dari store; entri yang sudah kedaluwarsa tetap berguna untuk revalidasi ETag
+    if not forecast_store:
+        return
+    warmed = 0
+    for adm4, fetched_at in forecast_store.adm4_codes().items():
+        stored = forecast_store.latest(adm4)
+        if stored:
+            forecast_cache.warm(adm4, stored.data, stored.etag, stored.last_modified, time.time() - fetched_at)
+            warmed += 1
+    log.info("Cache diisi %s wilayah dari %s.", warmed, forecast_store.path)
 
 def main():
+    setup_logging()
+    warm_start_cache()
+    bmkg_metrics.start_http_server()
     mqtt_client = mqtt.Client(client_id=MQTT_CLIENT_ID, protocol=mqtt.MQTTv5)
     mqtt_client.on_connect = on_connect
     mqtt_client.on_disconnect = on_disconnect
     mqtt_client.on_message = on_message
+    mqtt_client.on_publish = bmkg_metrics.inflight_tracker.on_publish
 
-    print("Responder: Mencoba terhubung ke MQTT Broker...")
+    log.info("Mencoba terhubung ke MQTT Broker...")
     try:
         mqtt_client.connect(MQTT_BROKER_HOST, MQTT_BROKER_PORT, 60)
     except Exception as e:
-        print(f"Responder: Exception saat mencoba connect: {e}")
+        log.error("Exception saat mencoba connect: %s", e)
         sys.exit(1)
 
-    print("Responder: Memulai network loop (blocking). Tekan Ctrl+C untuk keluar.")
+    if request_dispatcher:
+        log.info("Mode dispatch 'pool' (%s worker, antrian %s, deadline %ss).", RESPONDER_WORKERS, RESPONDER_QUEUE_SIZE, RESPONDER_REQUEST_DEADLINE_SECONDS)
+    else:
+        log.info("Mode dispatch 'inline', request diproses di thread network paho.")
+    log.info("Memulai network loop (blocking). Tekan Ctrl+C untuk keluar.")
     try:
         mqtt_client.loop_forever()
     except KeyboardInterrupt:
-        print("\nResponder: KeyboardInterrupt diterima. Menghentikan script...")
+        log.info("KeyboardInterrupt diterima. Menghentikan script...")
     except Exception as e_main:
-        print(f"Responder: Terjadi error tak terduga di main loop: {e_main}")
+        log.error("Terjadi error tak terduga di main loop: %s", e_main)
     finally:
+        if request_dispatcher:
+            request_dispatcher.shutdown(wait=False)
         if mqtt_client.is_connected():
-            print("Responder: Memutus koneksi MQTT.")
+            log.info("Memutus koneksi MQTT.")
             mqtt_client.disconnect()
-        print("Responder script telah dihentikan.")
+        log.info("Responder script telah dihentikan.")
         sys.exit(0)
 
 if __name__ == "__main__":
@@ -3,59 +3,104 @@ import json
 import time
 import paho.mqtt.client as mqtt
 import sys
+import os
+import heapq
+import queue
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor
+import bmkg_http
+import bmkg_metrics
+from bmkg_logging import setup_logging
+from bmkg_ratelimit import bmkg_rate_limiter, FETCH_MAX_WORKERS
+from bmkg_forecast import parse_bmkg_response
+from bmkg_fanout import PublishWindow
+from bmkg_sharding import ShardMembership, SHARD_GROUP, SHARD_NODE_ID
 
-BMKG_API_URL = "https://api.bmkg.go.id/publik/prakiraan-cuaca"
+log = logging.getLogger("bmkg.publisher")
+
+BMKG_API_URL = os.getenv("BMKG_API_URL", "https://api.bmkg.go.id/publik/prakiraan-cuaca")
 ADM4_CODE = "35.78.09.1001"
+# Multi-wilayah: daftar kode dipisah koma, atau file berisi satu kode per baris (# untuk komentar)
+ADM4_CODES_LIST = os.getenv("ADM4_CODES_LIST", "")
+ADM4_CODES_FILE = os.getenv("ADM4_CODES_FILE")
 
-MQTT_BROKER_HOST = "localhost"
-MQTT_BROKER_PORT = 1883
+MQTT_BROKER_HOST = os.getenv("MQTT_BROKER_HOST", "localhost")
+MQTT_BROKER_PORT = int(os.getenv("MQTT_BROKER_PORT", 1883))
 MQTT_CLIENT_ID = "bmkg_publisher_continuous_py_002"
+# Beberapa publisher dalam satu SHARD_GROUP membagi daftar wilayah; client ID harus unik per node
+if SHARD_GROUP:
+    MQTT_CLIENT_ID = f"{MQTT_CLIENT_ID}-{SHARD_NODE_ID}"
 
 MQTT_TOPIC_BASE = "bmkg/weather/forecast"
 
-FETCH_INTERVAL_SECONDS = 60
+FETCH_INTERVAL_SECONDS = int(os.getenv("FETCH_INTERVAL_SECONDS", 60))
+# Antrian hasil fetch yang menunggu dipublish (fetch dan publish berjalan paralel)
+PUBLISH_QUEUE_SIZE = int(os.getenv("PUBLISH_QUEUE_SIZE", 32))
+# Wilayah yang gagal dicoba lagi lebih cepat dari interval normal, dengan backoff sampai batas ini
+REGION_RETRY_MAX_SECONDS = int(os.getenv("REGION_RETRY_MAX_SECONDS", 300))
+
+# Maksimum pesan QoS 1 yang menunggu PUBACK; publish berikutnya menunggu slot kosong (MQTT_MAX_INFLIGHT)
+publish_window = PublishWindow()
+bmkg_metrics.MQTT_INFLIGHT.set_function(publish_window.inflight)
 
 def fetch_bmkg_data(api_url, adm4):
     full_url = f"{api_url}?adm4={adm4}"
     try:
-        print(f"\n[{time.strftime('%Y-%m-%d %H:%M:%S')}] Publisher: Meminta data dari BMKG API: {full_url}")
-        response = requests.get(full_url, timeout=20) # Timeout lebih panjang untuk jaga-jaga
+        log.debug("Meminta data dari BMKG API: %s", full_url)
+        response = bmkg_http.get(full_url, timeout=20) # Timeout lebih panjang untuk jaga-jaga
         response.raise_for_status() 
-        print(f"Publisher: Status Respons BMKG API: {response.status_code}")
+        log.debug("Status Respons BMKG API: %s", response.status_code)
         return response.json()
     except requests.exceptions.Timeout:
-        print(f"Error: Timeout saat menghubungi BMKG API {full_url}")
+        log.warning("Timeout saat menghubungi BMKG API %s", full_url)
         return None
     except requests.exceptions.HTTPError as http_err:
-        print(f"Error HTTP saat menghubungi BMKG API: {http_err} - Respons: {response.text if response else 'Tidak ada respons'}")
+        log.error("Error HTTP saat menghubungi BMKG API: %s - Respons: %s", http_err, response.text if response else 'Tidak ada respons')
         return None
     except requests.exceptions.RequestException as e:
-        print(f"Error mengambil data dari BMKG: {e}")
+        log.error("Error mengambil data dari BMKG: %s", e)
         return None
     except json.JSONDecodeError:
-        print(f"Error decoding JSON dari BMKG. Teks Respons: {response.text if response else 'Tidak ada respons'}")
+        log.error("Error decoding JSON dari BMKG. Teks Respons: %s", response.text if response else 'Tidak ada respons')
         return None
 
 def on_connect(client, userdata, flags, rc):
     if rc == 0:
-        print(f"Publisher: Terhubung ke MQTT Broker ({MQTT_BROKER_HOST}:{MQTT_BROKER_PORT}) dengan sukses.")
+        log.info("Terhubung ke MQTT Broker (%s:%s) dengan sukses.", MQTT_BROKER_HOST, MQTT_BROKER_PORT)
+        bmkg_metrics.record_connect()
+        shard_membership.announce(client)
     else:
-        print(f"Publisher: Gagal terhubung ke MQTT Broker, return code {rc}")
+        log.error("Gagal terhubung ke MQTT Broker, return code %s", rc)
 
 def on_disconnect(client, userdata, rc):
-    print(f"Publisher: Terputus dari MQTT Broker dengan kode: {rc}. Mencoba menghubungkan kembali...")
+    log.warning("Terputus dari MQTT Broker dengan kode: %s. Mencoba menghubungkan kembali...", rc)
+    publish_window.reset() # PUBACK untuk pesan lama tidak akan datang lagi, kembalikan slot window
+    bmkg_metrics.record_disconnect()
 
 def on_publish(client, userdata, mid):
-    pass
+    publish_window.on_publish(client, userdata, mid)
+
+def report_batch_complete(batch):
+    # Dipanggil dari thread network paho setelah ACK terakhir satu wilayah diterima
+    log.log(logging.WARNING if batch.failed else logging.INFO, "Batch %s dikonfirmasi broker: %s/%s pesan di-ACK (%s gagal) dalam %s ms.", batch.name, batch.acked, batch.submitted, batch.failed, batch.duration_ms())
 
 MQTT_QOS = 1
 
-def process_and_publish_data(mqtt_client, weather_data_raw):
+def splice_json_fields(record_json, fields_fragment):
+    """Sambung fragmen field JSON (objek tanpa kurung kurawal) ke akhir objek JSON yang sudah di-encode."""
+    if not fields_fragment:
+        return record_json
+    if record_json == "{}":
+        return f"{{{fields_fragment}}}"
+    return f"{record_json[:-1]}, {fields_fragment}}}"
+
+def process_and_publish_data(mqtt_client, weather_data_raw, adm4_code=ADM4_CODE):
     if weather_data_raw and "data" in weather_data_raw and weather_data_raw["data"] and "lokasi" in weather_data_raw:
-        print("Publisher: Data valid diterima dari BMKG, memproses untuk publikasi...")
+        log.debug("Data valid diterima dari BMKG, memproses untuk publikasi...")
         
         location_info = weather_data_raw.get("lokasi", {})
-        adm4_code_from_data = location_info.get("adm4", ADM4_CODE)
+        adm4_code_from_data = location_info.get("adm4", adm4_code)
         desa = location_info.get("desa", "N/A")
         kecamatan = location_info.get("kecamatan", "N/A")
         kotkab = location_info.get("kotkab", "N/A")
@@ -64,104 +109,218 @@ def process_and_publish_data(mqtt_client, weather_data_raw):
         forecast_location_data = weather_data_raw["data"][0] 
         
         if "cuaca" in forecast_location_data:
-            all_forecasts_for_location = []
-            for daily_forecast_array in forecast_location_data["cuaca"]:
-                for forecast_item_detail in daily_forecast_array:
-                    all_forecasts_for_location.append(forecast_item_detail)
+            # Hanya field yang dipakai dashboard yang dikirim (lihat bmkg_forecast)
+            _, forecasts = parse_bmkg_response(weather_data_raw)
+            all_forecasts_for_location = [forecast.to_dict() for forecast in forecasts]
             
             if not all_forecasts_for_location:
-                print("Publisher: Tidak ada item prakiraan di dalam array 'cuaca'.")
+                log.warning("Tidak ada item prakiraan di dalam array 'cuaca'.")
                 return False
 
-            print(f"Publisher: Ditemukan {len(all_forecasts_for_location)} periode prakiraan. Memulai publikasi...")
+            log.debug("Ditemukan %s periode prakiraan. Memulai publikasi...", len(all_forecasts_for_location))
+            # Header lokasi di-encode sekali per wilayah lalu disambung ke JSON tiap periode
+            # (field periode di depan), jadi field lokasi tidak di-encode ulang per periode
+            location_header_json = json.dumps({
+                "adm4_code": adm4_code_from_data, "desa": desa, "kecamatan": kecamatan,
+                "kotkab": kotkab, "provinsi": provinsi,
+            })[1:-1]
+            batch = publish_window.begin_batch(adm4_code_from_data, on_complete=report_batch_complete)
             published_count = 0
             for i, single_forecast_data in enumerate(all_forecasts_for_location):
-                payload_to_send = single_forecast_data.copy()
-                payload_to_send["adm4_code"] = adm4_code_from_data
-                payload_to_send["desa"] = desa
-                payload_to_send["kecamatan"] = kecamatan
-                payload_to_send["kotkab"] = kotkab
-                payload_to_send["provinsi"] = provinsi
-                
-                forecast_datetime_utc_str = single_forecast_data.get("datetime", f"unknown_time_index_{i}")
+                forecast_datetime_utc_str = single_forecast_data.get("datetime") or f"unknown_time_index_{i}"
                 dynamic_topic = f"{MQTT_TOPIC_BASE}/{adm4_code_from_data}/{forecast_datetime_utc_str}"
-                payload_json_str = json.dumps(payload_to_send)
+                payload_json_str = splice_json_fields(json.dumps(single_forecast_data), location_header_json)
                 
                 if mqtt_client.is_connected():
-                    publish_result = mqtt_client.publish(dynamic_topic, payload_json_str, qos=1)
-                    if publish_result.rc == mqtt.MQTT_ERR_SUCCESS:
+                    # Tidak menunggu PUBACK per pesan; hanya tertahan jika window in-flight penuh
+                    if publish_window.publish(mqtt_client, batch, dynamic_topic, payload_json_str, qos=MQTT_QOS):
                         published_count += 1
+                        bmkg_metrics.MQTT_PUBLISHED.inc(kind="forecast")
                     else:
-                        print(f"Publisher: Gagal publish ke {dynamic_topic}, error code: {publish_result.rc}")
-                    # time.sleep(0.01) # Jeda sangat kecil jika diperlukan
+                        log.warning("Gagal publish ke %s", dynamic_topic)
                 else:
-                    print("Publisher: MQTT Client tidak terhubung. Pesan tidak dipublikasikan.")
+                    log.warning("MQTT Client tidak terhubung. Pesan tidak dipublikasikan.")
+                    publish_window.close_batch(batch)
                     return False # Berhenti memproses jika koneksi putus
+            publish_window.close_batch(batch)
 
-            print(f"Publisher: {published_count} dari {len(all_forecasts_for_location)} data prakiraan berhasil diproses untuk publikasi.")
+            log.debug("%s dari %s data prakiraan dikirim, konfirmasi broker menyusul per batch.", published_count, len(all_forecasts_for_location))
             return True # Sukses mempublish
         else:
-            print("Publisher: Key 'cuaca' tidak ditemukan dalam respons data BMKG (di dalam 'data[0]').")
+            log.warning("Key 'cuaca' tidak ditemukan dalam respons data BMKG (di dalam 'data[0]').")
     else:
-        print("Publisher: Data dari BMKG tidak valid atau kosong/tidak lengkap.")
+        log.warning("Data dari BMKG tidak valid atau kosong/tidak lengkap.")
     return False
 
+def load_adm4_codes():
+    if ADM4_CODES_FILE:
+        with open(ADM4_CODES_FILE, encoding="utf-8") as codes_file:
+            codes = [line.split("#", 1)[0].strip() for line in codes_file]
+    else:
+        codes = [code.strip() for code in ADM4_CODES_LIST.split(",")]
+    codes = list(dict.fromkeys(code for code in codes if code)) # Buang duplikat, urutan tetap
+    return codes or [ADM4_CODE]
+
+# Kepemilikan wilayah per node (consistent hashing); tanpa SHARD_GROUP semua wilayah milik node ini.
+# Wilayah yang diambil alih setelah rebalance ikut dikerjakan pada jadwalnya berikutnya.
+shard_membership = ShardMembership(load_adm4_codes())
+
+class RegionScheduler:
+    """Jadwal refresh per wilayah dengan offset awal yang disebar merata sepanjang interval.
+
+    Fetch berjalan di thread pool (dibatasi token bucket BMKG), hasilnya masuk antrian
+    publish yang dikerjakan thread terpisah, jadi fetch wilayah berikutnya tidak menunggu
+    publish wilayah sebelumnya. Kegagalan satu wilayah hanya memajukan jadwal retry
+    wilayah itu sendiri.
+    """
+
+    def __init__(self, mqtt_client, adm4_codes, interval_seconds=FETCH_INTERVAL_SECONDS, owns=None):
+        self.mqtt_client = mqtt_client
+        self.owns = owns or (lambda code: True)
+        self.interval_seconds = interval_seconds
+        self._lock = threading.Lock()
+        self._due = [] # heap (waktu jatuh tempo, kode)
+        self._regions = {}
+        started_at = time.monotonic()
+        stagger_seconds = interval_seconds / len(adm4_codes)
+        for index, code in enumerate(adm4_codes):
+            due_at = started_at + index * stagger_seconds
+            self._regions[code] = {"next_due": due_at, "in_flight": False, "failures": 0, "last_success": None}
+            heapq.heappush(self._due, (due_at, code))
+        self._fetch_executor = ThreadPoolExecutor(max_workers=FETCH_MAX_WORKERS, thread_name_prefix="bmkg-fetch")
+        self._publish_queue = queue.Queue(maxsize=PUBLISH_QUEUE_SIZE)
+        bmkg_metrics.QUEUE_DEPTH.set_function(self._publish_queue.qsize, queue="publish")
+        self._publisher_thread = threading.Thread(target=self._publish_worker, name="bmkg-publish", daemon=True)
+        self._publisher_thread.start()
+
+    def run_pending(self):
+        """Kirim semua wilayah yang sudah jatuh tempo ke thread pool fetch; kembalikan detik sampai jadwal berikutnya."""
+        now = time.monotonic()
+        with self._lock:
+            while self._due and self._due[0][0] <= now:
+                due_at, code = heapq.heappop(self._due)
+                region = self._regions[code]
+                if due_at != region["next_due"]:
+                    continue # Entri lama (jadwal sudah diganti retry)
+                # Fixed-rate: offset antar wilayah tetap terjaga; jika tertinggal, mulai dari sekarang
+                region["next_due"] = due_at + self.interval_seconds if due_at + self.interval_seconds > now else now + self.interval_seconds
+                heapq.heappush(self._due, (region["next_due"], code))
+                if not self.owns(code):
+                    continue # Dikerjakan node lain di shard group; jadwal tetap jalan untuk rebalance
+                if region["in_flight"]:
+                    log.warning("[%s] Siklus sebelumnya belum selesai, jadwal ini dilewati.", code)
+                    continue
+                region["in_flight"] = True
+                self._fetch_executor.submit(self._fetch_region, code)
+            return max(0.0, self._due[0][0] - now) if self._due else self.interval_seconds
+
+    def _fetch_region(self, code):
+        try:
+            bmkg_rate_limiter.acquire()
+            weather_data_raw = fetch_bmkg_data(BMKG_API_URL, code)
+        except Exception as e:
+            log.exception("[%s] Error tak terduga saat fetch: %s", code, e)
+            weather_data_raw = None
+        if not weather_data_raw:
+            self._finish_region(code, False)
+            return
+        self._publish_queue.put((code, weather_data_raw)) # Tertahan jika publisher tertinggal (backpressure)
+
+    def _publish_worker(self):
+        while True:
+            code, weather_data_raw = self._publish_queue.get()
+            try:
+                ok = bool(process_and_publish_data(self.mqtt_client, weather_data_raw, code))
+            except Exception as e:
+                log.exception("[%s] Error tak terduga saat publish: %s", code, e)
+                ok = False
+            self._finish_region(code, ok)
+
+    def _finish_region(self, code, ok):
+        with self._lock:
+            region = self._regions[code]
+            region["in_flight"] = False
+            if ok:
+                region["failures"] = 0
+                region["last_success"] = time.strftime('%Y-%m-%d %H:%M:%S')
+                return
+            region["failures"] += 1
+            retry_in = min(REGION_RETRY_MAX_SECONDS, 15 * 2 ** (region["failures"] - 1))
+            retry_at = time.monotonic() + retry_in
+            if retry_at < region["next_due"]:
+                region["next_due"] = retry_at
+                heapq.heappush(self._due, (retry_at, code))
+        log.warning("[%s] Gagal (%sx berturut-turut), dicoba lagi dalam %.0f detik.", code, region['failures'], min(retry_in, self.interval_seconds))
+
+    def summary(self):
+        with self._lock:
+            failing = sorted(code for code, region in self._regions.items() if region["failures"])
+        return {"regions": len(self._regions), "owned": len([code for code in self._regions if self.owns(code)]),
+                "failing": failing, "publish_queue": self._publish_queue.qsize()}
+
+    def shutdown(self):
+        self._fetch_executor.shutdown(wait=False, cancel_futures=True)
+
 def main_loop():
+    setup_logging()
+    bmkg_metrics.start_http_server()
     mqtt_publisher = mqtt.Client(client_id=MQTT_CLIENT_ID)
     mqtt_publisher.on_connect = on_connect
     mqtt_publisher.on_disconnect = on_disconnect # callback on_disconnect
     mqtt_publisher.on_publish = on_publish
+    publish_window.configure_client(mqtt_publisher)
+    shard_membership.attach(mqtt_publisher) # Last Will menghapus presence jika proses mati
 
     # Mencoba terhubung terus menerus jika gagal
     while not mqtt_publisher.is_connected():
         try:
-            print(f"Publisher: Mencoba terhubung ke MQTT Broker ({MQTT_BROKER_HOST}:{MQTT_BROKER_PORT})...")
+            log.info("Mencoba terhubung ke MQTT Broker (%s:%s)...", MQTT_BROKER_HOST, MQTT_BROKER_PORT)
             mqtt_publisher.connect(MQTT_BROKER_HOST, MQTT_BROKER_PORT, 60)
             mqtt_publisher.loop_start() # Memulai network loop di thread terpisah
             time.sleep(1) # Beri waktu untuk koneksi
             if not mqtt_publisher.is_connected():
-                print("Publisher: Gagal terhubung setelah mencoba, menunggu sebelum mencoba lagi...")
+                log.warning("Gagal terhubung setelah mencoba, menunggu sebelum mencoba lagi...")
                 mqtt_publisher.loop_stop() # Hentikan loop jika koneksi awal gagal total
                 time.sleep(10) # Tunggu 10 detik sebelum mencoba lagi
         except Exception as e:
-            print(f"Publisher: Exception saat mencoba terhubung ke MQTT Broker: {e}. Mencoba lagi dalam 10 detik...")
+            log.warning("Exception saat mencoba terhubung ke MQTT Broker: %s. Mencoba lagi dalam 10 detik...", e)
             time.sleep(10)
     
-    print(f"Publisher: Terhubung dan memulai loop utama. Interval update: {FETCH_INTERVAL_SECONDS} detik.")
+    adm4_codes = shard_membership.keys
+    if shard_membership.enabled and not shard_membership.wait_settled():
+        log.warning("Presence shard belum terkonfirmasi, mulai dengan daftar node yang sudah diketahui.")
+    scheduler = RegionScheduler(mqtt_publisher, adm4_codes, owns=shard_membership.owns)
+    log.info("Terhubung dan memulai loop utama untuk %s wilayah. Interval update: %s detik (offset antar wilayah %.1f detik, shard: %s).", len(adm4_codes), FETCH_INTERVAL_SECONDS, FETCH_INTERVAL_SECONDS / len(adm4_codes), shard_membership.status())
     
     try:
         while True:
             if not mqtt_publisher.is_connected():
-                print("Publisher: Koneksi MQTT terputus. Mencoba menghubungkan kembali di iterasi berikutnya...")
+                log.warning("Koneksi MQTT terputus. Mencoba menghubungkan kembali di iterasi berikutnya...")
                 # Paho client dengan loop_start() akan mencoba reconnect otomatis
                 try:
                     mqtt_publisher.reconnect()
-                    print("Publisher: Reconnect attempt...")
+                    log.info("Reconnect attempt...")
                 except Exception as e_reconnect:
-                    print(f"Publisher: Gagal reconnect: {e_reconnect}")
+                    log.error("Gagal reconnect: %s", e_reconnect)
                 time.sleep(10) # Tunggu sebelum iterasi berikutnya jika reconnect gagal
                 continue
 
-            weather_data_raw = fetch_bmkg_data(BMKG_API_URL, ADM4_CODE)
-            
-            if weather_data_raw:
-                process_and_publish_data(mqtt_publisher, weather_data_raw)
-            else:
-                print(f"Publisher: Tidak ada data dari BMKG pada iterasi ini. Tidak ada yang dipublish.")
-            
-            print(f"Publisher: Menunggu {FETCH_INTERVAL_SECONDS} detik untuk siklus berikutnya...")
-            time.sleep(FETCH_INTERVAL_SECONDS)
+            # Tidur sampai wilayah berikutnya jatuh tempo (maks. 1 detik agar status koneksi tetap dicek)
+            time.sleep(min(1.0, scheduler.run_pending()))
 
     except KeyboardInterrupt:
-        print("\nPublisher: KeyboardInterrupt diterima. Menghentikan script...")
+        log.info("KeyboardInterrupt diterima. Menghentikan script...")
     except Exception as e_main:
-        print(f"Publisher: Terjadi error tak terduga di main loop: {e_main}")
+        log.exception("Terjadi error tak terduga di main loop: %s", e_main)
     finally:
+        scheduler.shutdown()
+        log.info("Status wilayah terakhir: %s", scheduler.summary())
         if mqtt_publisher and mqtt_publisher.is_connected():
-            print("Publisher: Menghentikan network loop dan memutus koneksi MQTT.")
+            log.info("Menghentikan network loop dan memutus koneksi MQTT.")
+            shard_membership.leave(mqtt_publisher)
             mqtt_publisher.loop_stop()
             mqtt_publisher.disconnect()
-        print("Publisher script telah dihentikan.")
+        log.info("Publisher script telah dihentikan.")
         sys.exit(0)
 
 if __name__ == "__main__":
@@ -0,0 +1,87 @@
+# sync_bmkg_modules.py
+# Modul bmkg_* di root repo adalah satu-satunya sumber. Folder deployable BismillahFiks/*
+# dijalankan berdiri sendiri (tanpa root repo di sys.path), jadi modul yang dipakainya
+# disalin ke sana oleh skrip ini dengan header "generated copy". Edit file di root,
+# lalu jalankan:
+#   python sync_bmkg_modules.py          -> tulis ulang semua salinan
+#   python sync_bmkg_modules.py --check  -> exit 1 jika ada salinan yang basi (dipakai tests/)
+import argparse
+import os
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.abspath(__file__))
+
+VENDORED_MODULES = {
+    "BismillahFiks/publisher": [
+        "bmkg_codec.py", "bmkg_dedup.py", "bmkg_delta.py", "bmkg_forecast.py", "bmkg_http.py",
+        "bmkg_logging.py", "bmkg_metrics.py", "bmkg_ratelimit.py", "bmkg_sharding.py", "bmkg_store.py",
+    ],
+    "BismillahFiks/dashboard": ["bmkg_codec.py", "bmkg_logging.py"],
+}
+
+GENERATED_HEADER = (
+    b"# GENERATED COPY dari ../../%s oleh sync_bmkg_modules.py -- JANGAN DIEDIT DI SINI.\r\n"
+    b"# Ubah file di root repo lalu jalankan: python sync_bmkg_modules.py\r\n"
+)
+
+
+def expected_copy(module_name):
+    with open(os.path.join(REPO_ROOT, module_name), "rb") as f:
+        source = f.read()
+    return GENERATED_HEADER % module_name.encode() + source
+
+
+def iter_copies():
+    for target_dir, module_names in VENDORED_MODULES.items():
+        for module_name in module_names:
+            yield module_name, os.path.join(REPO_ROOT, target_dir, module_name)
+
+
+def stale_copies():
+    """Daftar path salinan yang hilang atau berbeda dari modul sumbernya."""
+    stale = []
+    for module_name, copy_path in iter_copies():
+        try:
+            with open(copy_path, "rb") as f:
+                current = f.read()
+        except FileNotFoundError:
+            current = None
+        if current != expected_copy(module_name):
+            stale.append(os.path.relpath(copy_path, REPO_ROOT))
+    return stale
+
+
+def sync_copies():
+    written = []
+    for module_name, copy_path in iter_copies():
+        content = expected_copy(module_name)
+        if os.path.exists(copy_path):
+            with open(copy_path, "rb") as f:
+                if f.read() == content:
+                    continue
+        with open(copy_path, "wb") as f:
+            f.write(content)
+        written.append(os.path.relpath(copy_path, REPO_ROOT))
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Salin modul bmkg_* dari root repo ke folder BismillahFiks/*.")
+    parser.add_argument("--check", action="store_true", help="Hanya periksa; exit 1 jika ada salinan yang basi")
+    args = parser.parse_args()
+    if args.check:
+        stale = stale_copies()
+        for path in stale:
+            print(f"Stale: {path}")
+        if stale:
+            print("Jalankan: python sync_bmkg_modules.py")
+            return 1
+        print("All vendored copies up to date.")
+        return 0
+    for path in sync_copies():
+        print(f"Updated: {path}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,9 @@
+# conftest.py
+# Modul bmkg_* di repo ini berupa skrip datar di root (bukan package), jadi root repo
+# dimasukkan ke sys.path supaya test bisa mengimpornya seperti publisher-publishernya.
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
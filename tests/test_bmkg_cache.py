@@ -0,0 +1,55 @@
+import pytest
+
+import bmkg_cache
+from bmkg_cache import ForecastCache
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(bmkg_cache.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_fresh_entry_is_a_hit(clock):
+    cache = ForecastCache(ttl_seconds=60, max_entries=4)
+    cache.store("31.71.03.1001", {"data": 1})
+    entry = cache.lookup("31.71.03.1001")
+    assert entry.is_fresh() and entry.data == {"data": 1}
+    assert cache.stats()["hits"] == 1
+
+
+def test_expired_entry_is_kept_for_revalidation(clock):
+    cache = ForecastCache(ttl_seconds=60, max_entries=4)
+    cache.store("a", {"v": 1}, {"ETag": '"abc"', "Last-Modified": "Mon, 01 Jan 2024 00:00:00 GMT"})
+    clock[0] += 61
+    entry = cache.lookup("a")
+    assert entry is not None and not entry.is_fresh()
+    assert entry.validators() == {"If-None-Match": '"abc"', "If-Modified-Since": "Mon, 01 Jan 2024 00:00:00 GMT"}
+    assert cache.stats()["misses"] == 1
+
+
+def test_revalidated_extends_lifetime_and_keeps_validators(clock):
+    cache = ForecastCache(ttl_seconds=60, max_entries=4)
+    stale = cache.store("a", {"v": 1}, {"ETag": '"abc"'})
+    clock[0] += 61
+    refreshed = cache.revalidated("a", stale, {})
+    assert refreshed.is_fresh() and refreshed.data == {"v": 1} and refreshed.etag == '"abc"'
+    assert cache.lookup("a").is_fresh()
+    assert cache.stats()["revalidations"] == 1
+
+
+def test_lru_eviction_keeps_recently_used(clock):
+    cache = ForecastCache(ttl_seconds=60, max_entries=2)
+    cache.store("a", 1)
+    cache.store("b", 2)
+    cache.lookup("a")  # a jadi paling baru dipakai
+    cache.store("c", 3)
+    assert cache.lookup("b") is None
+    assert cache.lookup("a").data == 1 and cache.lookup("c").data == 3
+
+
+def test_warm_entry_ages_from_original_fetch(clock):
+    cache = ForecastCache(ttl_seconds=60, max_entries=4)
+    assert cache.warm("a", 1, age_seconds=30).is_fresh()
+    assert not cache.warm("b", 2, age_seconds=90).is_fresh()
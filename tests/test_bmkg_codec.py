@@ -0,0 +1,52 @@
+import pytest
+
+import bmkg_codec
+
+SAMPLE = {
+    "location": {"adm4": "31.71.01.1001", "desa": "Gambir", "lat": -6.17},
+    "forecasts": [{"datetime": "2026-10-17T00:00:00Z", "t": 30, "weather_desc": "Cerah Berawan", "hu": None}],
+}
+
+
+@pytest.mark.parametrize("codec", [
+    bmkg_codec.CODEC_JSON,
+    pytest.param(bmkg_codec.CODEC_MSGPACK, marks=pytest.mark.skipif(bmkg_codec.msgpack is None, reason="msgpack tidak terpasang")),
+    pytest.param(bmkg_codec.CODEC_JSON_ZSTD, marks=pytest.mark.skipif(bmkg_codec.zstandard is None, reason="zstandard tidak terpasang")),
+])
+def test_round_trip_through_content_type(codec):
+    payload = bmkg_codec.encode(SAMPLE, codec)
+    assert isinstance(payload, bytes)
+    assert bmkg_codec.decode(payload, bmkg_codec.CONTENT_TYPES[codec]) == SAMPLE
+
+
+def test_missing_content_type_is_json_from_legacy_publishers():
+    assert bmkg_codec.decode(b'{"desa": "Gambir"}') == {"desa": "Gambir"}
+    assert bmkg_codec.decode('{"desa": "Gambir"}', None) == {"desa": "Gambir"}
+
+
+def test_json_keeps_non_ascii_compact():
+    assert bmkg_codec.encode({"desa": "Pasar Baru", "cuaca": "Hujan Ringan°"}, bmkg_codec.CODEC_JSON) == \
+        '{"desa":"Pasar Baru","cuaca":"Hujan Ringan°"}'.encode("utf-8")
+
+
+def test_decode_errors_are_value_errors():
+    with pytest.raises(ValueError):
+        bmkg_codec.decode(b"\xff\xfe not json")
+    with pytest.raises(ValueError):
+        bmkg_codec.decode(b"\x00\x01", bmkg_codec.CONTENT_TYPES[bmkg_codec.CODEC_JSON_ZSTD])
+
+
+def test_negotiate_prefers_first_available_and_defaults_to_json():
+    assert bmkg_codec.negotiate(None) == bmkg_codec.CODEC_JSON
+    assert bmkg_codec.negotiate("brotli, application/json") == bmkg_codec.CODEC_JSON
+    expected = bmkg_codec.CODEC_MSGPACK if bmkg_codec.msgpack is not None else bmkg_codec.CODEC_JSON
+    assert bmkg_codec.negotiate(["application/msgpack", "json"]) == expected
+
+
+def test_requested_codec_reads_payload_field_before_user_property():
+    class Properties:
+        UserProperty = [("accept", "msgpack")]
+
+    assert bmkg_codec.requested_codec(Properties(), {"accept": "json"}) == bmkg_codec.CODEC_JSON
+    expected = bmkg_codec.CODEC_MSGPACK if bmkg_codec.msgpack is not None else bmkg_codec.CODEC_JSON
+    assert bmkg_codec.requested_codec(Properties()) == expected
@@ -0,0 +1,113 @@
+import json
+import os
+
+import pytest
+
+import bmkg_delta
+from bmkg_delta import DeltaTracker, KIND_DELTA, KIND_SNAPSHOT
+
+TOPIC = "bmkg/prakiraan/31.71.01.1001"
+
+
+def forecasts(*temps):
+    return [{"datetime": f"2026-10-17T{hour:02d}:00:00Z", "t": temp} for hour, temp in enumerate(temps)]
+
+
+def publish(tracker, items, force_snapshot=False):
+    update = tracker.plan(TOPIC, items, json.dumps(items), force_snapshot=force_snapshot)
+    tracker.commit(TOPIC, update)
+    return update
+
+
+def test_first_publish_is_snapshot_then_delta_carries_only_changes():
+    tracker = DeltaTracker(max_size_ratio=1.0)
+    first = publish(tracker, forecasts(30, 31, 32, 33))
+    assert first.kind == KIND_SNAPSHOT and first.topic == TOPIC and first.seq == 1
+    second = publish(tracker, forecasts(30, 29, 32))
+    assert second.kind == KIND_DELTA and second.topic == bmkg_delta.delta_topic(TOPIC)
+    body = json.loads(second.payload)
+    assert body["seq"] == 2
+    assert body["changed"] == [{"datetime": "2026-10-17T01:00:00Z", "t": 29}]
+    assert body["removed"] == ["2026-10-17T03:00:00Z"]
+
+
+def test_unchanged_data_resends_snapshot_not_empty_delta():
+    tracker = DeltaTracker(max_size_ratio=1.0)
+    publish(tracker, forecasts(30, 31))
+    assert publish(tracker, forecasts(30, 31)).kind == KIND_SNAPSHOT
+
+
+def test_large_delta_falls_back_to_snapshot():
+    tracker = DeltaTracker(max_size_ratio=0.1)
+    publish(tracker, forecasts(30, 31, 32))
+    assert publish(tracker, forecasts(20, 21, 22)).kind == KIND_SNAPSHOT
+
+
+def test_invalidate_forces_snapshot_but_seq_keeps_increasing():
+    tracker = DeltaTracker(max_size_ratio=1.0)
+    publish(tracker, forecasts(30, 31, 32))
+    tracker.invalidate(TOPIC)
+    update = publish(tracker, forecasts(30, 31, 33))
+    assert update.kind == KIND_SNAPSHOT and update.seq == 2
+
+
+def test_failed_publish_is_not_used_as_delta_base():
+    tracker = DeltaTracker(max_size_ratio=1.0)
+    publish(tracker, forecasts(30, 31, 32))
+    tracker.plan(TOPIC, forecasts(30, 31, 40), json.dumps(forecasts(30, 31, 40)))  # Tidak di-commit
+    body = json.loads(publish(tracker, forecasts(30, 31, 40)).payload)
+    assert body["changed"] == [{"datetime": "2026-10-17T02:00:00Z", "t": 40}]
+
+
+# --- Sisi subscriber: SubscriptionHub di dashboard menggabungkan delta dan mendeteksi seq bolong ---
+
+DASHBOARD_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "BismillahFiks", "dashboard")
+
+
+class _PublishResult:
+    rc = 0
+
+
+@pytest.fixture
+def hub(monkeypatch):
+    pytest.importorskip("paho.mqtt.client")
+    monkeypatch.syspath_prepend(DASHBOARD_DIR)
+    import bmkg_hub
+    hub = bmkg_hub.SubscriptionHub("localhost", 1883, "resp", delta_suffix=bmkg_delta.DELTA_TOPIC_SUFFIX,
+                                   resync_topic="bmkg/control/request")
+    hub.connected = True
+    hub.resyncs = []
+    monkeypatch.setattr(hub.client, "publish", lambda topic, payload, **kwargs: hub.resyncs.append(json.loads(payload)) or _PublishResult())
+    hub.attach("session")
+    hub.set_subscriptions("session", [TOPIC])
+    return hub
+
+
+def deliver(hub, update):
+    hub._apply({"topic": update.topic, "payload_bytes": update.payload.encode(),
+                "properties": {"UserProperty": dict(bmkg_delta.user_properties(update)), "ContentType": None}})
+
+
+def test_hub_merges_consecutive_deltas(hub):
+    tracker = DeltaTracker(max_size_ratio=1.0)
+    deliver(hub, publish(tracker, forecasts(30, 31, 32, 33)))
+    deliver(hub, publish(tracker, forecasts(30, 29, 32)))
+    _, value, _ = hub.latest(TOPIC)
+    assert value == forecasts(30, 29, 32)
+    assert hub.resyncs == []
+
+
+def test_hub_requests_resync_on_seq_gap_until_next_snapshot(hub):
+    tracker = DeltaTracker(max_size_ratio=1.0)
+    deliver(hub, publish(tracker, forecasts(30, 31, 32, 33)))
+    publish(tracker, forecasts(30, 29, 32, 33))  # Delta seq 2 hilang di jalan
+    deliver(hub, publish(tracker, forecasts(30, 29, 28, 33)))
+    _, value, _ = hub.latest(TOPIC)
+    assert value == forecasts(30, 31, 32, 33)  # Delta seq 3 tidak digabung ke data yang bolong
+    assert hub.resyncs == [{"command": "force_refresh", "adm4": "31.71.01.1001"}]
+    deliver(hub, publish(tracker, forecasts(30, 29, 28, 27)))  # Delta berikutnya: resync sudah diminta
+    assert len(hub.resyncs) == 1
+    deliver(hub, publish(tracker, forecasts(30, 29, 28, 27), force_snapshot=True))
+    deliver(hub, publish(tracker, forecasts(30, 29, 28, 26)))
+    _, value, _ = hub.latest(TOPIC)
+    assert value == forecasts(30, 29, 28, 26)
@@ -0,0 +1,61 @@
+import threading
+
+from bmkg_dispatch import RequestDispatcher
+
+
+def _drain(dispatcher):
+    for _ in range(500):
+        if dispatcher.queue_depth() == 0:
+            break
+        threading.Event().wait(0.01)
+    dispatcher.shutdown()
+
+
+def test_handler_receives_deadline():
+    dispatcher = RequestDispatcher(max_workers=1, max_queue=1, deadline_seconds=30)
+    done = threading.Event()
+    seen = {}
+
+    def handler(value, deadline=None):
+        seen["value"], seen["deadline"] = value, deadline
+        done.set()
+
+    assert dispatcher.submit(handler, "a")
+    assert done.wait(5)
+    dispatcher.shutdown()
+    assert seen["value"] == "a" and seen["deadline"] is not None
+    assert dispatcher.queue_depth() == 0
+
+
+def test_full_queue_rejects_without_blocking():
+    dispatcher = RequestDispatcher(max_workers=1, max_queue=1, deadline_seconds=30)
+    release = threading.Event()
+
+    def handler(deadline=None):
+        release.wait(5)
+
+    assert dispatcher.submit(handler)
+    assert dispatcher.submit(handler)
+    assert not dispatcher.submit(handler)
+    assert dispatcher.rejected == 1
+    release.set()
+    _drain(dispatcher)
+    assert dispatcher.queue_depth() == 0
+
+
+def test_request_past_deadline_calls_on_expired():
+    dispatcher = RequestDispatcher(max_workers=1, max_queue=1, deadline_seconds=0.05)
+    release = threading.Event()
+    handled, expired = [], []
+
+    def blocking(deadline=None):
+        release.wait(5)
+
+    assert dispatcher.submit(blocking)
+    assert dispatcher.submit(lambda value, deadline=None: handled.append(value), "late",
+                             on_expired=expired.append)
+    threading.Event().wait(0.1)
+    release.set()
+    _drain(dispatcher)
+    assert expired == ["late"] and handled == []
+    assert dispatcher.expired == 1
@@ -0,0 +1,56 @@
+import os
+import queue
+
+import pytest
+
+DASHBOARD_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "BismillahFiks", "dashboard")
+
+
+@pytest.fixture
+def eventqueue(monkeypatch):
+    monkeypatch.syspath_prepend(DASHBOARD_DIR)
+    import bmkg_eventqueue
+    return bmkg_eventqueue
+
+
+def test_full_queue_drops_oldest_event(eventqueue):
+    events = eventqueue.CoalescingEventQueue(maxsize=2)
+    for index in range(3):
+        events.put({"n": index})
+    assert [events.get_nowait()["n"] for _ in range(2)] == [1, 2]
+    assert events.stats()["dropped"] == 1 and events.stats()["high_water"] == 2
+    with pytest.raises(queue.Empty):
+        events.get_nowait()
+
+
+def test_coalesced_event_is_replaced_and_moved_behind_newer_events(eventqueue):
+    events = eventqueue.CoalescingEventQueue(maxsize=10)
+    events.put({"topic": "a", "v": 1}, coalesce_key="a")
+    events.put({"type": "delta"})
+    events.put({"topic": "a", "v": 2}, coalesce_key="a")
+    assert len(events) == 2 and events.stats()["coalesced"] == 1
+    # Snapshot terbaru tidak boleh mendahului delta yang antre setelah snapshot lama
+    assert events.get_nowait() == {"type": "delta"}
+    assert events.get_nowait() == {"topic": "a", "v": 2}
+
+
+def test_coalescing_never_drops_other_events(eventqueue):
+    events = eventqueue.CoalescingEventQueue(maxsize=2)
+    events.put({"v": 1}, coalesce_key="a")
+    events.put({"type": "response"})
+    events.put({"v": 2}, coalesce_key="a")
+    assert events.stats()["dropped"] == 0
+    assert [events.get_nowait() for _ in range(2)] == [{"type": "response"}, {"v": 2}]
+
+
+def test_get_times_out_when_empty(eventqueue):
+    with pytest.raises(queue.Empty):
+        eventqueue.CoalescingEventQueue().get(timeout=0.01)
+
+
+def test_log_ring_keeps_newest_lines(eventqueue):
+    events = eventqueue.CoalescingEventQueue(log_maxsize=2)
+    for line in ("a", "b", "c"):
+        events.put_log(line)
+    assert events.drain_logs() == ["b", "c"]
+    assert events.drain_logs() == [] and events.stats()["logs_dropped"] == 1
@@ -0,0 +1,129 @@
+import itertools
+import json
+
+import pytest
+
+import bmkg_fanout
+from bmkg_fanout import PublishWindow
+
+
+class PublishResult:
+    def __init__(self, rc, mid):
+        self.rc = rc
+        self.mid = mid
+
+
+class FakeClient:
+    """client.publish ala paho: mengembalikan mid berurutan, ACK dikirim manual lewat window.on_publish."""
+
+    def __init__(self, rc=0):
+        self.rc = rc
+        self._mids = itertools.count(1)
+        self.published = []
+
+    def is_connected(self):
+        return True
+
+    def publish(self, topic, payload, qos=0, retain=False):
+        self.published.append((topic, payload))
+        return PublishResult(self.rc, next(self._mids))
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    state = {"now": 1000.0}
+    monkeypatch.setattr(bmkg_fanout.time, "monotonic", lambda: state["now"])
+    return state
+
+
+def test_batch_completes_after_last_ack():
+    window = PublishWindow(max_inflight=4, slot_timeout=0.01)
+    client = FakeClient()
+    completed = []
+    batch = window.begin_batch("31.71.01.1001", on_complete=completed.append)
+    for i in range(3):
+        assert window.publish(client, batch, f"t/{i}", "{}")
+    window.close_batch(batch)
+    assert window.inflight() == 3 and completed == []
+    for mid in (1, 2, 3):
+        window.on_publish(client, None, mid)
+    assert completed == [batch] and batch.acked == 3 and window.inflight() == 0
+
+
+def test_full_window_fails_publish_after_slot_timeout():
+    window = PublishWindow(max_inflight=1, slot_timeout=0.01)
+    client = FakeClient()
+    batch = window.begin_batch("a")
+    assert window.publish(client, batch, "t/1", "{}")
+    assert not window.publish(client, batch, "t/2", "{}")
+    assert (batch.submitted, batch.failed) == (2, 1)
+
+
+def test_ack_arriving_before_publish_records_mid_is_matched():
+    window = PublishWindow(max_inflight=2, slot_timeout=0.01)
+    client = FakeClient()
+    batch = window.begin_batch("a")
+    window.on_publish(client, None, 1)  # PUBACK mendahului publish() (thread network paho lebih cepat)
+    assert window.publish(client, batch, "t/1", "{}")
+    window.close_batch(batch)
+    assert batch.acked == 1 and window.inflight() == 0
+    assert window.publish(client, window.begin_batch("b"), "t/2", "{}")
+    assert window.publish(client, window.begin_batch("c"), "t/3", "{}")  # Slot ACK dini sudah dikembalikan
+
+
+def test_unmatched_acks_expire_oldest_first(clock):
+    window = PublishWindow(max_inflight=2, slot_timeout=30)
+    client = FakeClient()
+    for mid in (101, 102, 103, 104):
+        window.on_publish(client, None, mid)
+    window.on_publish(client, None, 105)  # Melebihi 2x window: hanya yang tertua yang dibuang
+    assert list(window._early_acks) == [102, 103, 104, 105]
+    clock["now"] += 31
+    window.on_publish(client, None, 106)  # Semua ACK lama sudah melewati slot_timeout
+    assert list(window._early_acks) == [106]
+
+
+def test_reset_fails_unacked_messages_and_frees_slots():
+    window = PublishWindow(max_inflight=2, slot_timeout=0.01)
+    client = FakeClient()
+    completed = []
+    batch = window.begin_batch("a", on_complete=completed.append)
+    window.publish(client, batch, "t/1", "{}")
+    window.publish(client, batch, "t/2", "{}")
+    window.close_batch(batch)
+    window.reset()
+    assert completed == [batch] and batch.failed == 2
+    assert window.publish(client, window.begin_batch("b"), "t/3", "{}")
+
+
+def test_splice_json_fields_handles_empty_parts():
+    import publisher_bmkg
+
+    assert publisher_bmkg.splice_json_fields('{"t": 30}', '"desa": "A"') == '{"t": 30, "desa": "A"}'
+    assert publisher_bmkg.splice_json_fields('{}', '"desa": "A"') == '{"desa": "A"}'
+    assert publisher_bmkg.splice_json_fields('{"t": 30}', "") == '{"t": 30}'
+
+
+def test_period_payloads_carry_location_header_on_the_wire(monkeypatch):
+    import publisher_bmkg
+
+    monkeypatch.setattr(publisher_bmkg, "publish_window", PublishWindow(max_inflight=4, slot_timeout=0.01))
+    client = FakeClient()
+    weather_data = {
+        "lokasi": {"adm4": "31.71.01.1001", "desa": "Gambir", "kecamatan": "Gambir",
+                   "kotkab": "Kota Adm. Jakarta Pusat", "provinsi": "DKI Jakarta"},
+        "data": [{"cuaca": [[
+            {"datetime": "2025-01-01T00:00:00Z", "local_datetime": "2025-01-01 07:00:00", "t": 27, "weather_desc": "Cerah"},
+            {"datetime": "2025-01-01T03:00:00Z", "local_datetime": "2025-01-01 10:00:00", "t": 30, "weather_desc": "Berawan"},
+        ]]}],
+    }
+    assert publisher_bmkg.process_and_publish_data(client, weather_data)
+    header = ('"adm4_code": "31.71.01.1001", "desa": "Gambir", "kecamatan": "Gambir", '
+              '"kotkab": "Kota Adm. Jakarta Pusat", "provinsi": "DKI Jakarta"}')
+    assert [topic for topic, _ in client.published] == [
+        "bmkg/weather/forecast/31.71.01.1001/2025-01-01T00:00:00Z",
+        "bmkg/weather/forecast/31.71.01.1001/2025-01-01T03:00:00Z",
+    ]
+    for (_, payload), period in zip(client.published, weather_data["data"][0]["cuaca"][0]):
+        assert payload.startswith('{"datetime": "%s"' % period["datetime"]) and payload.endswith(", " + header)
+        assert json.loads(payload)["t"] == period["t"]
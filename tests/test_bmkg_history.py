@@ -0,0 +1,40 @@
+import json
+
+from bmkg_store import chunk_points, downsample
+
+HEADER = {"command": "history", "adm4": "31.71.01.1001", "since": "2026-10-10 00:00:00", "until": None}
+
+
+def encode(obj):
+    return json.dumps(obj, separators=(",", ":")).encode()
+
+
+def points(count):
+    return [{"datetime": f"2026-10-{10 + i // 8:02d} {3 * (i % 8):02d}:00:00", "t": 25 + i % 5, "n": 1} for i in range(count)]
+
+
+def test_small_series_fits_in_one_chunk():
+    chunks = chunk_points(HEADER, points(3), encode, max_bytes=64 * 1024)
+    assert chunks == [dict(HEADER, points=points(3))]
+
+
+def test_chunks_stay_under_limit_and_reassemble_in_order():
+    series = points(200)
+    chunks = chunk_points(HEADER, series, encode, max_bytes=2048, header_reserve=512)
+    assert len(chunks) > 1
+    for index, chunk in enumerate(chunks):
+        chunk.update(chunk=index, chunks=len(chunks))  # Sama seperti publish_history_response
+        assert len(encode(chunk)) <= 2048
+        assert {key: chunk[key] for key in HEADER} == HEADER
+    assert [point for chunk in chunks for point in chunk["points"]] == series
+
+
+def test_oversized_point_is_sent_alone():
+    big = {"datetime": "2026-10-10 00:00:00", "note": "x" * 5000}
+    chunks = chunk_points(HEADER, [big] + points(2), encode, max_bytes=1024)
+    assert [len(chunk["points"]) for chunk in chunks] == [1, 2]
+
+
+def test_empty_history_still_returns_header_chunk():
+    series, _ = downsample([], max_points=500)
+    assert chunk_points(HEADER, series, encode, max_bytes=1024) == [dict(HEADER, points=[])]
@@ -0,0 +1,93 @@
+import pytest
+import requests
+
+import bmkg_http
+
+
+class FakeResponse:
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+
+
+class FakeLimiter:
+    def __init__(self, grant=True):
+        self.grant = grant
+        self.calls = []
+
+    def acquire(self, timeout=None):
+        self.calls.append(timeout)
+        return self.grant
+
+
+@pytest.fixture
+def fake_http(monkeypatch):
+    """Session palsu dengan jam palsu: time.sleep di bmkg_http memajukan time.monotonic."""
+    state = {"now": 1000.0, "slept": [], "responses": [], "timeouts": []}
+
+    def fake_get(url, **kwargs):
+        state["timeouts"].append(kwargs.get("timeout"))
+        outcome = state["responses"].pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    def sleep(seconds):
+        state["slept"].append(seconds)
+        state["now"] += seconds
+
+    monkeypatch.setattr(bmkg_http.session, "get", fake_get)
+    monkeypatch.setattr(bmkg_http.time, "monotonic", lambda: state["now"])
+    monkeypatch.setattr(bmkg_http.time, "sleep", sleep)
+    monkeypatch.setattr(bmkg_http, "HTTP_MAX_RETRIES", 3)
+    return state
+
+
+URL = "https://bmkg.example/prakiraan?adm4=31.71.01.1001"
+
+
+def test_retry_takes_a_token_per_extra_attempt(fake_http):
+    fake_http["responses"] = [FakeResponse(503), requests.exceptions.ConnectionError("reset"), FakeResponse(200)]
+    limiter = FakeLimiter()
+    response = bmkg_http.get(URL, limiter=limiter)
+    assert response.status_code == 200
+    assert len(limiter.calls) == 2
+
+
+def test_retry_after_is_capped_by_backoff_max(fake_http, monkeypatch):
+    monkeypatch.setattr(bmkg_http, "HTTP_BACKOFF_MAX", 5)
+    fake_http["responses"] = [FakeResponse(429, {"Retry-After": "3600"}), FakeResponse(200)]
+    bmkg_http.get(URL, limiter=FakeLimiter())
+    assert fake_http["slept"] == [5]
+
+
+def test_retries_stop_at_deadline(fake_http, monkeypatch):
+    monkeypatch.setattr(bmkg_http, "HTTP_BACKOFF_MAX", 5)
+    fake_http["responses"] = [FakeResponse(503, {"Retry-After": "2"}), FakeResponse(503, {"Retry-After": "2"}),
+                              FakeResponse(200)]
+    response = bmkg_http.get(URL, timeout=10, deadline=fake_http["now"] + 3, limiter=FakeLimiter())
+    # Percobaan kedua dimulai di detik ke-2 dengan sisa 1 detik; retry berikutnya tidak sempat
+    assert response.status_code == 503
+    assert fake_http["timeouts"] == [3, 1]
+    assert fake_http["slept"] == [2]
+
+
+def test_error_raised_when_retries_exhausted(fake_http):
+    fake_http["responses"] = [requests.exceptions.ConnectTimeout("slow")] * 4
+    with pytest.raises(requests.exceptions.ConnectTimeout):
+        bmkg_http.get(URL, limiter=FakeLimiter())
+    assert fake_http["responses"] == []
+
+
+def test_limiter_refusal_returns_last_response(fake_http):
+    fake_http["responses"] = [FakeResponse(503), FakeResponse(200)]
+    response = bmkg_http.get(URL, deadline=fake_http["now"] + 30, limiter=FakeLimiter(grant=False))
+    assert response.status_code == 503
+    assert fake_http["slept"] == []
+
+
+def test_non_retryable_status_returned_immediately(fake_http):
+    fake_http["responses"] = [FakeResponse(404)]
+    limiter = FakeLimiter()
+    assert bmkg_http.get(URL, limiter=limiter).status_code == 404
+    assert limiter.calls == []
@@ -0,0 +1,82 @@
+import json
+import os
+
+import pytest
+
+TOPIC = "bmkg/prakiraan/31.71.01.1001"
+DASHBOARD_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "BismillahFiks", "dashboard")
+
+
+def period(hour, temp):
+    return {"datetime": f"2026-10-17T{hour:02d}:00:00Z", "t": temp}
+
+
+class _PublishResult:
+    rc = 0
+
+
+@pytest.fixture
+def bmkg_hub(monkeypatch):
+    pytest.importorskip("paho.mqtt.client")
+    monkeypatch.syspath_prepend(DASHBOARD_DIR)
+    import bmkg_hub
+    return bmkg_hub
+
+
+@pytest.fixture
+def hub(bmkg_hub, monkeypatch):
+    hub = bmkg_hub.SubscriptionHub("localhost", 1883, "resp", delta_suffix="/delta", resync_topic="bmkg/control/request")
+    hub.connected = True
+    hub.resyncs = []
+    monkeypatch.setattr(hub.client, "publish", lambda topic, payload, **kwargs: hub.resyncs.append(json.loads(payload)) or _PublishResult())
+    hub.attach("session")
+    hub.set_subscriptions("session", [TOPIC])
+    return hub
+
+
+def deliver(hub, topic, value, seq=None):
+    user_properties = {"seq": str(seq)} if seq is not None else {}
+    hub._apply({"topic": topic, "payload_bytes": json.dumps(value).encode(),
+                "properties": {"UserProperty": user_properties, "ContentType": None}})
+
+
+def test_merge_forecast_delta_replaces_removes_and_sorts(bmkg_hub):
+    current = [period(0, 30), period(1, 31), period(2, 32)]
+    delta = {"changed": [period(1, 29), period(3, 33)], "removed": [period(0, 30)["datetime"]]}
+    assert bmkg_hub.merge_forecast_delta(current, delta) == [period(1, 29), period(2, 32), period(3, 33)]
+
+
+def test_merge_forecast_delta_ignores_non_dict_items(bmkg_hub):
+    assert bmkg_hub.merge_forecast_delta([period(0, 30), "rusak"], {}) == [period(0, 30)]
+    assert bmkg_hub.merge_forecast_delta(None, {"changed": [period(0, 30)]}) == [period(0, 30)]
+
+
+def test_duplicate_delta_is_ignored(hub):
+    deliver(hub, TOPIC, [period(0, 30), period(1, 31)], seq=1)
+    deliver(hub, f"{TOPIC}/delta", {"changed": [period(1, 29)]}, seq=2)
+    version, _, _ = hub.latest(TOPIC)
+    deliver(hub, f"{TOPIC}/delta", {"changed": [period(1, 29)]}, seq=2)  # Dikirim ulang (QoS 1)
+    deliver(hub, f"{TOPIC}/delta", {"changed": [period(1, 28)]}, seq=1)
+    assert hub.latest(TOPIC)[:2] == (version, [period(0, 30), period(1, 29)])
+    assert hub.resyncs == []
+
+
+def test_delta_without_snapshot_seq_requests_resync(hub):
+    deliver(hub, TOPIC, [period(0, 30)])  # Snapshot dari publisher tanpa seq
+    deliver(hub, f"{TOPIC}/delta", {"changed": [period(0, 29)]}, seq=2)
+    assert hub.latest(TOPIC)[1] == [period(0, 30)]
+    assert hub.resyncs == [{"command": "force_refresh", "adm4": "31.71.01.1001"}]
+
+
+def test_identical_snapshot_does_not_bump_version(hub):
+    deliver(hub, TOPIC, [period(0, 30)], seq=1)
+    version, _, _ = hub.latest(TOPIC)
+    deliver(hub, TOPIC, [period(0, 30)], seq=2)
+    assert hub.latest(TOPIC)[0] == version
+    assert hub.changed_since(version, [TOPIC]) == (version, {})
+
+
+def test_messages_for_unsubscribed_topics_are_dropped(hub):
+    hub.set_subscriptions("session", [])
+    deliver(hub, TOPIC, [period(0, 30)], seq=1)
+    assert hub.latest(TOPIC) == (0, None, None)
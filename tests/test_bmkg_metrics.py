@@ -0,0 +1,26 @@
+import bmkg_metrics
+from bmkg_metrics import Counter, Histogram
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = Histogram("test_latency_seconds", "Test histogram.", ["status"])
+    histogram.observe(0.03, status="200")
+    histogram.observe(2, status="200")
+    lines = bmkg_metrics.render()
+    assert 'test_latency_seconds_bucket{status="200",le="0.05"} 1' in lines
+    assert 'test_latency_seconds_bucket{status="200",le="+Inf"} 2' in lines
+    assert 'test_latency_seconds_count{status="200"} 2' in lines
+
+
+def test_fetch_latency_is_labelled_by_status_only():
+    bmkg_metrics.record_fetch(304, 0.02)
+    text = bmkg_metrics.render()
+    assert 'bmkg_fetch_duration_seconds_count{status="304"}' in text
+    assert 'bmkg_fetches_total{status="304"}' in text
+    assert "adm4=" not in text
+
+
+def test_label_values_are_escaped():
+    counter = Counter("test_escaped_total", "Test counter.", ["kind"])
+    counter.inc(kind='say "hi"\n')
+    assert 'test_escaped_total{kind="say \\"hi\\"\\n"} 1' in bmkg_metrics.render()
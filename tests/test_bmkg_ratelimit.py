@@ -0,0 +1,78 @@
+import asyncio
+import time
+
+import pytest
+
+import bmkg_ratelimit
+from bmkg_ratelimit import AsyncTokenBucket, TokenBucket
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Jam palsu: time.sleep di bmkg_ratelimit memajukan time.monotonic tanpa menunggu."""
+    state = {"now": 1000.0, "slept": []}
+
+    def sleep(seconds):
+        state["slept"].append(seconds)
+        state["now"] += seconds
+
+    monkeypatch.setattr(bmkg_ratelimit.time, "monotonic", lambda: state["now"])
+    monkeypatch.setattr(bmkg_ratelimit.time, "sleep", sleep)
+    return state
+
+
+def test_bucket_allows_burst_then_paces(clock):
+    bucket = TokenBucket(rate_per_minute=60, burst=2)
+    bucket.acquire()
+    bucket.acquire()
+    assert clock["slept"] == []
+    bucket.acquire()
+    assert clock["slept"] == [pytest.approx(1.0)]
+
+
+def test_bucket_refills_while_idle_up_to_capacity(clock):
+    bucket = TokenBucket(rate_per_minute=120, burst=3)
+    for _ in range(3):
+        bucket.acquire()
+    clock["now"] += 60  # Jauh melebihi waktu isi ulang; token tetap dibatasi kapasitas
+    for _ in range(3):
+        bucket.acquire()
+    assert clock["slept"] == []
+    bucket.acquire()
+    assert clock["slept"] == [pytest.approx(0.5)]
+
+
+def test_fetch_cycle_takes_one_token_per_code():
+    class CountingLimiter:
+        calls = 0
+
+        def acquire(self):
+            self.calls += 1
+
+    limiter = CountingLimiter()
+    summary = bmkg_ratelimit.run_fetch_cycle(["a", "b", "c"], lambda code: code != "b", limiter=limiter, max_workers=2)
+    assert limiter.calls == 3
+    assert (summary["succeeded"], summary["failed"], summary["skipped"]) == (2, 1, 0)
+
+
+def test_async_bucket_paces_acquires_without_blocking_loop():
+    async def scenario():
+        bucket = AsyncTokenBucket(rate_per_minute=6000, burst=1)  # Satu token per 10 ms
+        ticks = []
+
+        async def ticker():
+            for _ in range(5):
+                ticks.append(time.monotonic())
+                await asyncio.sleep(0.002)
+
+        started = time.monotonic()
+        ticker_task = asyncio.ensure_future(ticker())
+        for _ in range(4):
+            await bucket.acquire()
+        elapsed = time.monotonic() - started
+        await ticker_task
+        return elapsed, ticks
+
+    elapsed, ticks = asyncio.run(scenario())
+    assert elapsed >= 0.025  # Token pertama dari burst, tiga sisanya menunggu isi ulang
+    assert len(ticks) == 5 and ticks[-1] - ticks[0] < elapsed
@@ -0,0 +1,71 @@
+from bmkg_sharding import HashRing, ShardMembership, shared_topic
+
+KEYS = [f"31.71.{district:02d}.{village:04d}" for district in range(1, 11) for village in range(1001, 1051)]
+
+
+class PresenceMessage:
+    def __init__(self, node_id, online=True):
+        self.topic = f"bmkg/nodes/group/{node_id}"
+        self.payload = b'{"node_id": "%s"}' % node_id.encode() if online else b""
+
+
+def test_every_key_has_exactly_one_owner_and_load_is_spread():
+    ring = HashRing(["node-a", "node-b", "node-c"])
+    owners = [ring.owner(key) for key in KEYS]
+    assert set(owners) == {"node-a", "node-b", "node-c"}
+    for node in ring.nodes:
+        assert owners.count(node) > len(KEYS) / 3 * 0.5  # Virtual node menjaga pembagian tidak timpang
+
+
+def test_adding_a_node_only_moves_keys_to_the_new_node():
+    before = HashRing(["node-a", "node-b", "node-c"])
+    after = HashRing(["node-a", "node-b", "node-c", "node-d"])
+    moved = [key for key in KEYS if before.owner(key) != after.owner(key)]
+    assert all(after.owner(key) == "node-d" for key in moved)
+    assert len(moved) < len(KEYS) / 2
+
+
+def test_empty_ring_has_no_owner():
+    assert HashRing().owner("31.71.01.1001") is None
+
+
+def test_membership_rebalances_on_join_and_leave():
+    changes = []
+    membership = ShardMembership(KEYS, group="group", node_id="node-a", on_change=lambda gained, lost: changes.append((gained, lost)))
+    assert membership.owned() == KEYS
+    membership._on_presence(None, None, PresenceMessage("node-a"))
+    membership._on_presence(None, None, PresenceMessage("node-b"))
+    owned = membership.owned()
+    assert 0 < len(owned) < len(KEYS)
+    assert changes[-1] == ([], sorted(set(KEYS) - set(owned)))
+    peer = ShardMembership(KEYS, group="group", node_id="node-b")
+    peer._on_presence(None, None, PresenceMessage("node-a"))
+    assert sorted(owned + peer.owned()) == sorted(KEYS)  # Dua node sepakat tanpa tumpang tindih
+    membership._on_presence(None, None, PresenceMessage("node-b", online=False))
+    assert membership.owned() == KEYS
+    assert membership.status()["rebalances"] == 2
+
+
+def test_own_empty_presence_does_not_remove_self():
+    membership = ShardMembership(KEYS, group="group", node_id="node-a")
+    membership._on_presence(None, None, PresenceMessage("node-a", online=False))
+    assert membership.owned() == KEYS
+
+
+def test_disabled_group_owns_everything_and_topics_are_unshared():
+    membership = ShardMembership(KEYS[:3], group="")
+    assert membership.owned() == KEYS[:3] and membership.wait_settled()
+    assert shared_topic("bmkg/weather/request", group="") == "bmkg/weather/request"
+    assert shared_topic("bmkg/weather/request", group="workers") == "$share/workers/bmkg/weather/request"
+
+
+def test_exactly_one_node_is_coordinator():
+    nodes = ["node-a", "node-b", "node-c"]
+    members = []
+    for node_id in nodes:
+        membership = ShardMembership(KEYS, group="group", node_id=node_id)
+        for peer in nodes:
+            membership._on_presence(None, None, PresenceMessage(peer))
+        members.append(membership)
+    assert sum(membership.is_coordinator() for membership in members) == 1
+    assert ShardMembership(KEYS, group="").is_coordinator()
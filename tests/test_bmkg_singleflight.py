@@ -0,0 +1,101 @@
+import threading
+
+import pytest
+
+from bmkg_singleflight import SingleFlight
+
+
+def _start_followers(flight, key, count, results):
+    def follower():
+        try:
+            results.append(flight.do(key, lambda: "follower ran", wait_timeout=5))
+        except Exception as e:
+            results.append(e)
+    threads = [threading.Thread(target=follower) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    return threads
+
+
+def _wait_for_followers(flight, count):
+    for _ in range(500):
+        if flight.coalesced == count:
+            return
+        threading.Event().wait(0.01)
+    raise AssertionError("followers never joined the in-flight call")
+
+
+def test_concurrent_callers_share_one_call():
+    flight = SingleFlight()
+    release = threading.Event()
+    calls = []
+
+    def fetch():
+        calls.append(1)
+        release.wait(5)
+        return {"adm4": "a"}
+
+    leader_result = []
+    leader = threading.Thread(target=lambda: leader_result.append(flight.do("a", fetch)))
+    leader.start()
+    while flight.in_flight() == 0:
+        threading.Event().wait(0.001)
+    results = []
+    threads = _start_followers(flight, "a", 3, results)
+    _wait_for_followers(flight, 3)
+    release.set()
+    for thread in threads + [leader]:
+        thread.join(5)
+    assert calls == [1]
+    assert leader_result == [{"adm4": "a"}] and results == [{"adm4": "a"}] * 3
+    assert flight.in_flight() == 0
+
+
+def test_error_is_shared_with_waiters():
+    flight = SingleFlight()
+    release = threading.Event()
+
+    def failing_fetch():
+        release.wait(5)
+        raise ConnectionError("BMKG down")
+
+    leader_error = []
+
+    def leader():
+        try:
+            flight.do("a", failing_fetch)
+        except ConnectionError as e:
+            leader_error.append(e)
+
+    leader_thread = threading.Thread(target=leader)
+    leader_thread.start()
+    while flight.in_flight() == 0:
+        threading.Event().wait(0.001)
+    results = []
+    threads = _start_followers(flight, "a", 2, results)
+    _wait_for_followers(flight, 2)
+    release.set()
+    for thread in threads + [leader_thread]:
+        thread.join(5)
+    assert len(leader_error) == 1
+    assert all(isinstance(result, ConnectionError) for result in results) and len(results) == 2
+
+
+def test_waiter_times_out_without_cancelling_leader():
+    flight = SingleFlight()
+    release = threading.Event()
+    leader = threading.Thread(target=lambda: flight.do("a", lambda: release.wait(5) and "done"))
+    leader.start()
+    while flight.in_flight() == 0:
+        threading.Event().wait(0.001)
+    with pytest.raises(TimeoutError):
+        flight.do("a", lambda: "unused", wait_timeout=0.01)
+    release.set()
+    leader.join(5)
+    assert flight.in_flight() == 0
+
+
+def test_new_call_after_completion_runs_again():
+    flight = SingleFlight()
+    assert flight.do("a", lambda: 1) == 1
+    assert flight.do("a", lambda: 2) == 2
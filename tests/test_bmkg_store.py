@@ -0,0 +1,67 @@
+import pytest
+
+from bmkg_store import NATIVE_RESOLUTION_SECONDS, ForecastStore, downsample
+
+
+def period(day, hour, t, hu=80, weather_desc="Cerah"):
+    return {"datetime": f"2026-10-{day:02d} {hour:02d}:00:00", "local_datetime": f"2026-10-{day:02d} {hour + 7:02d}:00:00",
+            "t": t, "hu": hu, "ws": 5, "weather_desc": weather_desc}
+
+
+def three_hourly(day, temps):
+    return [period(day, 3 * index, t) for index, t in enumerate(temps)]
+
+
+def test_downsample_keeps_native_resolution_when_under_limit():
+    records = three_hourly(17, [24, 26, 30])
+    points, bucket_seconds = downsample(records, max_points=10)
+    assert bucket_seconds == NATIVE_RESOLUTION_SECONDS
+    assert [point["t"] for point in points] == [24, 26, 30]
+    assert all(point["n"] == 1 for point in points)
+
+
+def test_downsample_averages_equal_width_buckets():
+    records = three_hourly(17, [24, 26, 30, 32, 28, 26, 25, 24])  # Satu hari, 8 periode
+    points, bucket_seconds = downsample(records, max_points=3)
+    assert bucket_seconds == 3 * NATIVE_RESOLUTION_SECONDS
+    assert [point["n"] for point in points] == [3, 3, 2]
+    assert [point["t"] for point in points] == [26.7, 28.7, 24.5]
+    assert points[0]["datetime"] == records[0]["datetime"]
+
+
+def test_downsample_picks_most_common_description_and_skips_missing_values():
+    records = [period(17, 0, 24, weather_desc="Hujan"), period(17, 3, None, hu=None, weather_desc="Cerah"),
+               period(17, 6, 30, weather_desc="Hujan")]
+    points, _ = downsample(records, max_points=1)
+    assert points == [{"datetime": records[0]["datetime"], "local_datetime": records[0]["local_datetime"], "n": 3,
+                       "t": 27.0, "hu": 80.0, "ws": 5.0, "weather_desc": "Hujan"}]
+
+
+def test_downsample_ignores_records_without_valid_datetime():
+    assert downsample([{"datetime": "kemarin", "t": 30}], max_points=5) == ([], NATIVE_RESOLUTION_SECONDS)
+
+
+@pytest.fixture
+def store(tmp_path):
+    return ForecastStore(str(tmp_path / "forecasts.sqlite3"), retention_days=36500)
+
+
+def test_latest_returns_only_last_fetch_while_history_keeps_past_periods(store):
+    location = {"adm4": "31.71.01.1001", "desa": "Gambir"}
+    store.save("31.71.01.1001", {"location": location, "forecasts": three_hourly(16, [25, 27])}, {"ETag": '"a"'})
+    store.save("31.71.01.1001", {"location": location, "forecasts": three_hourly(17, [24, 26])}, {"ETag": '"b"'})
+    latest = store.latest("31.71.01.1001")
+    assert latest.data == {"location": location, "forecasts": three_hourly(17, [24, 26])}
+    assert latest.etag == '"b"'
+    assert [record["t"] for record in store.history("31.71.01.1001")] == [25, 27, 24, 26]
+    assert [record["t"] for record in store.history("31.71.01.1001", since="2026-10-17 00:00:00")] == [24, 26]
+    assert store.latest("31.71.01.1002") is None
+
+
+def test_touch_updates_fetch_time_and_keeps_validators(store):
+    store.save("31.71.01.1001", {"location": {}, "forecasts": three_hourly(17, [24])}, {"ETag": '"a"'}, fetched_at=1.0)
+    store.touch("31.71.01.1001", {"Last-Modified": "Sat, 17 Oct 2026 00:00:00 GMT"})
+    latest = store.latest("31.71.01.1001")
+    assert latest.fetched_at > 1.0
+    assert (latest.etag, latest.last_modified) == ('"a"', "Sat, 17 Oct 2026 00:00:00 GMT")
+    assert store.stats()["regions"] == 1 and store.stats()["forecast_periods"] == 1
@@ -0,0 +1,6 @@
+import sync_bmkg_modules
+
+
+def test_vendored_copies_match_root_modules():
+    # Gagal jika salinan di BismillahFiks/* diedit langsung atau lupa disinkronkan
+    assert sync_bmkg_modules.stale_copies() == []
@@ -14,6 +14,9 @@ from datetime import datetime
 from dotenv import load_dotenv
 import yaml
 from yaml.loader import SafeLoader
+import logging
+import threading
+import hmac
 
 # -----------------------------------------------------------------------------
 # 1. Konfigurasi Halaman Streamlit (HARUS PALING ATAS)
@@ -25,6 +28,10 @@ st.set_page_config(page_title="Info Cuaca MQTT (Plain Auth)", layout="wide", ini
 # -----------------------------------------------------------------------------
 load_dotenv()
 
+# Log ke stderr dengan level dari LOG_LEVEL; basicConfig tidak memasang handler ulang saat rerun Streamlit
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO").upper(), format="%(asctime)s %(levelname)-7s %(name)s: %(message)s")
+log = logging.getLogger("bmkg.dashboard")
+
 # Konfigurasi MQTT dari .env atau default
 MQTT_BROKER_HOST = os.getenv("MQTT_BROKER_HOST", "localhost")
 MQTT_BROKER_PORT_MQTT = int(os.getenv("MQTT_BROKER_PORT_MQTT", 1883))
@@ -33,6 +40,12 @@ MQTT_USERNAME_STREAMLIT = os.getenv("MQTT_STREAMLIT_USERNAME") # Untuk koneksi M
 MQTT_PASSWORD_STREAMLIT = os.getenv("MQTT_STREAMLIT_PASSWORD") # Untuk koneksi MQTT, bukan auth UI
 CA_CERT_PATH = os.getenv("CA_CERT_PATH", "C:/mosquitto_certs/ca.crt")
 USE_MQTTS_STREAMLIT = os.getenv("USE_MQTTS_STREAMLIT", "true").lower() == "true"
+CLIENT_RESPONSE_BASE = "streamlit_app/res" # Response topic sesi: <base>/<session_id>
+# Data baru didorong ke UI lewat fragment yang di-refresh paling sering STREAMLIT_MAX_FPS kali per detik
+STREAMLIT_MAX_FPS = float(os.getenv("STREAMLIT_MAX_FPS", 2))
+STREAMLIT_REFRESH_SECONDS = 1 / max(STREAMLIT_MAX_FPS, 0.1)
+# Sesi yang tidak lagi terlihat (tab browser ditutup) selama ini dilepas dari koneksi bersama
+STREAMLIT_SESSION_IDLE_SECONDS = float(os.getenv("STREAMLIT_SESSION_IDLE_SECONDS", 600))
 
 # Muat konfigurasi pengguna dari credentials_plaintext.yaml
 try:
@@ -51,209 +64,292 @@ if config_users is None or not isinstance(config_users.get('credentials', {}).ge
 
 USER_CREDENTIALS = config_users['credentials']['usernames']
 
-# dashboard.py
-# ... (import dan konfigurasi awal) ...
-
 # -----------------------------------------------------------------------------
 # 3. Inisialisasi State Aplikasi Streamlit (PASTIKAN HANYA SEKALI PER SESI)
 # -----------------------------------------------------------------------------
 # Gunakan fungsi untuk memastikan inisialisasi hanya sekali
 def initialize_session_state():
-    print("[StreamlitApp MainThread] Memeriksa inisialisasi session state...")
+    log.debug("Memeriksa inisialisasi session state...")
     if 'session_initialized' not in st.session_state:
         st.session_state.logged_in = False
         st.session_state.username = ""
 
-        st.session_state.mqtt_client = None
-        st.session_state.mqtt_connected_flag = False # Flag yang diatur oleh callback
+        # Koneksi MQTT ada di get_mqtt_connection() (bersama); sesi hanya menyimpan id-nya
+        st.session_state.session_id = str(uuid.uuid4())
         
         # client_response_topic dibuat sekali dan disimpan
-        st.session_state.client_response_topic = f"streamlit_app/res/{uuid.uuid4()}"
-        print(f"[StreamlitApp MainThread] client_response_topic diinisialisasi: {st.session_state.client_response_topic}")
+        st.session_state.client_response_topic = f"{CLIENT_RESPONSE_BASE}/{st.session_state.session_id}"
+        log.info("client_response_topic diinisialisasi: %s", st.session_state.client_response_topic)
 
-        st.session_state.weather_data_subs = {}
+        st.session_state.rendered_data_version = None # Cursor ke data_version koneksi bersama; datanya tidak disalin ke sesi
         st.session_state.weather_data_req_res = {}
         st.session_state.pending_requests = {}
         st.session_state.current_subscribed_kw = None
         st.session_state.last_subscribe_qos = 1
         st.session_state.last_connect_attempt_time = 0 # Waktu upaya koneksi terakhir
+        st.session_state.last_connected_status = False # Status koneksi pada rerun penuh terakhir
         
         st.session_state.session_initialized = True
-        print("[StreamlitApp MainThread] Session state telah diinisialisasi.")
+        log.info("Session state telah diinisialisasi.")
     else:
-        print("[StreamlitApp MainThread] Session state sudah diinisialisasi sebelumnya.")
+        log.debug("Session state sudah diinisialisasi sebelumnya.")
 
 initialize_session_state() # Panggil fungsi inisialisasi
 
-# ... (USER_CREDENTIALS, verify_plaintext_password) ...
-
 # -----------------------------------------------------------------------------
-# 5. Fungsi dan Callback MQTT
+# 4. Verifikasi Login (password teks biasa dari credentials_plaintext.yaml)
 # -----------------------------------------------------------------------------
-def streamlit_on_connect(client, userdata, flags, rc, properties=None):
-    app_userdata = userdata if isinstance(userdata, dict) else {}
-    client_response_topic_from_userdata = app_userdata.get('client_response_topic')
-    current_kw_from_userdata = app_userdata.get('current_subscribed_kw')
-    last_qos_from_userdata = app_userdata.get('last_subscribe_qos', 1)
-
-    if rc == 0:
-        print(f"[StreamlitApp CB] Terhubung ke MQTT Broker (TLS: {USE_MQTTS_STREAMLIT})!")
-        st.session_state.mqtt_connected_flag = True # SET FLAG DARI CALLBACK
-
-        if client_response_topic_from_userdata:
-            client.subscribe(client_response_topic_from_userdata, qos=1)
-            print(f"[StreamlitApp CB] Subscribe ke response topic: {client_response_topic_from_userdata}")
-        else:
-            print("[StreamlitApp CB] WARNING: client_response_topic tidak tersedia di userdata saat on_connect.")
-            # Fallback jika userdata gagal (seharusnya tidak terjadi jika di-set benar)
-            if hasattr(st.session_state, 'client_response_topic'):
-                 client.subscribe(st.session_state.client_response_topic, qos=1)
-                 print(f"[StreamlitApp CB] Fallback: Subscribe ke response topic dari st.session_state: {st.session_state.client_response_topic}")
-
-
-        if current_kw_from_userdata:
-            topic_to_resubscribe = f"bmkg/prakiraan-cuaca/{current_kw_from_userdata}/#"
-            client.subscribe(topic_to_resubscribe, qos=last_qos_from_userdata)
-            print(f"[StreamlitApp CB] Re-subscribed ke {topic_to_resubscribe} (QoS {last_qos_from_userdata})")
-        
-        # Jangan panggil st.rerun() dari sini. Main thread akan menangani update UI.
-    else:
-        print(f"[StreamlitApp CB] Gagal terhubung ke MQTT, return code {rc} ({mqtt.connack_string(rc)})")
-        st.session_state.mqtt_connected_flag = False # SET FLAG DARI CALLBACK
-
-def streamlit_on_message(client, userdata, msg):
-    # ... (logika on_message tetap sama, JANGAN st.rerun() dari sini) ...
-    print(f"[StreamlitApp CB] Pesan diterima di topic {msg.topic}. Data disimpan ke session_state.")
-    payload_str = msg.payload.decode()
-    # proses payload_str dan update st.session_state.weather_data_subs atau req_res
-    # Tandai bahwa ada data baru jika perlu UI update segera di main thread
-    # st.session_state.new_mqtt_data_received = True
-
-def streamlit_on_disconnect(client, userdata, rc, properties=None):
-    print(f"[StreamlitApp CB] Terputus dari MQTT dengan result code {rc}")
-    st.session_state.mqtt_connected_flag = False # SET FLAG DARI CALLBACK
-    if rc != 0:
-        print("[StreamlitApp CB] Koneksi MQTT terputus secara tidak normal.")
-    # Jangan st.rerun() dari sini.
-
-def attempt_mqtt_connect():
-    # ... (logika membersihkan client lama) ...
-    if 'mqtt_client' in st.session_state and st.session_state.mqtt_client:
-        try:
-            st.session_state.mqtt_client.loop_stop(force=True)
-            if hasattr(st.session_state.mqtt_client, '_sock') and st.session_state.mqtt_client._sock is not None: # Cek apakah socket ada
-                 st.session_state.mqtt_client.disconnect()
-            print("[StreamlitApp] Client MQTT lama dibersihkan.")
-        except Exception as e:
-            print(f"[StreamlitApp] Error saat membersihkan client MQTT lama: {e}")
-
-    st.session_state.mqtt_client = None
-    # Jangan set mqtt_connected_flag di sini, biarkan callback yang mengaturnya
-
-    client_id = f"streamlit-app-{uuid.uuid4()}"
-    
-    current_app_userdata = {
-        'client_response_topic': st.session_state.client_response_topic, # Ini HARUS sudah diinisialisasi
-        'current_subscribed_kw': st.session_state.current_subscribed_kw,
-        'last_subscribe_qos': st.session_state.last_subscribe_qos
-    }
-    if not current_app_userdata['client_response_topic']:
-        print("FATAL ERROR di attempt_mqtt_connect: client_response_topic tidak ada di session_state!")
-        st.error("Kesalahan Internal: Konfigurasi MQTT tidak lengkap.")
+def verify_plaintext_password(username, password):
+    stored_password = USER_CREDENTIALS.get(username)
+    if stored_password is None:
         return False
+    # Nilai YAML bisa berupa angka (mis. 1234), jadi bandingkan sebagai string
+    return hmac.compare_digest(str(stored_password).encode(), str(password).encode())
 
-    client = mqtt.Client(CallbackAPIVersion.VERSION2, client_id=client_id, protocol=mqtt.MQTTv5)
-    client.user_data_set(current_app_userdata)
-
-    # ... (logika username/password dan TLS tetap sama) ...
-    if MQTT_USERNAME_STREAMLIT and MQTT_PASSWORD_STREAMLIT:
-        client.username_pw_set(MQTT_USERNAME_STREAMLIT, MQTT_PASSWORD_STREAMLIT)
-    if USE_MQTTS_STREAMLIT: # ... (konfigurasi TLS) ...
-        if not os.path.exists(CA_CERT_PATH):
-            st.error(f"Sertifikat CA tidak ditemukan di {CA_CERT_PATH}.")
-            return False
-        try:
-            client.tls_set(ca_certs=CA_CERT_PATH, cert_reqs=ssl.CERT_REQUIRED, tls_version=ssl.PROTOCOL_TLS_CLIENT)
-            client.tls_insecure_set(False)
+# -----------------------------------------------------------------------------
+# 5. Koneksi MQTT Bersama (satu per proses server, dipakai semua sesi)
+# -----------------------------------------------------------------------------
+# Callback paho berjalan di thread network tanpa konteks script Streamlit, jadi tidak boleh
+# menyentuh st.session_state. Koneksi bersama menyimpan state di objeknya sendiri; tiap sesi
+# hanya membaca dari sana. Filter topik di-refcount: broker di-subscribe saat sesi pertama
+# memintanya dan di-unsubscribe saat sesi terakhir melepasnya.
+class SharedMqttConnection:
+    def __init__(self, response_base):
+        self.response_base = response_base
+        self.lock = threading.Lock()
+        self.connected = False
+        self.session_filters = {}  # session_id -> (filter, qos)
+        self.filter_refs = {}  # filter -> set(session_id)
+        self.latest = {}  # topik -> payload string terakhir (dipakai bersama semua sesi)
+        self.data_version = 0  # Naik setiap ada payload data baru; fragment cukup membandingkan angka ini
+        self.responses = {}  # session_id -> {correlation_id: payload string}
+        self.last_seen = {}  # session_id -> time.monotonic() terakhir sesi terlihat (rerun atau fragment)
+        self.next_reap = time.monotonic() + 60
+        self.client = mqtt.Client(CallbackAPIVersion.VERSION2, client_id=f"streamlit-app-{uuid.uuid4()}", protocol=mqtt.MQTTv5)
+        self.client.on_connect = self.on_connect
+        self.client.on_message = self.on_message
+        self.client.on_disconnect = self.on_disconnect
+
+    def start(self):
+        if MQTT_USERNAME_STREAMLIT and MQTT_PASSWORD_STREAMLIT:
+            self.client.username_pw_set(MQTT_USERNAME_STREAMLIT, MQTT_PASSWORD_STREAMLIT)
+        if USE_MQTTS_STREAMLIT:
+            if not os.path.exists(CA_CERT_PATH):
+                raise ValueError(f"Sertifikat CA tidak ditemukan di {CA_CERT_PATH}.")
+            self.client.tls_set(ca_certs=CA_CERT_PATH, cert_reqs=ssl.CERT_REQUIRED, tls_version=ssl.PROTOCOL_TLS_CLIENT)
+            self.client.tls_insecure_set(False)
             port_to_use = MQTT_BROKER_PORT_MQTTS
-        except Exception as e:
-            st.error(f"Error saat konfigurasi TLS: {e}")
-            return False
-    else:
-        port_to_use = MQTT_BROKER_PORT_MQTT
-
-
-    client.on_connect = streamlit_on_connect
-    client.on_message = streamlit_on_message
-    client.on_disconnect = streamlit_on_disconnect
+        else:
+            port_to_use = MQTT_BROKER_PORT_MQTT
+        log.info("Koneksi bersama: connect_async() ke %s:%s...", MQTT_BROKER_HOST, port_to_use)
+        # connect_async + loop_start: paho sendiri yang reconnect, tidak perlu client baru per percobaan
+        self.client.connect_async(MQTT_BROKER_HOST, port_to_use, 60)
+        self.client.loop_start()
+        return self
+
+    def on_connect(self, client, userdata, flags, reason_code, properties=None):
+        if reason_code.is_failure:
+            log.error("Gagal terhubung ke MQTT: %s", reason_code)
+            return
+        with self.lock:
+            self.connected = True
+            filters = [(topic_filter, max(qos for _, qos in (self.session_filters[sid] for sid in holders)))
+                       for topic_filter, holders in self.filter_refs.items()]
+        log.info("Terhubung ke MQTT Broker (TLS: %s)!", USE_MQTTS_STREAMLIT)
+        client.subscribe(f"{self.response_base}/#", qos=1)
+        if filters:
+            client.subscribe(filters)
+            log.info("Re-subscribed %s filter topik", len(filters))
+
+    def on_message(self, client, userdata, msg):
+        log.debug("Pesan diterima di topic %s.", msg.topic)
+        payload_str = msg.payload.decode()
+        with self.lock:
+            if msg.topic.startswith(f"{self.response_base}/"):
+                correlation_id = msg.properties.CorrelationData.decode() if hasattr(msg.properties, 'CorrelationData') else None
+                self.responses.setdefault(msg.topic[len(self.response_base) + 1:], {})[correlation_id] = payload_str
+            else:
+                self.latest[msg.topic] = payload_str
+                self.data_version += 1
+
+    def on_disconnect(self, client, userdata, disconnect_flags, reason_code, properties=None):
+        with self.lock:
+            self.connected = False
+        if reason_code.is_failure:
+            log.warning("Koneksi MQTT terputus secara tidak normal: %s", reason_code)
+        else:
+            log.info("Terputus dari MQTT: %s", reason_code)
+
+    def is_connected(self):
+        return self.connected and self.client.is_connected()
+
+    def subscribe_kw(self, session_id, kw, qos):
+        """Ganti langganan sesi ke bmkg/prakiraan-cuaca/<kw>/# (kw None = lepas langganan)."""
+        new = (f"bmkg/prakiraan-cuaca/{kw}/#", qos) if kw else None
+        with self.lock:
+            old = self.session_filters.pop(session_id, None)
+            if old == new:
+                if new: self.session_filters[session_id] = new
+                return
+            if old:
+                holders = self.filter_refs.get(old[0], set())
+                holders.discard(session_id)
+                if not holders:
+                    self.filter_refs.pop(old[0], None)
+                    for cached in [topic for topic in self.latest if mqtt.topic_matches_sub(old[0], topic)]:
+                        del self.latest[cached]
+                    if self.connected: self.client.unsubscribe(old[0])
+            if new:
+                self.session_filters[session_id] = new
+                holders = self.filter_refs.setdefault(new[0], set())
+                if self.connected and (not holders or qos > max(self.session_filters[sid][1] for sid in holders)):
+                    self.client.subscribe(new[0], qos=qos)
+                holders.add(session_id)
+
+    def touch(self, session_id):
+        """Tandai sesi masih hidup; True jika sesi baru atau sudah dilepas karena idle."""
+        now = time.monotonic()
+        with self.lock:
+            is_new = session_id not in self.last_seen
+            self.last_seen[session_id] = now
+            reap = now >= self.next_reap
+            if reap:
+                self.next_reap = now + 60
+        if reap:
+            self._reap_idle_sessions()
+        return is_new
+
+    def detach(self, session_id):
+        self.subscribe_kw(session_id, None, 1)
+        with self.lock:
+            self.last_seen.pop(session_id, None)
+            self.responses.pop(session_id, None)
+
+    def _reap_idle_sessions(self):
+        # Streamlit tidak memberi tahu saat tab ditutup; tanpa ini langganan dan respons sesi itu tersimpan selamanya
+        cutoff = time.monotonic() - STREAMLIT_SESSION_IDLE_SECONDS
+        with self.lock:
+            idle = [session_id for session_id, seen_at in self.last_seen.items() if seen_at < cutoff]
+        for session_id in idle:
+            log.info("Sesi %s idle selama %ss, langganannya dilepas", session_id[:8], STREAMLIT_SESSION_IDLE_SECONDS)
+            self.detach(session_id)
+
+    def data_for(self, session_id):
+        with self.lock:
+            topic_filter = self.session_filters.get(session_id, (None,))[0]
+            if not topic_filter:
+                return {}
+            return {topic: payload for topic, payload in self.latest.items() if mqtt.topic_matches_sub(topic_filter, topic)}
+
+    def pop_responses(self, session_id):
+        with self.lock:
+            return self.responses.pop(session_id, {})
+
+@st.cache_resource
+def get_mqtt_connection():
+    return SharedMqttConnection(CLIENT_RESPONSE_BASE).start()
 
+def attempt_mqtt_connect():
+    # st.cache_resource tidak menyimpan exception, jadi kegagalan setup dicoba lagi di rerun berikutnya
     try:
-        print(f"[StreamlitApp MainThread] Mencoba connect() ke {MQTT_BROKER_HOST}:{port_to_use}...")
-        client.connect(MQTT_BROKER_HOST, port_to_use, 60)
-        client.loop_start()
-        st.session_state.mqtt_client = client
-        print("[StreamlitApp MainThread] connect() dan loop_start() dipanggil. Menunggu callback...")
-        return True # Berhasil memulai upaya koneksi
+        return get_mqtt_connection()
     except Exception as e:
         st.error(f"Gagal memulai koneksi MQTT awal: {e}")
-        print(f"[StreamlitApp MainThread] Exception saat connect(): {e}")
-        st.session_state.mqtt_client = None
-        st.session_state.mqtt_connected_flag = False # Pastikan flag false jika error di sini
-        return False
+        log.error("Exception saat memulai koneksi bersama: %s", e)
+        return None
 
-# ... (display_weather_data) ...
+# -----------------------------------------------------------------------------
+# 6. Tampilan Data Cuaca
+# -----------------------------------------------------------------------------
+def format_forecast(forecast):
+    return (f"**{forecast.get('local_datetime', 'N/A')}** - {forecast.get('weather_desc', 'N/A')}, "
+            f"{forecast.get('t', 'N/A')}°C, kelembapan {forecast.get('hu', 'N/A')}%, "
+            f"angin {forecast.get('ws', 'N/A')} km/j dari {forecast.get('wd', 'N/A')}")
+
+def display_weather_data(weather_data):
+    kw = st.session_state.current_subscribed_kw
+    if not kw:
+        st.info("Belum berlangganan kode wilayah. Pilih kode wilayah di sidebar.")
+        return
+    st.subheader(f"Data Langganan: {kw}")
+    topic_terdekat = f"bmkg/prakiraan-cuaca/{kw}/terdekat"
+    topic_3harian = f"bmkg/prakiraan-cuaca/{kw}/3harian"
+    if topic_terdekat not in weather_data and topic_3harian not in weather_data:
+        st.info("Menunggu data dari publisher...")
+        return
+    try:
+        if topic_terdekat in weather_data:
+            st.markdown("Prakiraan terdekat: " + format_forecast(json.loads(weather_data[topic_terdekat])))
+        if topic_3harian in weather_data:
+            with st.expander("Prakiraan 3 harian"):
+                for forecast in json.loads(weather_data[topic_3harian]):
+                    st.markdown(format_forecast(forecast))
+    except (json.JSONDecodeError, TypeError, AttributeError) as e:
+        st.error(f"Data langganan untuk {kw} tidak valid: {e}")
+
+@st.fragment(run_every=STREAMLIT_REFRESH_SECONDS)
+def mqtt_status_watch(mqtt_connection):
+    # Cek ringan tanpa interaksi user: rerun penuh hanya jika status koneksi berubah atau ada respons
+    if mqtt_connection.touch(st.session_state.session_id):
+        st.rerun() # Sesi sempat dilepas karena idle: rerun penuh memasang langganannya lagi
+    responses = mqtt_connection.pop_responses(st.session_state.session_id)
+    for correlation_id, response_payload in responses.items():
+        st.session_state.weather_data_req_res[correlation_id] = response_payload
+        st.session_state.pending_requests.pop(correlation_id, None)
+    if responses or mqtt_connection.is_connected() != st.session_state.last_connected_status:
+        st.rerun()
+
+@st.fragment(run_every=STREAMLIT_REFRESH_SECONDS)
+def live_weather_panel(mqtt_connection):
+    # Hanya panel ini yang dijalankan ulang secara berkala, bukan seluruh halaman. Payload dibaca
+    # langsung dari latest-value store koneksi bersama; sesi hanya menyimpan versi yang terakhir dirender.
+    st.session_state.rendered_data_version = mqtt_connection.data_version
+    display_weather_data(mqtt_connection.data_for(st.session_state.session_id))
 
 # -----------------------------------------------------------------------------
 # 7. Logika Utama Aplikasi Streamlit
 # -----------------------------------------------------------------------------
 
 if not st.session_state.logged_in:
-    # ... (logika form login tetap sama) ...
+    st.title("🔐 Login Dashboard Cuaca")
+    with st.form("login_form"):
+        input_username = st.text_input("Username")
+        input_password = st.text_input("Password", type="password")
+        login_button = st.form_submit_button("Login")
     if login_button:
         if verify_plaintext_password(input_username, input_password):
             st.session_state.logged_in = True
             st.session_state.username = input_username
             st.success(f"Login berhasil sebagai {input_username}!")
             st.rerun() # Rerun untuk masuk ke blok 'else'
-        # ...
+        else:
+            st.error("Username atau password salah.")
 else: # Jika sudah login
-    # --- Mencoba koneksi MQTT jika belum terhubung atau client hilang ---
-    # Cek kondisi aktual koneksi client jika ada
-    is_client_really_connected = False
-    if st.session_state.mqtt_client and hasattr(st.session_state.mqtt_client, 'is_connected'):
-        try:
-            is_client_really_connected = st.session_state.mqtt_client.is_connected()
-        except Exception as e:
-            print(f"Error cek is_connected(): {e}")
-            is_client_really_connected = False # Anggap tidak konek jika error
-
-    # Kondisi untuk mencoba konek:
-    # 1. Belum ada client ATAU
-    # 2. Ada client tapi tidak konek (menurut is_connected()) ATAU
-    # 3. Ada client tapi flag dari callback bilang tidak konek
-    # DAN sudah lewat masa cooldown
-    should_try_connect = (
-        st.session_state.mqtt_client is None or
-        not is_client_really_connected or
-        not st.session_state.mqtt_connected_flag
-    )
-
-    if should_try_connect:
-        current_time = time.time()
-        if current_time - st.session_state.get('last_connect_attempt_time', 0) > 5: # Cooldown 5 detik
-            print("[StreamlitApp MainThread] Kondisi koneksi MQTT tidak optimal, mencoba koneksi/re-koneksi...")
-            attempt_mqtt_connect() # Fungsi ini sekarang hanya memulai upaya
-            st.session_state.last_connect_attempt_time = current_time
-            # Jangan rerun di sini, biarkan UI update berdasarkan flag di iterasi berikutnya
-            # Atau jika attempt_mqtt_connect() sendiri memicu error yang butuh rerun UI.
-            # Jika attempt_mqtt_connect() gagal (return False), UI akan menampilkan error dari sana.
+    # --- Koneksi MQTT bersama ---
+    # Dibuat sekali per proses; reconnect otomatis ditangani loop paho, jadi rerun sesi tidak
+    # lagi membuat client baru setiap kali status terlihat terputus.
+    mqtt_connection = attempt_mqtt_connect()
+    is_client_really_connected = mqtt_connection is not None and mqtt_connection.is_connected()
+    st.session_state.last_connected_status = is_client_really_connected
+    if mqtt_connection is not None:
+        mqtt_connection.touch(st.session_state.session_id)
+        mqtt_connection.subscribe_kw(st.session_state.session_id, st.session_state.current_subscribed_kw, st.session_state.last_subscribe_qos)
+        mqtt_status_watch(mqtt_connection)
 
     # --- Sidebar ---
     with st.sidebar:
-        # ... (logout) ...
+        st.markdown(f"Login sebagai **{st.session_state.username}**")
+        if st.button("Logout", key="logout_btn_plain"):
+            log.info("User %s logout.", st.session_state.username)
+            if mqtt_connection is not None:
+                mqtt_connection.detach(st.session_state.session_id)
+            st.session_state.logged_in = False
+            st.session_state.username = ""
+            st.session_state.current_subscribed_kw = None
+            st.rerun()
         # Tampilkan status berdasarkan flag dari callback, dan konfirmasi dengan is_connected()
         # Ini untuk mengatasi race condition antara callback dan UI update
-        final_connected_status = st.session_state.mqtt_connected_flag and is_client_really_connected
+        final_connected_status = is_client_really_connected
         
         status_color = "green" if final_connected_status else "red"
         status_text = "Terhubung" if final_connected_status else "Terputus"
@@ -261,17 +357,69 @@ else: # Jika sudah login
 
         if not final_connected_status:
             if st.button("Hubungkan Manual ke MQTT", key="reconnect_mqtt_btn_plain_manual_v2"):
-                print("[StreamlitApp MainThread] Tombol 'Hubungkan Manual ke MQTT' ditekan.")
-                attempt_mqtt_connect()
-                st.session_state.last_connect_attempt_time = time.time()
+                log.info("Tombol 'Hubungkan Manual ke MQTT' ditekan.")
+                current_time = time.time()
+                if mqtt_connection is not None and current_time - st.session_state.last_connect_attempt_time > 5: # Cooldown 5 detik
+                    try:
+                        mqtt_connection.client.reconnect() # Berlaku untuk koneksi bersama, bukan hanya sesi ini
+                    except Exception as e:
+                        log.error("reconnect() gagal: %s", e)
+                    st.session_state.last_connect_attempt_time = current_time
                 st.rerun() # Rerun untuk segera mencoba merefleksikan upaya koneksi
         
         if final_connected_status:
-            # ... (UI sidebar untuk QoS, Langganan) ...
+            st.subheader("Langganan Data Cuaca")
+            qos_options = [0, 1, 2]
+            selected_qos = st.selectbox("QoS Langganan", qos_options, index=qos_options.index(st.session_state.last_subscribe_qos))
+            input_kw = st.text_input("Kode Wilayah (adm4)", value=st.session_state.current_subscribed_kw or "").strip()
+            col_sub, col_unsub = st.columns(2)
+            # subscribe_kw() di awal setiap rerun menerapkan langganan dari session state
+            if col_sub.button("Subscribe", key="subscribe_btn_plain", disabled=not input_kw):
+                st.session_state.current_subscribed_kw = input_kw
+                st.session_state.last_subscribe_qos = selected_qos
+                st.session_state.rendered_data_version = None
+                st.rerun()
+            if col_unsub.button("Unsubscribe", key="unsubscribe_btn_plain", disabled=not st.session_state.current_subscribed_kw):
+                st.session_state.current_subscribed_kw = None
+                st.session_state.rendered_data_version = None
+                st.rerun()
     
     # --- Konten Utama Aplikasi ---
     st.title("☀️ Dashboard Cuaca Interaktif via MQTT 🛰️ (Auth Teks Biasa)")
     if final_connected_status:
-        # ... (UI utama untuk data cuaca reguler dan on-demand) ...
+        live_weather_panel(mqtt_connection)
+
+        # --- Permintaan on-demand (request/response MQTT v5) ---
+        st.subheader("Permintaan Data On-Demand")
+        request_kw = st.text_input("Kode Wilayah untuk permintaan", key="request_kw_input").strip()
+        if st.button("Minta Data Cuaca", key="request_btn_plain", disabled=not request_kw):
+            correlation_id = str(uuid.uuid4())
+            publish_properties = props.Properties(PacketTypes.PUBLISH)
+            publish_properties.ResponseTopic = st.session_state.client_response_topic
+            publish_properties.CorrelationData = correlation_id.encode()
+            result = mqtt_connection.client.publish(f"bmkg/req/cuaca/{request_kw}", payload="", qos=1, properties=publish_properties)
+            if result.rc == mqtt.MQTT_ERR_SUCCESS:
+                st.session_state.pending_requests[correlation_id] = {"kw": request_kw, "sent_at": datetime.now().strftime('%H:%M:%S')}
+                log.info("Permintaan on-demand %s untuk %s dikirim.", correlation_id, request_kw)
+            else:
+                st.error(f"Gagal mengirim permintaan untuk {request_kw} (rc={result.rc}).")
+
+        for correlation_id, pending in st.session_state.pending_requests.items():
+            st.caption(f"Menunggu respons untuk {pending['kw']} (dikirim {pending['sent_at']}, id {correlation_id[:8]})")
+
+        for correlation_id, response_payload in reversed(list(st.session_state.weather_data_req_res.items())):
+            try:
+                response = json.loads(response_payload)
+            except json.JSONDecodeError:
+                st.error(f"Respons {correlation_id[:8]} tidak valid.")
+                continue
+            if "error" in response:
+                st.error(f"Respons {correlation_id[:8]}: {response['error']}")
+                continue
+            location = response.get("location") or {}
+            location_name = ", ".join(str(location[key]) for key in ("desa", "kecamatan", "kotkab") if location.get(key)) or "N/A"
+            with st.expander(f"Respons {correlation_id[:8]}: {location_name}"):
+                for forecast in response.get("forecasts", []):
+                    st.markdown(format_forecast(forecast))
     else:
-        st.error("Koneksi ke MQTT Broker terputus atau belum berhasil. Fitur tidak tersedia. Coba hubungkan melalui sidebar.")
\ No newline at end of file
+        st.error("Koneksi ke MQTT Broker terputus atau belum berhasil. Fitur tidak tersedia. Coba hubungkan melalui sidebar.")